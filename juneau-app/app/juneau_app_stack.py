@@ -10,12 +10,13 @@ from aws_cdk import (
     aws_lambda as _lambda,
     aws_lambda_event_sources as lambda_event_sources,
     RemovalPolicy,
+    aws_s3 as s3,
     aws_secretsmanager as secretsmanager,
     aws_sns as sns,
     aws_sns_subscriptions as subs,
     aws_sqs as sqs,
 )
-from aws_cdk.aws_lambda_python_alpha import PythonFunction
+from aws_cdk.aws_lambda_python_alpha import PythonFunction, PythonLayerVersion
 from constructs import Construct
 from dotenv import load_dotenv
 
@@ -55,10 +56,42 @@ class JuneauAppStack(Stack):
         self.LOOP_SECRET_NAME = self.context.get("LOOP_SECRET_NAME")
         if not self.LOOP_SECRET_NAME:
             raise KeyError("Missing context value: LOOP_SECRET_NAME")
+
+        # Optional second model backend: failover, and hedging of slow Gemini calls
+        self.ANTHROPIC_SECRET_NAME = self.context.get("ANTHROPIC_SECRET_NAME")
         
 
         self.PROCESSING_SQS_NAME = self.context.get("PROCESSING_SQS_NAME", None)
+        # FIFO, so one recipient's messages (and the chunks of a streamed reply) arrive in order
         self.SENDING_LOOP_SQS_NAME = self.context.get("SENDING_LOOP_SQS_NAME", None)
+        if self.SENDING_LOOP_SQS_NAME and not self.SENDING_LOOP_SQS_NAME.endswith(".fifo"):
+            self.SENDING_LOOP_SQS_NAME += ".fifo"
+        self.STATUS_SQS_NAME = self.context.get("STATUS_SQS_NAME", None)
+        self.MAX_RECEIVE_COUNT = int(self.context.get("MAX_RECEIVE_COUNT", 3))  # deliveries before a record goes to its DLQ
+        self.PROCESSING_CONCURRENCY = int(self.context.get("PROCESSING_CONCURRENCY", 1))  # conversations processed in parallel per batch
+        self.SENDING_CONCURRENCY = int(self.context.get("SENDING_CONCURRENCY", 1))  # recipients sent to in parallel per batch
+        # Send replies bubble by bubble while generating, through the FIFO sending queue
+        self.STREAM_REPLIES = bool(self.context.get("STREAM_REPLIES", False))
+        self.METRICS_SAMPLE_RATE = float(self.context.get("METRICS_SAMPLE_RATE", 1))  # share of invocations that log EMF metrics
+        self.COALESCE_WINDOW_SECONDS = int(self.context.get("COALESCE_WINDOW_SECONDS", 0))  # wait this long to answer rapid-fire texts together
+        self.MODEL_TIMEOUT_SECONDS = int(self.context.get("MODEL_TIMEOUT_SECONDS", 20))  # deadline per model call
+        self.MODEL_HEDGING = bool(self.context.get("MODEL_HEDGING", True))  # start the second backend when Gemini is slow
+        self.HEDGE_PERCENTILE = float(self.context.get("HEDGE_PERCENTILE", 0.9))  # of recent Gemini latencies
+        self.MODEL_ROUTING = bool(self.context.get("MODEL_ROUTING", True))  # canned/light/standard tier per text
+        self.COMPACTION = bool(self.context.get("COMPACTION", True))  # summarise the oldest turns of long chats
+        self.TURN_ENCODING = self.context.get("TURN_ENCODING", "page")  # "page": exchanges stored as one compressed item
+        self.LONG_TERM_MEMORY = bool(self.context.get("LONG_TERM_MEMORY", True))  # recall snippets from a phone's earlier chats
+        # Memory (and with it CPU) per function; tools/power_sweep.py --write keeps these up to date
+        self.MEMORY_SIZES = self.context.get("MEMORY_SIZES", {})
+        # Functions restored from a primed snapshot on cold start instead of running init (see juneau_common.snapstart)
+        self.SNAPSTART = self.context.get("SNAPSTART", {})
+        self.WEBHOOK_CAPTURE = bool(self.context.get("WEBHOOK_CAPTURE", False))  # log sanitised webhooks for tools/replay.py
+        # "adapter": FastAPI + uvicorn image behind the Lambda web adapter, "native": plain handler for HTTP API v2 events
+        self.RECEIVING_HANDLER = self.context.get("RECEIVING_HANDLER", "adapter")
+        if self.RECEIVING_HANDLER not in ("adapter", "native"):
+            raise ValueError(f"Unknown RECEIVING_HANDLER: {self.RECEIVING_HANDLER}")
+        if self.SNAPSTART.get("receiving") and self.RECEIVING_HANDLER != "native":
+            raise ValueError("SnapStart needs the native receiving handler; container images don't support it")
         
         self.DOMAIN_NAME = os.environ.get("DOMAIN_NAME", None)
         self.SUBDOMAIN_NAME = os.environ.get("SUBDOMAIN_NAME", None)
@@ -99,6 +132,20 @@ class JuneauAppStack(Stack):
             billing=dynamo_billing,
             removal_policy=RemovalPolicy.DESTROY)
         
+        # One item per conversation turn, keyed by "<phone>#<chat_id>" and a time-ordered sequence
+        self.dynamo_turns = dynamodb.TableV2(
+            scope=self,
+            id=f"ConversationTurnsDB_Table",
+            table_name="ConversationTurns",
+            partition_key=dynamodb.Attribute(
+                name="conversation",
+                type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(
+                name="seq",
+                type=dynamodb.AttributeType.NUMBER),
+            billing=dynamo_billing,
+            removal_policy=RemovalPolicy.DESTROY)
+        
         self.dynamo_chat_counts = dynamodb.TableV2(
             scope=self,
             id=f"ChatCountsDB_Table",
@@ -109,29 +156,92 @@ class JuneauAppStack(Stack):
             billing=dynamo_billing,
             removal_policy=RemovalPolicy.DESTROY)
         
+        # Webhook ids already handled, claimed with a conditional put and expired by TTL
+        self.dynamo_dedupe = dynamodb.TableV2(
+            scope=self,
+            id=f"WebhookDedupeDB_Table",
+            table_name="WebhookDedupe",
+            partition_key=dynamodb.Attribute(
+                name="id",
+                type=dynamodb.AttributeType.STRING),
+            time_to_live_attribute="expires_at",
+            billing=dynamo_billing,
+            removal_policy=RemovalPolicy.DESTROY)
+        
+        # One NumPy index of embedded snippets per phone (see processing/lib/memory.py)
+        self.memory_bucket = s3.Bucket(
+            self,
+            "MemoryBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+        ) if self.LONG_TERM_MEMORY else None
+        
 
-        # RECEIVE LOOP MESSAGE LAMBDA
-        self.receive_loop_message_lambda = _lambda.DockerImageFunction(
+        # SHARED LAMBDA CODE
+        # juneau_common (AWS client registry, ...) is shipped as a layer to the zip based
+        # functions and copied into the receiving image, whose build context is app/services
+        self.common_layer = PythonLayerVersion(
             self,
-            "ReceiveLoopMessageFunction",
-            code=_lambda.DockerImageCode.from_image_asset(
-                "./app/services/loop_message/receiving"
-            ),
-            
-            memory_size=128,  # smallest available
-            timeout=Duration.seconds(20),
-            environment={
-                "ENVIRONMENT": environment,
-                "SQS_NAME": self.PROCESSING_SQS_NAME,
-                "LOOP_BEARER_TOKEN": self.LOOP_BEARER_TOKEN,
-            },
-            reserved_concurrent_executions=5,
-            architecture=_lambda.Architecture.ARM_64,
+            "JuneauCommonLayer",
+            entry="./app/services/common",
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
+            compatible_architectures=[_lambda.Architecture.ARM_64],
+            description="Shared helpers for the Juneau lambdas",
         )
+
+
+        # RECEIVE LOOP MESSAGE LAMBDA
+        receive_loop_message_environment = {
+            "ENVIRONMENT": environment,
+            "METRICS_SAMPLE_RATE": str(self.METRICS_SAMPLE_RATE),
+            "SQS_NAME": self.PROCESSING_SQS_NAME,
+            "LOOP_BEARER_TOKEN": self.LOOP_BEARER_TOKEN,
+        }
+        if self.STATUS_SQS_NAME:
+            receive_loop_message_environment["STATUS_SQS_NAME"] = self.STATUS_SQS_NAME
+        if self.WEBHOOK_CAPTURE:
+            receive_loop_message_environment["WEBHOOK_CAPTURE"] = "true"
+        if self.RECEIVING_HANDLER == "native":
+            self.receive_loop_message_lambda = PythonFunction(
+                self,
+                "ReceiveLoopMessageNativeFunction",
+                entry="./app/services/loop_message/receiving",
+                runtime=_lambda.Runtime.PYTHON_3_12,
+                index="webhook.py",
+                handler="lambda_handler",
+                memory_size=int(self.MEMORY_SIZES.get("receiving", 128)),
+                snap_start=self._snap_start("receiving"),
+                timeout=Duration.seconds(20),
+                environment=receive_loop_message_environment,
+                reserved_concurrent_executions=5,
+                architecture=_lambda.Architecture.ARM_64,
+                layers=[self.common_layer],
+            )
+        else:
+            self.receive_loop_message_lambda = _lambda.DockerImageFunction(
+                self,
+                "ReceiveLoopMessageFunction",
+                code=_lambda.DockerImageCode.from_image_asset(
+                    "./app/services",
+                    file="loop_message/receiving/Dockerfile",
+                    exclude=["processing"],
+                ),
+                
+                memory_size=int(self.MEMORY_SIZES.get("receiving", 128)),
+                timeout=Duration.seconds(20),
+                environment=receive_loop_message_environment,
+                reserved_concurrent_executions=5,
+                architecture=_lambda.Architecture.ARM_64,
+            )
+        
+        self.dynamo_dedupe.grant_read_write_data(self.receive_loop_message_lambda)
         
         self.receive_loop_message_lambda_integration = apigatewav2_integrations.HttpLambdaIntegration(
             "LoopWebhookIntegration",
-            self.receive_loop_message_lambda
+            self._invoked_version(self.receive_loop_message_lambda, "receiving"),
         )
         
         self.api.api.add_routes(
@@ -147,12 +257,25 @@ class JuneauAppStack(Stack):
         )
         
         # PROCESSING SQS
+        self.processing_dead_letter_queue = sqs.Queue(
+            self,
+            "ProcessingDeadLetterQueue",
+            queue_name=f"{self.PROCESSING_SQS_NAME}_dlq" if self.PROCESSING_SQS_NAME else None,
+            retention_period=Duration.days(14),
+        )
+        
         self.processing_message_queue = sqs.Queue(
             self,
             "ProcessingMessageQueue",
             queue_name=self.PROCESSING_SQS_NAME,
             retention_period=Duration.days(4),
-            visibility_timeout=Duration.minutes(5),
+            # 3x the function timeout, and short enough that a retried reply is re-queued for
+            # sending within the FIFO queue's 5 minute deduplication window
+            visibility_timeout=Duration.minutes(3),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=self.MAX_RECEIVE_COUNT,
+                queue=self.processing_dead_letter_queue,
+            ),
         )
         
         self.processing_message_queue.grant_send_messages(
@@ -166,6 +289,29 @@ class JuneauAppStack(Stack):
             secret_name=self.GEMINI_SECRET_NAME,
         )
         
+        processing_environment = {
+            "ENVIRONMENT": environment,
+            "METRICS_SAMPLE_RATE": str(self.METRICS_SAMPLE_RATE),
+            "SQS_NAME": self.SENDING_LOOP_SQS_NAME,
+            "GEMINI_SECRET_NAME": self.GEMINI_SECRET_NAME,
+            "PROCESSING_CONCURRENCY": str(self.PROCESSING_CONCURRENCY),
+            "STREAM_REPLIES": str(self.STREAM_REPLIES).lower(),
+            "MODEL_TIMEOUT_SECONDS": str(self.MODEL_TIMEOUT_SECONDS),
+            "MODEL_HEDGING": str(self.MODEL_HEDGING).lower(),
+            "HEDGE_PERCENTILE": str(self.HEDGE_PERCENTILE),
+            "MODEL_ROUTING": str(self.MODEL_ROUTING).lower(),
+            "TURN_ENCODING": self.TURN_ENCODING,
+        }
+        if self.ANTHROPIC_SECRET_NAME:
+            processing_environment["ANTHROPIC_SECRET_NAME"] = self.ANTHROPIC_SECRET_NAME
+        if self.COMPACTION:
+            # Compaction jobs go back through our own queue
+            processing_environment["COMPACTION_SQS_NAME"] = self.PROCESSING_SQS_NAME
+        if self.LONG_TERM_MEMORY:
+            # So do the jobs that memorise a chat once the phone starts a new one
+            processing_environment["MEMORY_BUCKET"] = self.memory_bucket.bucket_name
+            processing_environment["MEMORY_SQS_NAME"] = self.PROCESSING_SQS_NAME
+        
         self.processing_message_lambda = PythonFunction(
             self,
             "ProcessingMessageFunction",
@@ -173,38 +319,65 @@ class JuneauAppStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_12,
             index="lambda.py",
             handler="lambda_handler",
-            memory_size=128,
+            memory_size=int(self.MEMORY_SIZES.get("processing", 128)),
+            snap_start=self._snap_start("processing"),
             timeout=Duration.seconds(60),
-            environment={
-                "ENVIRONMENT": environment,
-                "SQS_NAME": self.SENDING_LOOP_SQS_NAME,
-                "GEMINI_SECRET_NAME": self.GEMINI_SECRET_NAME,
-            },
+            environment=processing_environment,
             reserved_concurrent_executions=5,
             architecture=_lambda.Architecture.ARM_64,
+            layers=[self.common_layer],
         )
         
         self.gemini_secret.grant_read(self.processing_message_lambda)
+        if self.ANTHROPIC_SECRET_NAME:
+            secretsmanager.Secret.from_secret_name_v2(
+                self,
+                "AnthropicSecret",
+                secret_name=self.ANTHROPIC_SECRET_NAME,
+            ).grant_read(self.processing_message_lambda)
         self.dynamo_contexts.grant_read_write_data(self.processing_message_lambda)
+        self.dynamo_turns.grant_read_write_data(self.processing_message_lambda)
         self.dynamo_chat_counts.grant_read_write_data(self.processing_message_lambda)
+        self.dynamo_dedupe.grant_read_write_data(self.processing_message_lambda)
         self.processing_message_queue.grant_consume_messages(
             self.processing_message_lambda
         )
+        if self.COMPACTION or self.LONG_TERM_MEMORY:
+            self.processing_message_queue.grant_send_messages(self.processing_message_lambda)
+        if self.LONG_TERM_MEMORY:
+            self.memory_bucket.grant_read_write(self.processing_message_lambda)
         
-        self.processing_message_lambda.add_event_source(
+        self._invoked_version(self.processing_message_lambda, "processing").add_event_source(
             lambda_event_sources.SqsEventSource(
                 self.processing_message_queue,
                 batch_size=5,
+                # Texts from one phone that land in the same batch are answered with one reply
+                max_batching_window=Duration.seconds(self.COALESCE_WINDOW_SECONDS) if self.COALESCE_WINDOW_SECONDS else None,
+                report_batch_item_failures=True,
             )
         )
         
         # SENDING SQS
+        self.sending_dead_letter_queue = sqs.Queue(
+            self,
+            "SendingLoopDeadLetterQueue",
+            queue_name=self.SENDING_LOOP_SQS_NAME.replace(".fifo", "_dlq.fifo") if self.SENDING_LOOP_SQS_NAME else None,
+            retention_period=Duration.days(14),
+            fifo=True,  # a FIFO queue's DLQ must be FIFO too
+        )
+        
         self.sending_loop_message_queue = sqs.Queue(
             self,
             "SendingLoopMessageQueue",
             queue_name=self.SENDING_LOOP_SQS_NAME,
             retention_period=Duration.days(4),
             visibility_timeout=Duration.minutes(5),
+            # Grouped by recipient; processing sets a deduplication id per reply (or chunk of one)
+            fifo=True,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=self.MAX_RECEIVE_COUNT,
+                queue=self.sending_dead_letter_queue,
+            ),
         )
         
         self.sending_loop_message_queue.grant_send_messages(
@@ -225,14 +398,18 @@ class JuneauAppStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_12,
             index="lambda.py",
             handler="lambda_handler",
-            memory_size=128,
+            memory_size=int(self.MEMORY_SIZES.get("sending", 128)),
+            snap_start=self._snap_start("sending"),
             timeout=Duration.seconds(20),
             environment={
                 "ENVIRONMENT": environment,
+                "METRICS_SAMPLE_RATE": str(self.METRICS_SAMPLE_RATE),
                 "LOOP_SECRET_NAME": self.LOOP_SECRET_NAME,
+                "SENDING_CONCURRENCY": str(self.SENDING_CONCURRENCY),
             },
             reserved_concurrent_executions=5,
             architecture=_lambda.Architecture.ARM_64,
+            layers=[self.common_layer],
         )
         
         self.loop_secret.grant_read(self.sending_loop_message_lambda)
@@ -241,10 +418,82 @@ class JuneauAppStack(Stack):
             self.sending_loop_message_lambda
         )
         
-        self.sending_loop_message_lambda.add_event_source(
+        self._invoked_version(self.sending_loop_message_lambda, "sending").add_event_source(
             lambda_event_sources.SqsEventSource(
                 self.sending_loop_message_queue,
                 batch_size=5,
+                report_batch_item_failures=True,
             )
         )
-        
\ No newline at end of file
+        
+        # STATUS SQS
+        # Delivery statuses and reactions, kept off the LLM lane's reserved concurrency
+        self.status_dead_letter_queue = sqs.Queue(
+            self,
+            "StatusDeadLetterQueue",
+            queue_name=f"{self.STATUS_SQS_NAME}_dlq" if self.STATUS_SQS_NAME else None,
+            retention_period=Duration.days(14),
+        )
+        
+        self.status_message_queue = sqs.Queue(
+            self,
+            "StatusMessageQueue",
+            queue_name=self.STATUS_SQS_NAME,
+            retention_period=Duration.days(1),
+            visibility_timeout=Duration.minutes(1),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=self.MAX_RECEIVE_COUNT,
+                queue=self.status_dead_letter_queue,
+            ),
+        )
+        
+        self.status_message_queue.grant_send_messages(
+            self.receive_loop_message_lambda
+        )
+        
+        # STATUS LAMBDA
+        self.status_message_lambda = PythonFunction(
+            self,
+            "StatusMessageFunction",
+            entry="./app/services/loop_message/status",
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            index="lambda.py",
+            handler="lambda_handler",
+            memory_size=int(self.MEMORY_SIZES.get("status", 128)),
+            snap_start=self._snap_start("status"),
+            timeout=Duration.seconds(10),
+            environment={
+                "ENVIRONMENT": environment,
+                "METRICS_SAMPLE_RATE": str(self.METRICS_SAMPLE_RATE),
+            },
+            reserved_concurrent_executions=1,
+            architecture=_lambda.Architecture.ARM_64,
+            layers=[self.common_layer],
+        )
+        
+        self.status_message_queue.grant_consume_messages(
+            self.status_message_lambda
+        )
+        
+        self._invoked_version(self.status_message_lambda, "status").add_event_source(
+            lambda_event_sources.SqsEventSource(
+                self.status_message_queue,
+                batch_size=10,
+                max_batching_window=Duration.seconds(10),  # nobody is waiting on these
+                report_batch_item_failures=True,
+            )
+        )
+
+    def _snap_start(self, function_key: str):
+        if self.SNAPSTART.get(function_key):
+            return _lambda.SnapStartConf.ON_PUBLISHED_VERSIONS
+        return None
+
+    def _invoked_version(self, function: _lambda.Function, function_key: str) -> _lambda.IFunction:
+        """
+        What the function's trigger should invoke: SnapStart only restores published
+        versions, so with it on that is a `live` alias of the current version.
+        """
+        if self.SNAPSTART.get(function_key):
+            return function.add_alias("live")
+        return function
@@ -0,0 +1,135 @@
+"""
+Per-container registry of AWS clients, DynamoDB tables and SQS queue URLs.
+
+Everything is created on first use and kept in module scope, so warm invocations
+of a Lambda reuse the same clients (and their pooled HTTPS connections) instead of
+paying for client setup and a `get_queue_url` round trip on every message.
+
+Low-level clients are thread-safe and shared; boto3 resources (and the `Table`
+objects built from them) are not, so those are cached per thread. Every API call
+made through them is timed by `juneau_common.metrics`.
+"""
+
+import os
+import threading
+
+from juneau_common.metrics import metrics
+
+MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "10"))
+
+_lock = threading.RLock()
+_session = None
+_config = None
+_loader = None  # parsed service models; survive reset() since they hold no credentials or connections
+_clients = {}
+_queue_urls = {}
+_local = threading.local()
+_generation = 0  # bumped by reset() so threads rebuild their resources
+
+
+def session():
+    """The shared boto3 session; boto3 itself is only imported on first use."""
+    global _session, _config, _loader
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import boto3
+                import botocore.session
+                from botocore.config import Config
+
+                _config = Config(
+                    max_pool_connections=MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    retries={"max_attempts": 3, "mode": "standard"},
+                )
+                core = botocore.session.get_session()
+                if _loader is None:
+                    _loader = core.get_component("data_loader")
+                else:
+                    core.register_component("data_loader", _loader)
+                _session = boto3.session.Session(botocore_session=core)
+                metrics.instrument(_session)
+    return _session
+
+
+def client(service_name: str):
+    """Return the shared low-level client for `service_name`."""
+    cached = _clients.get(service_name)
+    if cached is not None:
+        return cached
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = session().client(service_name, config=_config)
+        return _clients[service_name]
+
+
+def _thread_cache() -> dict:
+    if getattr(_local, "generation", None) != _generation:
+        _local.generation = _generation
+        _local.resources = {}
+        _local.tables = {}
+    return _local.__dict__
+
+
+def resource(service_name: str):
+    """Return this thread's resource for `service_name` (e.g. dynamodb)."""
+    resources = _thread_cache()["resources"]
+    if service_name not in resources:
+        with _lock:  # creating resources from a shared session is not thread-safe
+            resources[service_name] = session().resource(service_name, config=_config)
+    return resources[service_name]
+
+
+def table(table_name: str):
+    """Return this thread's cached DynamoDB `Table` object."""
+    tables = _thread_cache()["tables"]
+    if table_name not in tables:
+        tables[table_name] = resource("dynamodb").Table(table_name)
+    return tables[table_name]
+
+
+def queue_url(queue_name: str) -> str:
+    """Resolve an SQS queue URL once per container."""
+    cached = _queue_urls.get(queue_name)
+    if cached is not None:
+        return cached
+    url = client("sqs").get_queue_url(QueueName=queue_name).get("QueueUrl")
+    if not url:
+        raise ValueError(f"Could not resolve SQS queue URL for {queue_name}")
+    _queue_urls[queue_name] = url
+    return url
+
+
+def invalidate_queue_url(queue_name: str = None):
+    """Forget cached queue URLs, e.g. after a queue has been recreated."""
+    with _lock:
+        if queue_name is None:
+            _queue_urls.clear()
+        else:
+            _queue_urls.pop(queue_name, None)
+
+
+def send_to_queue(queue_name: str, **kwargs):
+    """
+    `sqs.send_message` against a cached queue URL. If the queue no longer exists
+    under that URL, the cache entry is dropped and the send is retried once.
+    """
+    sqs_client = client("sqs")
+    try:
+        return sqs_client.send_message(QueueUrl=queue_url(queue_name), **kwargs)
+    except sqs_client.exceptions.QueueDoesNotExist:
+        invalidate_queue_url(queue_name)
+        return sqs_client.send_message(QueueUrl=queue_url(queue_name), **kwargs)
+
+
+def reset():
+    """
+    Drop every cached client, table and queue URL, and the session with its
+    credentials. Service models already loaded are kept, so rebuilding is cheap.
+    """
+    global _session, _generation
+    with _lock:
+        _session = None
+        _generation += 1
+        _clients.clear()
+        _queue_urls.clear()
@@ -0,0 +1,117 @@
+"""
+Helpers for SQS triggered lambdas that report partial batch failures.
+
+With `ReportBatchItemFailures` enabled on the event source, only the records listed
+under `batchItemFailures` are made visible again; everything else is deleted.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from juneau_common.metrics import metrics
+
+
+@dataclass
+class BatchResult:
+    outcomes: Dict[str, Any] = field(default_factory=dict)
+    failures: List[str] = field(default_factory=list)
+
+    def response(self) -> Dict[str, Any]:
+        return {
+            "batchItemFailures": [{"itemIdentifier": message_id} for message_id in self.failures]
+        }
+
+
+# Kept in module scope so worker threads (and their thread-local clients) survive warm invocations
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch")
+            _executor_workers = max_workers
+        return _executor
+
+
+def group_records(records: List[dict], key: Optional[Callable[[dict], Any]]) -> List[List[dict]]:
+    """Split records into ordered groups that share `key(record)`, keeping arrival order."""
+    if key is None:
+        return [[record] for record in records]
+    groups: Dict[Any, List[dict]] = {}
+    for record in records:
+        try:
+            group_key = key(record)
+        except Exception:
+            group_key = None
+        if group_key is None:  # records without a key don't need ordering with anything else
+            group_key = ("messageId", record.get("messageId"))
+        groups.setdefault(group_key, []).append(record)
+    return list(groups.values())
+
+
+def _run_group(group: List[dict], handle: Callable[[Any], Any], result: BatchResult,
+               coalesce: Optional[Callable[[List[dict]], List[List[dict]]]]):
+    units = coalesce(group) if coalesce else [[record] for record in group]
+    for index, unit in enumerate(units):
+        unit_ids = [record.get("messageId") for record in unit]
+        try:
+            outcome = handle(unit) if coalesce else handle(unit[0])
+            for message_id in unit_ids:
+                result.outcomes[message_id] = outcome
+        except Exception as e:
+            logging.exception(f"Failed to process records {unit_ids}: {str(e)}")
+            for message_id in unit_ids:
+                result.outcomes[message_id] = {"success": False, "error": str(e)}
+                result.failures.append(message_id)
+            # Later records in the group must not overtake the failed ones, so retry them too
+            for skipped in (record for later in units[index + 1:] for record in later):
+                skipped_id = skipped.get("messageId")
+                result.outcomes[skipped_id] = {"success": False, "error": f"Skipped after {unit_ids[-1]} failed"}
+                result.failures.append(skipped_id)
+            return
+
+
+def process_batch(records: List[dict],
+                  handle: Callable[[Any], Any],
+                  key: Optional[Callable[[dict], Any]] = None,
+                  max_workers: int = 1,
+                  coalesce: Optional[Callable[[List[dict]], List[List[dict]]]] = None) -> BatchResult:
+    """
+    Run `handle(record)` for every record, isolating failures so one bad record does
+    not cause the whole batch to be redelivered.
+
+    If `key` is given, records sharing a key (e.g. the same recipient) run in order on
+    one worker while different keys run concurrently on up to `max_workers` threads.
+
+    If `coalesce` is given, it splits each ordered group into consecutive units and
+    `handle(records)` is called once per unit; a unit succeeds or fails as a whole.
+    """
+    result = BatchResult()
+    for record in records:
+        metrics.record_queue_age(record)
+    groups = group_records(records, key)
+
+    if max_workers <= 1 or len(groups) <= 1:
+        for group in groups:
+            _run_group(group, handle, result, coalesce)
+    else:
+        executor = _get_executor(max_workers)
+        futures = [executor.submit(_run_group, group, handle, result, coalesce) for group in groups]
+        for future in futures:
+            future.result()
+
+    # Keep the failure list in batch order regardless of which worker finished first
+    order = {record.get("messageId"): position for position, record in enumerate(records)}
+    result.failures.sort(key=lambda message_id: order.get(message_id, len(order)))
+    metrics.count("Records", len(records))
+    metrics.count("RecordFailures", len(result.failures))
+    return result
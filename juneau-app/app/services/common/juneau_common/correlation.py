@@ -0,0 +1,116 @@
+"""
+Correlation envelope that follows a message from the webhook to the Loop send.
+
+The envelope reuses Loop's `message_id` as the correlation id and records when the
+webhook was received plus, for every queue it passes through, when it was enqueued
+and dequeued. It travels in a `Correlation` SQS message attribute, so payloads are
+untouched, and the sender hands it to Loop as `passthrough` so the `message_sent`
+status webhook can be tied back to the original message.
+
+While a record is being handled its envelope is bound to the worker thread, so code
+further down (e.g. queueing the reply) picks it up without threading it through
+every call.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from juneau_common.metrics import metrics
+
+ATTRIBUTE = "Correlation"
+
+_local = threading.local()
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def start(message_id: Optional[str] = None) -> Dict[str, Any]:
+    """A new envelope for a webhook received just now."""
+    return {"id": message_id or uuid.uuid4().hex, "received": now_ms(), "hops": []}
+
+
+def attributes(envelope: Optional[Dict[str, Any]], stage: str) -> Dict[str, Any]:
+    """SQS `MessageAttributes` for sending the envelope on to `stage`'s queue."""
+    if envelope is None:
+        return {}
+    forwarded = dict(envelope, hops=envelope["hops"] + [{"stage": stage, "enqueued": now_ms()}])
+    return {ATTRIBUTE: {"DataType": "String", "StringValue": json.dumps(forwarded, separators=(",", ":"))}}
+
+
+def from_record(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The envelope carried by an SQS record, with its last hop marked as dequeued now."""
+    attribute = (record.get("messageAttributes") or {}).get(ATTRIBUTE) or {}
+    value = attribute.get("stringValue")
+    if not value:
+        return None
+    try:
+        envelope = json.loads(value)
+    except ValueError:
+        logging.warning(f"Ignoring malformed correlation attribute on {record.get('messageId')}")
+        return None
+    if envelope.get("hops"):
+        envelope["hops"][-1].setdefault("dequeued", now_ms())
+    return envelope
+
+
+def passthrough(envelope: Dict[str, Any]) -> str:
+    """What Loop echoes back in its status webhooks for the message we send."""
+    return json.dumps({"correlation_id": envelope["id"], "received": envelope["received"], "sent": now_ms()},
+                      separators=(",", ":"))
+
+
+def from_passthrough(value: Optional[str]) -> Optional[Dict[str, Any]]:
+    try:
+        parsed = json.loads(value) if value else None
+    except ValueError:
+        return None  # passthrough set by someone else
+    return parsed if isinstance(parsed, dict) and "correlation_id" in parsed else None
+
+
+@contextmanager
+def bound(envelope: Optional[Dict[str, Any]]):
+    """Make `envelope` the current one for this thread while the block runs."""
+    previous = getattr(_local, "envelope", None)
+    _local.envelope = envelope
+    try:
+        yield envelope
+    finally:
+        _local.envelope = previous
+
+
+def current() -> Optional[Dict[str, Any]]:
+    return getattr(_local, "envelope", None)
+
+
+def log(envelope: Optional[Dict[str, Any]], message: str):
+    correlation_id = envelope["id"] if envelope else "-"
+    logging.info(f"[{correlation_id}] {message}")
+
+
+def record_latency(envelope: Optional[Dict[str, Any]], finished: Optional[int] = None):
+    """
+    Emit the webhook-to-now latency and its breakdown: the time spent in each stage
+    ("Latency.Receiving", "Latency.Processing", ...) and waiting in each queue
+    ("Latency.ProcessingQueue", ...).
+    """
+    if not envelope:
+        return
+    finished = finished or now_ms()
+    stage, mark = "Receiving", envelope["received"]
+    for hop in envelope["hops"]:
+        name = hop["stage"].capitalize()
+        enqueued = hop.get("enqueued", mark)
+        dequeued = hop.get("dequeued", enqueued)
+        metrics.put(f"Latency.{stage}", enqueued - mark)
+        metrics.put(f"Latency.{name}Queue", dequeued - enqueued)
+        stage, mark = name, dequeued
+    metrics.put(f"Latency.{stage}", finished - mark)
+    metrics.put("Latency.Total", finished - envelope["received"])
+    log(envelope, f"Total latency {finished - envelope['received']} ms")
@@ -0,0 +1,146 @@
+"""
+Drop duplicate webhooks before they cost a model call or a second iMessage.
+
+Loop retries webhooks and SQS delivers at least once, so the same payload can reach
+us several times. Each stage claims a payload's key with a conditional PutItem on the
+`WebhookDedupe` table; only the first claim wins and the item expires through the
+table's TTL. A per-container LRU of keys already completed here answers most repeats
+without a round trip.
+
+A claim is a pending lease that is completed or released once the work has finished
+or failed (or, for work with nothing to lose, written as done right away). A lease
+left behind by a crashed or timed out attempt can be re-claimed after it runs out, so
+redeliveries are not lost. Each caller sizes the lease to how long its work may take.
+
+Write cost per inbound text: the receiving edge writes only its short lease (a claim,
+then `remember` locally instead of completing it), and processing writes a claim and a
+complete, so three writes in all, plus a delete for each failed attempt. The edge
+lease only stops Loop retries that arrive while the first delivery is being enqueued;
+later copies reach processing, whose completed claim drops them.
+
+DynamoDB errors other than a lost claim fail open: a rare duplicate is better than a
+dropped message.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from juneau_common import aws
+
+DEDUPE_TABLE = os.getenv("DEDUPE_TABLE", "WebhookDedupe")
+DEDUPE_TTL_SECONDS = int(os.getenv("DEDUPE_TTL_SECONDS", str(24 * 60 * 60)))  # Loop stops retrying well within a day
+# Must run out before SQS redelivers (the queues' visibility timeout), or the redelivery is
+# mistaken for a duplicate and the message is lost; callers pass a lease sized to their timeout
+DEDUPE_LEASE_SECONDS = int(os.getenv("DEDUPE_LEASE_SECONDS", "90"))
+DEDUPE_CACHE_SIZE = int(os.getenv("DEDUPE_CACHE_SIZE", "4096"))  # keys remembered per container
+
+PENDING = "pending"
+DONE = "done"
+
+
+def payload_key(payload: Dict[str, Any]) -> Optional[str]:
+    """
+    The identity of a webhook. Loop sends several alerts per message (inbound, sent,
+    delivered, ...), so the message_id is qualified with the alert type; the webhook_id
+    is the fallback for alerts without a message.
+    """
+    message_id = payload.get("message_id")
+    if message_id:
+        return f"{payload.get('alert_type', 'unknown')}:{message_id}"
+    webhook_id = payload.get("webhook_id")
+    if webhook_id:
+        return f"webhook:{webhook_id}"
+    return None
+
+
+class Deduplicator:
+    def __init__(self, table_name: str = DEDUPE_TABLE,
+                 ttl: int = DEDUPE_TTL_SECONDS,
+                 lease: int = DEDUPE_LEASE_SECONDS,
+                 cache_size: int = DEDUPE_CACHE_SIZE):
+        self.table_name = table_name
+        self.ttl = ttl
+        self.lease = lease
+        self.cache_size = cache_size
+        self._seen = OrderedDict()  # key -> None, oldest first
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, done: bool = False, lease: Optional[int] = None) -> bool:
+        """
+        True if the caller should handle `key`, False if it is a duplicate. Unless
+        `done`, the claim is a lease of `lease` seconds (default: the instance's).
+        """
+        if self._recently_seen(key):
+            return False
+        now = int(time.time())
+        table = aws.table(self.table_name)
+        item = {"id": key, "status": DONE if done else PENDING, "expires_at": now + self.ttl}
+        if not done:
+            item["lease_until"] = now + (self.lease if lease is None else lease)
+        try:
+            table.put_item(
+                Item=item,
+                ConditionExpression="attribute_not_exists(id) OR (#status = :pending AND lease_until < :now)",
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={":pending": PENDING, ":now": now},
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            # Not remembered locally: a pending claim may still be released and retried
+            return False
+        except Exception as e:
+            logging.error(f"Dedupe claim failed for {key}, handling it anyway: {str(e)}")
+            return True
+        if done:
+            self._remember(key)
+        return True
+
+    def complete(self, key: str):
+        """Mark a pending claim as done so every later copy is dropped."""
+        self._remember(key)
+        try:
+            aws.table(self.table_name).update_item(
+                Key={"id": key},
+                UpdateExpression="SET #status = :done REMOVE lease_until",
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={":done": DONE},
+            )
+        except Exception as e:
+            logging.error(f"Dedupe complete failed for {key}: {str(e)}")
+
+    def remember(self, key: str):
+        """Treat `key` as done in this container only; its claim in the table runs out with the lease."""
+        self._remember(key)
+
+    def release(self, key: str):
+        """Give up a claim after a failure so the retry is not mistaken for a duplicate."""
+        with self._lock:
+            self._seen.pop(key, None)
+        try:
+            aws.table(self.table_name).delete_item(Key={"id": key})
+        except Exception as e:
+            logging.error(f"Dedupe release failed for {key}: {str(e)}")
+
+    def invalidate(self):
+        with self._lock:
+            self._seen.clear()
+
+    def _recently_seen(self, key: str) -> bool:
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return True
+            return False
+
+    def _remember(self, key: str):
+        with self._lock:
+            self._seen[key] = None
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.cache_size:
+                self._seen.popitem(last=False)
+
+
+deduplicator = Deduplicator()
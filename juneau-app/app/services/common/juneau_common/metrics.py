@@ -0,0 +1,148 @@
+"""
+Per-stage latency metrics written as CloudWatch Embedded Metric Format (EMF) log lines.
+
+Values are buffered in memory while an invocation runs and written as a single JSON
+line when it ends, so recording a value costs a list append and CloudWatch extracts
+the metrics from the log without any API calls. Invocations are sampled with
+METRICS_SAMPLE_RATE; unsampled ones skip recording entirely.
+
+Every AWS API call made through `juneau_common.aws` is timed as "<Service>.<Operation>"
+(e.g. "DynamoDB.Query", "SQS.SendMessage") by hooking the boto3 session's events.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "Juneau")
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1"))  # share of invocations that emit metrics
+METRICS_SERVICE = os.getenv("METRICS_SERVICE") or os.getenv("AWS_LAMBDA_FUNCTION_NAME", "local")
+MAX_VALUES_PER_METRIC = 100  # EMF limit for a metric's value array
+
+MILLISECONDS = "Milliseconds"
+COUNT = "Count"
+
+
+class Metrics:
+    def __init__(self, namespace: str = METRICS_NAMESPACE,
+                 service: str = METRICS_SERVICE,
+                 sample_rate: float = METRICS_SAMPLE_RATE):
+        self.namespace = namespace
+        self.service = service
+        self.sample_rate = sample_rate
+        self.sampled = True
+        self._values: Dict[str, List[float]] = {}
+        self._units: Dict[str, str] = {}
+        self._properties: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def put(self, name: str, value: float, unit: str = MILLISECONDS):
+        if not self.sampled:
+            return
+        with self._lock:
+            values = self._values.setdefault(name, [])
+            if len(values) < MAX_VALUES_PER_METRIC:
+                values.append(value)
+                self._units[name] = unit
+
+    def count(self, name: str, value: int = 1):
+        self.put(name, value, COUNT)
+
+    def property(self, name: str, value: Any):
+        """Attach searchable, non-metric context (e.g. a request id) to the log line."""
+        if self.sampled:
+            with self._lock:
+                self._properties[name] = value
+
+    @contextmanager
+    def timer(self, name: str):
+        """Record how long the block takes, in milliseconds, even if it raises."""
+        if not self.sampled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, (time.perf_counter() - start) * 1000)
+
+    def begin(self):
+        """Start an invocation: drop anything left over and decide whether to sample it."""
+        with self._lock:
+            self._values.clear()
+            self._units.clear()
+            self._properties.clear()
+        self.sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """Write the buffered values as one EMF line and return the document (None if empty)."""
+        with self._lock:
+            values, units, properties = self._values, self._units, self._properties
+            self._values, self._units, self._properties = {}, {}, {}
+        if not values:
+            return None
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["Service"]],
+                    "Metrics": [{"Name": name, "Unit": units[name]} for name in values],
+                }],
+            },
+            "Service": self.service,
+            **properties,
+        }
+        for name, recorded in values.items():
+            document[name] = recorded[0] if len(recorded) == 1 else recorded
+        print(json.dumps(document), flush=True)
+        return document
+
+    @contextmanager
+    def invocation(self):
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.flush()
+
+    def emit(self, handler):
+        """Decorator for a Lambda handler: one sampled EMF line per invocation."""
+        @wraps(handler)
+        def wrapper(event, context):
+            with self.invocation():
+                if context is not None:
+                    self.property("RequestId", getattr(context, "aws_request_id", None))
+                return handler(event, context)
+        return wrapper
+
+    def record_queue_age(self, record: Dict[str, Any]):
+        """Time an SQS record spent in its queue, from the SentTimestamp attribute."""
+        attributes = record.get("attributes") or {}
+        sent = attributes.get("SentTimestamp")
+        if sent is not None:
+            self.put("QueueAge", max(time.time() * 1000 - int(sent), 0))
+        receive_count = attributes.get("ApproximateReceiveCount")
+        if receive_count is not None and int(receive_count) > 1:
+            self.count("Redelivered")
+
+    def instrument(self, session):
+        """Time every API call made by clients created from a boto3 `session`."""
+        def before_call(model, context, **kwargs):
+            context["metrics_start"] = time.perf_counter()
+
+        def after_call(model, context, **kwargs):
+            start = context.pop("metrics_start", None)
+            if start is not None:
+                self.put(f"{model.service_model.service_id}.{model.name}", (time.perf_counter() - start) * 1000)
+
+        session.events.register("before-call", before_call, unique_id="juneau-metrics-before")
+        session.events.register("after-call", after_call, unique_id="juneau-metrics-after")
+
+
+metrics = Metrics()
@@ -0,0 +1,43 @@
+"""
+Lazily fetched, TTL cached Secrets Manager values.
+
+Secrets are no longer read at import time: the first call in a container fetches the
+secret and later calls reuse it until the TTL runs out, so rotated keys still get
+picked up without a round trip on every invocation.
+"""
+
+import json
+import os
+import threading
+import time
+
+from juneau_common import aws
+
+SECRET_TTL_SECONDS = int(os.getenv("SECRET_TTL_SECONDS", "900"))
+
+_lock = threading.Lock()
+_cache = {}  # secret name -> (fetched_at, value)
+
+
+def get_secret(secret_name: str, ttl: int = SECRET_TTL_SECONDS) -> dict:
+    """Return the JSON key/value pairs stored in `secret_name`."""
+    cached = _cache.get(secret_name)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    with _lock:
+        cached = _cache.get(secret_name)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        response = aws.client("secretsmanager").get_secret_value(SecretId=secret_name)
+        value = json.loads(response["SecretString"])
+        _cache[secret_name] = (time.monotonic(), value)
+        return value
+
+
+def invalidate(secret_name: str = None):
+    """Force the next `get_secret` call to fetch again."""
+    with _lock:
+        if secret_name is None:
+            _cache.clear()
+        else:
+            _cache.pop(secret_name, None)
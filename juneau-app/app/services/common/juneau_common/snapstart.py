@@ -0,0 +1,83 @@
+"""
+Lambda SnapStart hooks.
+
+With SnapStart a function runs its init phase once, when a version is published, and
+every cold start resumes from a snapshot of that memory. Whatever init leaves behind
+is shared by every environment restored from the snapshot, so init is split in two:
+
+- `before_snapshot` hooks prime the snapshot: heavy imports and first-call work that
+  would otherwise land on the first message after a cold start. They must not fetch
+  secrets or open connections. AWS clients built here are dropped again on restore,
+  but the service models they loaded are kept (see `aws.reset`).
+- `after_restore` hooks refresh what must not be shared: cached secrets, the boto3
+  session (credentials and pooled connections), HTTP sessions and the random seed.
+
+Lambda only calls the hooks for functions with SnapStart on, through the runtime's
+`snapshot_restore_py` module. Elsewhere registering is a no-op and the hooks can be
+run by hand with `run_before_snapshot` / `run_after_restore`.
+"""
+
+import logging
+import random
+import time
+from typing import Callable, List
+
+from juneau_common import aws, secrets
+
+_before: List[Callable[[], None]] = []
+_after: List[Callable[[], None]] = []
+
+
+def before_snapshot(hook: Callable[[], None]) -> Callable[[], None]:
+    """Register `hook` to prime the snapshot; usable as a decorator."""
+    _before.append(hook)
+    return hook
+
+
+def after_restore(hook: Callable[[], None]) -> Callable[[], None]:
+    """Register `hook` to run in every environment restored from the snapshot."""
+    _after.append(hook)
+    return hook
+
+
+def run_before_snapshot():
+    """
+    Run the priming hooks in registration order. Priming is best effort: a failing
+    hook is logged and the snapshot is taken anyway.
+    """
+    started = time.perf_counter()
+    for hook in _before:
+        try:
+            hook()
+        except Exception:
+            logging.exception(f"SnapStart priming hook {hook.__name__} failed")
+    logging.info(f"SnapStart priming took {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+def run_after_restore():
+    """Run the refresh hooks in registration order; a failure fails the restore."""
+    started = time.perf_counter()
+    for hook in _after:
+        hook()
+    logging.info(f"SnapStart refresh took {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+@before_snapshot
+def prime_aws():
+    aws.session()  # imports boto3 and botocore
+
+
+@after_restore
+def refresh_common():
+    secrets.invalidate()
+    aws.reset()
+    random.seed()  # every restored environment would otherwise draw the same jitter
+
+
+try:
+    from snapshot_restore_py import register_after_restore, register_before_snapshot
+except ImportError:  # not in the Lambda Python runtime
+    pass
+else:
+    register_before_snapshot(run_before_snapshot)
+    register_after_restore(run_after_restore)
@@ -0,0 +1,82 @@
+"""
+Opt-in capture of sanitised webhook traffic for replay (see tools/replay.py).
+
+With WEBHOOK_CAPTURE=true every webhook reaching the receiver is written as one JSONL
+record: the receive time in milliseconds and the payload with anything personal
+removed. Phone numbers become stable fake +1555 numbers (so bursts per phone survive),
+ids are hashed consistently, text keeps its length, whitespace, punctuation and
+emoji (so '✨' new chats and questions still show) but every letter and digit is
+masked, and fields we don't know to be safe are dropped.
+
+Records go to CAPTURE_PATH when set (local runs), otherwise to stdout, where they
+land in CloudWatch Logs as lines starting with {"juneau_capture": ...}.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict
+
+WEBHOOK_CAPTURE = os.getenv("WEBHOOK_CAPTURE", "false").lower() == "true"
+CAPTURE_PATH = os.getenv("CAPTURE_PATH")
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "juneau")  # set per capture so hashes can't be matched across captures
+
+KEPT_FIELDS = {
+    "alert_type", "message_type", "api_version", "success", "error_code", "reaction",
+    "delivery_type", "thread_id", "language",
+}
+HASHED_FIELDS = {"message_id", "webhook_id", "reply_to_id", "group_id"}
+PHONE_FIELDS = {"recipient", "sender"}
+TEXT_FIELDS = {"text", "subject"}
+
+_lock = threading.Lock()
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(f"{CAPTURE_SALT}:{value}".encode("utf-8")).hexdigest()
+
+
+def fake_phone(phone: str) -> str:
+    """A stable, obviously fake +1555 number standing in for `phone`."""
+    return f"+1555{int(_digest(phone)[:12], 16) % 10_000_000:07d}"
+
+
+def mask_text(text: str) -> str:
+    """Same length and shape, no content: letters become 'x' and digits '0'."""
+    return "".join("0" if char.isdigit() else "x" if char.isalnum() else char for char in text)
+
+
+def sanitise(payload: Dict[str, Any]) -> Dict[str, Any]:
+    clean = {}
+    for field, value in payload.items():
+        if value is None:
+            continue
+        if field in KEPT_FIELDS:
+            clean[field] = value
+        elif field in HASHED_FIELDS:
+            clean[field] = _digest(str(value))[:32]
+        elif field in PHONE_FIELDS:
+            clean[field] = fake_phone(str(value))
+        elif field in TEXT_FIELDS:
+            clean[field] = mask_text(str(value))
+        elif field == "attachments":
+            clean[field] = len(value)
+    return clean
+
+
+def capture(payload: Dict[str, Any], received: int = None):
+    """Write `payload` as a capture record if capturing is switched on."""
+    if not WEBHOOK_CAPTURE:
+        return
+    line = json.dumps({
+        "juneau_capture": 1,
+        "t": received or int(time.time() * 1000),
+        "payload": sanitise(payload),
+    }, ensure_ascii=False, separators=(",", ":"))
+    if CAPTURE_PATH:
+        with _lock, open(CAPTURE_PATH, "a", encoding="utf-8") as capture_file:
+            capture_file.write(line + "\n")
+    else:
+        print(line, flush=True)
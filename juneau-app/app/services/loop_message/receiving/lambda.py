@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import boto3
 import json
 import logging
 import os
@@ -11,6 +10,9 @@ from fastapi import FastAPI, Depends, Header, HTTPException, Request, status
 from fastapi.responses import JSONResponse
 from typing import Any, Dict, Optional
 
+from juneau_common.metrics import metrics
+from webhook import WebhookError, authorize, ingest
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Environment
@@ -26,22 +28,19 @@ app = FastAPI(title="Loop Message Webhook API")
 def log(message: str):
     logging.info(message)
 
+# One EMF metrics line per request, including the auth dependency
+@app.middleware("http")
+async def emit_metrics(request: Request, call_next):
+    with metrics.invocation():
+        return await call_next(request)
+
 # Authentication dependency
 async def verify_token(authorization: Optional[str] = Header(None)):
-    logging.info(f"Authorization header: {authorization}")
-    if not authorization:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Authorization header is missing"
-        )
-    
-    if authorization != f"Bearer {LOOP_BEARER_TOKEN}":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Invalid authorization token"
-        )
-    
-    return True
+    try:
+        with metrics.timer("Auth"):
+            return authorize(authorization)
+    except WebhookError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
 # Routes
 @app.get("/")
@@ -54,33 +53,13 @@ async def handle_webhook(request: Request, authenticated: bool = Depends(verify_
         payload = await request.json()
         logging.info(f"Received webhook: {json.dumps(payload, indent=2)}")
         
-        packaged_payload = json.dumps(payload)
-        sqs_name = os.getenv("SQS_NAME")
-        if not sqs_name:
-            logging.error("SQS_NAME environment variable is not set")
-            raise HTTPException(status_code=500, detail="SQS name not configured")
-        sqs_client = boto3.client('sqs')
-        queue_url = sqs_client.get_queue_url(QueueName=SQS_NAME).get('QueueUrl')
-        if not queue_url:
-            logging.error("SQS_QUEUE_URL environment variable is not set")
-            raise HTTPException(status_code=500, detail="SQS queue URL not configured")
         try:
-            sent_message = sqs_client.send_message(
-                QueueUrl=queue_url,
-                MessageBody=packaged_payload,
-            )
-                            
-            logging.info(f"Message sent to SQS: {sent_message['MessageId']}")
             return JSONResponse(
                 status_code=status.HTTP_200_OK, # Maybe make this a 202 Accepted
-                content={
-                    "status": "success",
-                    "message": f"Message sent to SQS: {sent_message['MessageId']}"
-                }
+                content=ingest(payload)
             )
-        except Exception as e:
-            logging.error(f"Error sending message to SQS: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Failed to send message to SQS: {str(e)}")
+        except WebhookError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
     except json.JSONDecodeError:
         logging.error("Failed to parse JSON payload")
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
@@ -0,0 +1,181 @@
+"""
+Framework-free core of the Loop webhook receiver.
+
+`authorize` and `ingest` are shared by the FastAPI app in lambda.py (local development
+and the web adapter image) and by `lambda_handler`, a native handler for API Gateway
+HTTP API (payload v2) events that skips booting a web server on cold start.
+
+Webhooks are routed by alert type: inbound texts go to the processing queue (the LLM
+lane), delivery statuses and reactions to the low-priority status queue, and anything
+else is counted and dropped here instead of costing an SQS hop and an invocation.
+"""
+
+import base64
+import json
+import logging
+import os
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from capture import capture
+from juneau_common import aws, correlation, snapstart
+from juneau_common.idempotency import deduplicator, payload_key
+from juneau_common.metrics import metrics
+
+
+INTERACTIVE = "interactive"
+STATUS = "status"
+
+LANES = {
+    "message_inbound": INTERACTIVE,
+    "message_sent": STATUS,
+    "message_failed": STATUS,
+    "message_timeout": STATUS,
+    "message_reaction": STATUS,
+}
+LANE_QUEUES = {  # environment variable holding each lane's queue name
+    INTERACTIVE: "SQS_NAME",
+    STATUS: "STATUS_SQS_NAME",
+}
+LANE_STAGES = {  # stage names in the correlation envelope
+    INTERACTIVE: "processing",
+    STATUS: "status",
+}
+
+# Longer than the receiving function's 20 s timeout, so a claim only outlives a crashed attempt briefly
+EDGE_LEASE_SECONDS = int(os.getenv("EDGE_LEASE_SECONDS", "30"))
+
+dropped = Counter()  # alert type -> webhooks dropped by this container
+
+
+class WebhookError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def authorize(authorization: Optional[str]) -> bool:
+    if not authorization:
+        raise WebhookError(401, "Authorization header is missing")
+    if authorization != f"Bearer {os.getenv('LOOP_BEARER_TOKEN')}":
+        raise WebhookError(403, "Invalid authorization token")
+    return True
+
+
+def lane(payload: Dict[str, Any]) -> Optional[str]:
+    """The lane a webhook belongs to, or None if nothing acts on it."""
+    return LANES.get(payload.get("alert_type"))
+
+
+def enqueue(payload: Dict[str, Any], sqs_name: Optional[str],
+            envelope: Optional[Dict[str, Any]] = None, stage: str = "processing") -> Optional[str]:
+    """
+    Forward a webhook payload to `sqs_name` and return the SQS message id, or None if
+    the same webhook was already enqueued (Loop retries deliveries). The correlation
+    `envelope`, if any, rides along as a message attribute.
+    """
+    if not sqs_name:
+        logging.error("SQS_NAME environment variable is not set")
+        raise WebhookError(500, "SQS name not configured")
+    key = payload_key(payload)
+    dedupe_key = f"edge:{key}" if key else None
+    # A lease, not a done marker: if the send fails or we time out before it, Loop's retry gets through.
+    # It is never completed (a write per message saved): later copies are dropped by processing's claim.
+    if dedupe_key and not deduplicator.claim(dedupe_key, lease=EDGE_LEASE_SECONDS):
+        logging.info(f"Duplicate webhook dropped: {key}")
+        metrics.count("DuplicateWebhooks")
+        return None
+    try:
+        message = {"MessageBody": json.dumps(payload)}
+        if envelope:
+            message["MessageAttributes"] = correlation.attributes(envelope, stage)
+        sent_message = aws.send_to_queue(sqs_name, **message)
+    except Exception as e:
+        logging.error(f"Error sending message to SQS: {str(e)}")
+        if dedupe_key:
+            deduplicator.release(dedupe_key)  # let Loop's retry through
+        raise WebhookError(500, f"Failed to send message to SQS: {str(e)}")
+    if dedupe_key:
+        deduplicator.remember(dedupe_key)
+    logging.info(f"Message sent to SQS: {sent_message['MessageId']}")
+    return sent_message["MessageId"]
+
+
+def drop(alert_type: str) -> Dict[str, Any]:
+    dropped[alert_type] += 1
+    metrics.count("DroppedWebhooks")
+    logging.info(f"Dropped {alert_type} webhook ({dropped[alert_type]} so far in this container)")
+    return {"status": "success", "message": f"Ignored {alert_type} webhook"}
+
+
+def ingest(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Route a webhook to its lane and return the response body. Duplicates and dropped
+    webhooks are acknowledged as a success too, otherwise Loop keeps retrying them.
+    """
+    envelope = correlation.start(payload.get("message_id"))
+    capture(payload, envelope["received"])  # everything, duplicates and dropped alerts included
+    alert_type = payload.get("alert_type", "unknown")
+    webhook_lane = lane(payload)
+    if webhook_lane is None:
+        return drop(alert_type)
+    sqs_name = os.getenv(LANE_QUEUES[webhook_lane])
+    if not sqs_name and webhook_lane != INTERACTIVE:
+        return drop(alert_type)  # e.g. local development without a status queue
+    metrics.property("CorrelationId", envelope["id"])
+    correlation.log(envelope, f"Received {alert_type} webhook")
+    with metrics.timer("Enqueue"):
+        message_id = enqueue(payload, sqs_name, envelope, LANE_STAGES[webhook_lane])
+    if message_id is None:
+        return {"status": "success", "message": "Duplicate webhook ignored"}
+    return {"status": "success", "message": f"Message sent to SQS: {message_id}"}
+
+
+def _response(status_code: int, content: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "statusCode": status_code,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(content),
+    }
+
+
+def _body(event: Dict[str, Any]) -> Dict[str, Any]:
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body).decode("utf-8")
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError:
+        logging.error("Failed to parse JSON payload")
+        raise WebhookError(400, "Invalid JSON payload")
+
+
+@snapstart.before_snapshot
+def prime():
+    """With SnapStart, build the SQS and dedupe clients before the snapshot instead of on the first webhook."""
+    aws.client("sqs")
+    aws.table(deduplicator.table_name)
+
+
+@metrics.emit
+def lambda_handler(event, context):
+    """Entry point for API Gateway HTTP API v2 events (GET / and POST /loop)."""
+    http = event.get("requestContext", {}).get("http", {})
+    method = http.get("method", "")
+    path = event.get("rawPath") or http.get("path", "")
+    headers = {key.lower(): value for key, value in (event.get("headers") or {}).items()}
+
+    try:
+        if method == "GET" and path == "/":
+            return _response(200, {"message": "Webhook server is running"})
+        if method == "POST" and path == "/loop":
+            with metrics.timer("Auth"):
+                authorize(headers.get("authorization"))
+            return _response(200, ingest(_body(event)))
+        return _response(404, {"detail": "Not Found"})
+    except WebhookError as e:
+        return _response(e.status_code, {"detail": e.detail})
+    except Exception as e:
+        logging.error(f"Error processing webhook: {str(e)}")
+        return _response(500, {"detail": f"Internal server error: {str(e)}"})
@@ -1,34 +1,77 @@
 import argparse
-import boto3
 import json
 import os
+import random
 import requests
+import threading
+import time
+
+from juneau_common import aws, batch, correlation, secrets, snapstart
+from juneau_common.metrics import metrics
+from requests.adapters import HTTPAdapter
 
 ENVIRONMENT = os.getenv("ENVIRONMENT", "local")
 if ENVIRONMENT == "local":
     from dotenv import load_dotenv
     load_dotenv(".env.development")
 
+LOOP_API_URL = os.getenv("LOOP_API_URL", "https://server.loopmessage.com/api/v1/message/send/")
+SENDING_CONCURRENCY = int(os.getenv("SENDING_CONCURRENCY", "1"))  # recipients sent to in parallel per batch
+LOOP_MAX_ATTEMPTS = int(os.getenv("LOOP_MAX_ATTEMPTS", "3"))  # in-lambda attempts for 5xx/connection errors
+LOOP_REQUEST_TIMEOUT = float(os.getenv("LOOP_REQUEST_TIMEOUT", "10"))
+LOOP_BACKOFF_BASE = 0.25  # seconds
+LOOP_BACKOFF_CAP = 2.0
+THROTTLE_BASE_DELAY = int(os.getenv("THROTTLE_BASE_DELAY", "10"))  # seconds a throttled record stays invisible
+THROTTLE_MAX_DELAY = 900
+RETRYABLE_STATUS_CODES = {500, 502, 503, 504}
+
+# Kept across warm invocations so each send reuses a keep-alive TLS connection to Loop
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max(SENDING_CONCURRENCY, 1)))
+http_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max(SENDING_CONCURRENCY, 1)))
+
+# While Loop is throttling us, the remaining records are deferred without calling the API
+throttled_until = 0.0
+throttle_lock = threading.Lock()
+
+
+@snapstart.before_snapshot
+def prime():
+    """With SnapStart, build the AWS clients and a Loop request once, so a restored container doesn't on its first send."""
+    aws.client("sqs")
+    aws.client("secretsmanager")
+    http_session.prepare_request(requests.Request(
+        "POST", LOOP_API_URL, headers={"Content-Type": "application/json"},
+        json={"recipient": "+15555555555", "text": "Hi!", "passthrough": correlation.passthrough(correlation.start())},
+    ))
+
+
+@snapstart.after_restore
+def refresh_http_session():
+    http_session.close()  # drops pooled connections; the session opens new ones on the next send
 
-def set_secrets():
-    if ENVIRONMENT == "local":
-        from dotenv import load_dotenv
-        load_dotenv()
-        LOOP_API_KEY = os.getenv("LOOP_API_KEY")
-        LOOP_AUTH_KEY = os.getenv("LOOP_AUTH_KEY")
-    else:
-        LOOP_SECRET_NAME = os.getenv("LOOP_SECRET_NAME")
-        secrets_manager = boto3.client("secretsmanager")
-        get_secret_value_response = secrets_manager.get_secret_value(
-            SecretId=LOOP_SECRET_NAME
-        )
-        secret_string = get_secret_value_response["SecretString"]
-        secret_dict = json.loads(secret_string)
-        LOOP_API_KEY = secret_dict.get("LOOP_API_KEY")
-        LOOP_AUTH_KEY = secret_dict.get("LOOP_AUTH_KEY")
-    return LOOP_API_KEY, LOOP_AUTH_KEY
 
-LOOP_API_KEY, LOOP_AUTH_KEY = set_secrets()
+class LoopThrottledError(Exception):
+    """Loop answered 429; the record should be retried later via SQS, not by sleeping."""
+    def __init__(self, retry_after=None):
+        super().__init__(f"Loop API is throttling requests (retry after {retry_after})")
+        self.retry_after = retry_after
+
+
+class LoopSendError(Exception):
+    """Loop rejected the message or kept failing after retries."""
+    def __init__(self, message, status_code=None, response=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = response
+
+
+def get_loop_keys():
+    """Loop credentials, fetched on first send and cached with a TTL rather than at import time."""
+    if ENVIRONMENT == "local":
+        return os.getenv("LOOP_API_KEY"), os.getenv("LOOP_AUTH_KEY")
+    secret_dict = secrets.get_secret(os.getenv("LOOP_SECRET_NAME"))
+    return secret_dict.get("LOOP_API_KEY"), secret_dict.get("LOOP_AUTH_KEY")
         
 
 def send_message(recipient, text, sender_name=None, 
@@ -39,12 +82,11 @@ def send_message(recipient, text, sender_name=None,
     Send a message via the iMessage Conversation API
     """
     sender_name = "Loop Message Sender" if sender_name is None else sender_name
+    LOOP_API_KEY, LOOP_AUTH_KEY = get_loop_keys()
     
     if not LOOP_API_KEY or not LOOP_AUTH_KEY or not sender_name:
         raise ValueError("API key, Secret key, and Sender name are required")
     
-    url = "https://server.loopmessage.com/api/v1/message/send/"
-    
     headers = {
         "Authorization": LOOP_AUTH_KEY,
         "Loop-Secret-Key": LOOP_API_KEY,
@@ -75,56 +117,158 @@ def send_message(recipient, text, sender_name=None,
     if effect:
         payload["effect"] = effect
     
+    print(f"Sending message to {recipient} with payload: {payload}")
+    response = post_with_retries(headers, payload)
     try:
-        print(f"Sending message to {recipient} with payload: {payload}")
-        response: requests.Response = requests.post(url, headers=headers, json=payload)
-        return {
-            "status_code": response.status_code,
-            "response": response.json()
-        }
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+        body = response.json()
+    except ValueError:
+        body = {"raw": response.text}
+    if response.status_code >= 400 or body.get("success") is False:
+        raise LoopSendError(
+            f"Loop rejected message to {recipient}: {response.status_code} {body}",
+            status_code=response.status_code,
+            response=body,
+        )
+    return {
+        "success": True,
+        "status_code": response.status_code,
+        "message_id": body.get("message_id"),
+        "response": body,
+    }
 
-def lambda_handler(event, context):
+def backoff_delay(attempt, base=LOOP_BACKOFF_BASE, cap=LOOP_BACKOFF_CAP):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def parse_retry_after(response):
     try:
-        if 'Records' in event and len(event['Records']) > 0:
-            for record in event['Records']:
-                # This is an SQS event
-                payload = json.loads(record['body'])
-                recipient = payload.get('recipient')
-                text = payload.get('text')
-                sender_name = payload.get('sender_name')
-                attachments = payload.get('attachments')
-                timeout = payload.get('timeout')
-                passthrough = payload.get('passthrough')
-                status_callback = payload.get('status_callback')
-                status_callback_header = payload.get('status_callback_header')
-                reply_to_id = payload.get('reply_to_id')
-                subject = payload.get('subject')
-                effect = payload.get('effect')
-                service = payload.get('service', 'imessage')
-                
-                result = send_message(
-                    recipient=recipient,
-                    text=text,
-                    sender_name=sender_name,
-                    attachments=attachments,
-                    timeout=timeout,
-                    passthrough=passthrough,
-                    status_callback=status_callback,
-                    status_callback_header=status_callback_header,
-                    reply_to_id=reply_to_id,
-                    subject=subject,
-                    effect=effect,
-                    service=service
-                )
+        return int(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def post_with_retries(headers, payload):
+    """
+    POST to Loop, retrying connection errors and 5xx responses a few times with backoff.
+    A 429 is raised straight away as LoopThrottledError so the caller can defer the record.
+    """
+    global throttled_until
+    last_error = None
+    for attempt in range(LOOP_MAX_ATTEMPTS):
+        if time.time() < throttled_until:
+            raise LoopThrottledError(retry_after=int(throttled_until - time.time()) + 1)
+        try:
+            with metrics.timer("LoopPost"):
+                response = http_session.post(LOOP_API_URL, headers=headers, json=payload, timeout=LOOP_REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            last_error = LoopSendError(f"Request to Loop failed: {str(e)}")
         else:
-            raise ValueError("No records found in the event")
-    except json.JSONDecodeError:
-        return {"success": False, "error": "Failed to parse JSON payload"}
-    
+            if response.status_code == 429:
+                metrics.count("LoopThrottled")
+                retry_after = parse_retry_after(response)
+                with throttle_lock:
+                    throttled_until = max(throttled_until, time.time() + (retry_after or THROTTLE_BASE_DELAY))
+                raise LoopThrottledError(retry_after=retry_after)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+            last_error = LoopSendError(f"Loop returned {response.status_code}", status_code=response.status_code)
+        if attempt + 1 < LOOP_MAX_ATTEMPTS:
+            time.sleep(backoff_delay(attempt))
+    raise last_error
+
+def defer_record(record, retry_after=None):
+    """Hide a throttled record for a while by changing its SQS visibility timeout."""
+    receipt_handle = record.get('receiptHandle')
+    source_arn = record.get('eventSourceARN')
+    if not receipt_handle or not source_arn:
+        return None  # not from SQS, e.g. the local CLI
+    receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+    delay = retry_after or THROTTLE_BASE_DELAY * (2 ** (receive_count - 1))
+    delay = int(min(THROTTLE_MAX_DELAY, delay + random.uniform(0, THROTTLE_BASE_DELAY)))
+    queue_name = source_arn.split(':')[-1]
+    aws.client("sqs").change_message_visibility(
+        QueueUrl=aws.queue_url(queue_name),
+        ReceiptHandle=receipt_handle,
+        VisibilityTimeout=delay,
+    )
+    return delay
+
+def send_record(record):
+    payload = json.loads(record['body'])
+    envelope = correlation.from_record(record)
+    passthrough = payload.get('passthrough')
+    if passthrough is None and envelope:
+        passthrough = correlation.passthrough(envelope)  # echoed back in the message_sent webhook
+    correlation.log(envelope, f"Sending to {payload.get('recipient')}")
+    try:
+        result = send_message(
+            recipient=payload.get('recipient'),
+            text=payload.get('text'),
+            sender_name=payload.get('sender_name'),
+            attachments=payload.get('attachments'),
+            timeout=payload.get('timeout'),
+            passthrough=passthrough,
+            status_callback=payload.get('status_callback'),
+            status_callback_header=payload.get('status_callback_header'),
+            reply_to_id=payload.get('reply_to_id'),
+            subject=payload.get('subject'),
+            effect=payload.get('effect'),
+            service=payload.get('service', 'imessage')
+        )
+    except LoopThrottledError as e:
+        delay = defer_record(record, e.retry_after)
+        if delay:
+            print(f"Loop is throttling, deferred record {record.get('messageId')} by {delay}s")
+        raise
+    except LoopSendError as e:
+        if not is_rejection(e):
+            raise
+        # Retrying can't change Loop's answer, and a batch item failure would only hold back
+        # this recipient's next messages until the record reached the DLQ
+        metrics.count("LoopRejected")
+        correlation.log(envelope, f"Dropped record {record.get('messageId')}: {e}")
+        return {"success": False, "dropped": True, "status_code": e.status_code, "error": str(e)}
+    correlation.record_latency(envelope)
     return result
 
+def is_rejection(error):
+    """A 4xx other than 429 (which is LoopThrottledError): Loop refused the message itself."""
+    return error.status_code is not None and 400 <= error.status_code < 500
+
+def delivery_order(records):
+    """
+    Chunks of a streamed reply (same `reply_id`) in `sequence` order; everything else keeps
+    arrival order. The FIFO sending queue already delivers them in order, so this only
+    guards against a queue or a redrive that doesn't.
+    """
+    first_seen = {}
+    keys = []
+    for position, record in enumerate(records):
+        try:
+            payload = json.loads(record['body'])
+        except (KeyError, TypeError, ValueError):
+            payload = {}
+        group = payload.get('reply_id', f"record-{position}")
+        first_seen.setdefault(group, position)
+        keys.append((first_seen[group], payload.get('sequence') or 0))
+    order = sorted(range(len(records)), key=lambda position: keys[position])
+    return [records[position] for position in order]
+
+@metrics.emit
+def lambda_handler(event, context):
+    if 'Records' not in event or len(event['Records']) == 0:
+        raise ValueError("No records found in the event")
+    # This is an SQS event; failed records are reported individually so only they are retried.
+    # Messages to one recipient stay in order, different recipients are sent concurrently.
+    result = batch.process_batch(
+        delivery_order(event['Records']),
+        send_record,
+        key=lambda record: json.loads(record['body']).get('recipient'),
+        max_workers=SENDING_CONCURRENCY,
+    )
+    for message_id, outcome in result.outcomes.items():
+        print(f"Record {message_id}: {json.dumps(outcome, default=str)}")
+    return result.response()
+
 if __name__ == "__main__":
     import argparse
 
@@ -146,6 +290,7 @@ if __name__ == "__main__":
     request = {
         "Records": [
             {
+                "messageId": "local-test",
                 "body": json.dumps({
                     "recipient": args.recipient,
                     "text": args.text,
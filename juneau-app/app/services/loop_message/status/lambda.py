@@ -0,0 +1,60 @@
+"""
+Consumer for the low-priority status lane: delivery statuses and reactions.
+
+These webhooks used to ride the processing queue and take a slot of the LLM lane's
+reserved concurrency just to be ignored. Here they are handled in large batches by a
+small function with no dependencies beyond juneau_common.
+
+Messages we sent carry a correlation `passthrough`, so their status webhooks close the
+loop: the time from the original inbound webhook to Loop confirming delivery.
+"""
+
+import json
+import logging
+
+from juneau_common import batch, correlation
+from juneau_common.metrics import metrics
+
+logging.getLogger().setLevel(logging.INFO)
+
+
+def handle_status(payload, envelope=None):
+    alert_type = payload.get('alert_type', 'unknown')
+    message_id = payload.get('message_id')
+    trace = correlation.from_passthrough(payload.get('passthrough'))
+    if trace:
+        logging.info(f"[{trace['correlation_id']}] {alert_type} for message {message_id}")
+    if trace and alert_type == "message_sent":
+        # When the status webhook reached us, not when this low-priority lane got to it
+        reported = envelope["received"] if envelope else correlation.now_ms()
+        metrics.put("Latency.Delivered", reported - trace["received"])
+        metrics.put("Latency.LoopDelivery", reported - trace["sent"])
+
+    if alert_type == "message_sent":
+        if payload.get('success', False):
+            logging.info(f"Message {message_id} was sent successfully")
+        else:
+            logging.warning(f"Message {message_id} was not delivered")
+
+    elif alert_type == "message_failed":
+        logging.error(f"Message {message_id} failed with error code {payload.get('error_code', 0)}")
+
+    elif alert_type == "message_timeout":
+        logging.warning(f"Message {message_id} timed out")
+
+    elif alert_type == "message_reaction":
+        logging.info(f"Received reaction {payload.get('reaction', '')} for message {message_id}")
+
+    else:
+        logging.info(f"Received {alert_type} webhook")
+
+    return {"alert_type": alert_type, "message_id": message_id}
+
+
+def process_record(record):
+    return handle_status(json.loads(record['body']), correlation.from_record(record))
+
+
+@metrics.emit
+def lambda_handler(event, context):
+    return batch.process_batch(event.get('Records', []), process_record).response()
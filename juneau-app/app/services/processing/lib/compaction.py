@@ -0,0 +1,128 @@
+"""
+Rolling summary compaction of long chats.
+
+Once the turns after a chat's last summary add up to more than COMPACT_THRESHOLD_TOKENS,
+`schedule` queues a `juneau_compact` job on the processing queue (the webhook receiver
+never forwards that alert type, so only we can send it). The job runs `compact`: the
+previous summary and the oldest turns are summarised into a new summary item, and only
+the newest COMPACT_KEEP_TOKENS of turns stay verbatim. The summary's sort key is half
+a step after the last turn it covers, so reads stop there (see lib/conversations.py)
+and the compacted turns stay in the table but never reach a prompt again.
+
+Compaction is off unless COMPACTION_SQS_NAME names the queue to send jobs to.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+from typing import List, Optional
+
+from juneau_common import aws
+from juneau_common.metrics import COUNT, metrics
+from lib import conversations, models, prompt
+
+COMPACT_ALERT_TYPE = "juneau_compact"
+COMPACTION_SQS_NAME = os.getenv("COMPACTION_SQS_NAME")
+COMPACT_THRESHOLD_TOKENS = int(os.getenv("COMPACT_THRESHOLD_TOKENS", "12000"))  # below the 16k window, so nothing is dropped unsummarised
+COMPACT_KEEP_TOKENS = int(os.getenv("COMPACT_KEEP_TOKENS", "4000"))  # newest turns kept word for word
+COMPACT_READ_TOKENS = 2 * prompt.MAX_CONTEXT_TOKENS  # older turns were already out of every prompt
+COMPACT_PENDING_SECONDS = 300  # a chat isn't queued again this soon from the same container
+SUMMARY_WORDS = 250
+
+SUMMARY_PROMPT = (
+    "You keep the memory of a texting assistant. Rewrite the summary below so it also covers the new "
+    f"messages, in at most {SUMMARY_WORDS} words. Keep names, facts about the user, their preferences, "
+    "decisions, promises and anything still open; drop small talk. Reply with the summary only.\n"
+)
+
+_pending = {}  # conversation key -> when a job was queued
+_pending_lock = threading.Lock()
+
+
+def uncompacted_tokens(history: List[dict]) -> int:
+    return sum(prompt.turn_tokens(turn) for turn in history if not turn.get('summary'))
+
+
+def schedule(phone: int, chat_id: int, history: List[dict], recipient: str) -> bool:
+    """Queue a compaction job if `history` (everything after the summary) is over the threshold."""
+    if not COMPACTION_SQS_NAME or uncompacted_tokens(history) <= COMPACT_THRESHOLD_TOKENS:
+        return False
+    key = conversations.conversation_key(phone, chat_id)
+    with _pending_lock:
+        if time.monotonic() - _pending.get(key, float("-inf")) < COMPACT_PENDING_SECONDS:
+            return False
+        _pending[key] = time.monotonic()
+    aws.send_to_queue(
+        COMPACTION_SQS_NAME,
+        # `recipient` keeps the job in order with the phone's texts within a batch
+        MessageBody=json.dumps({"alert_type": COMPACT_ALERT_TYPE, "recipient": recipient,
+                                "phone": phone, "chat_id": chat_id}),
+    )
+    metrics.count("CompactionsQueued")
+    return True
+
+
+def split(turns: List[dict], keep_tokens: int = COMPACT_KEEP_TOKENS):
+    """(turns to summarise, turns to keep): the kept ones are the newest and start on a human turn."""
+    kept = 0
+    cut = len(turns)
+    for index in range(len(turns) - 1, -1, -1):
+        kept += prompt.turn_tokens(turns[index])
+        if kept > keep_tokens:
+            break
+        cut = index
+    while cut < len(turns) and not turns[cut]['human']:
+        cut += 1
+    return turns[:cut], turns[cut:]
+
+
+def transcript(turns: List[dict]) -> str:
+    return "\n".join(f"{'User' if turn['human'] else 'Assistant'}: {turn['text']}" for turn in turns)
+
+
+def summarise(previous: Optional[str], turns: List[dict]) -> str:
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    messages = [
+        SystemMessage(content=SUMMARY_PROMPT),
+        HumanMessage(content=f"Summary so far:\n{previous or '(none)'}\n\nNew messages:\n{transcript(turns)}"),
+    ]
+    with metrics.timer("CompactionModelCall"):
+        return models.pool.generate(messages, tier=models.STANDARD).text.strip()
+
+
+def compact(phone: int, chat_id: int) -> Optional[dict]:
+    """Fold the chat's oldest turns into its summary. Returns the new summary item, if any."""
+    history = conversations.recent_turns(phone, chat_id, token_budget=COMPACT_READ_TOKENS)
+    previous = history[0] if history and history[0].get('summary') else None
+    turns = history[1:] if previous else history
+    if uncompacted_tokens(turns) <= COMPACT_THRESHOLD_TOKENS:
+        return None  # another job got here first
+    old, kept = split(turns)
+    if not old:
+        return None
+
+    text = summarise(previous['text'] if previous else None, old)
+    last_seq = Decimal(old[-1]['seq'])
+    summary = {
+        'conversation': conversations.conversation_key(phone, chat_id),
+        'seq': last_seq + Decimal("0.5"),  # right after the last turn it covers, before any kept turn
+        'phone': phone,
+        'chat_id': chat_id,
+        'text': text,
+        'human': False,
+        'summary': True,
+        'compacted_through': last_seq,
+        'compacted_turns': len(old) + (int(previous.get('compacted_turns', 0)) if previous else 0),
+        'ts': int(time.time() * 1000),
+        'tokens': prompt.count_tokens(text, human=False),
+    }
+    conversations.append_turn(summary)
+    conversations.repository.invalidate(phone, chat_id)  # the next read stops at the summary
+    metrics.count("Compactions")
+    metrics.put("CompactedTokens", uncompacted_tokens(old), COUNT)
+    logging.info(f"Compacted {len(old)} turns of {summary['conversation']} into {summary['tokens']} tokens")
+    return summary
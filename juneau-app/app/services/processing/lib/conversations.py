@@ -0,0 +1,308 @@
+"""
+Conversation turns stored one item per turn.
+
+Items live in the `ConversationTurns` table under a partition key of
+"<phone>#<chat_id>" and a time-ordered numeric sort key, so appending a turn is a
+single small PutItem and reading context is one Query for the newest turns. The cost
+of a turn depends on the context window rather than on how long the chat has run,
+and no item grows towards DynamoDB's 400 KB limit.
+
+`ConversationRepository` sits on top of that and keeps the DynamoDB round trips per
+exchange to a minimum: history comes from a write-through per-container cache when
+possible (and is known to be empty for a brand new chat), and the human turn and the
+reply are written together in one BatchWriteItem once the reply exists. The next text
+of a phone is often handled by another container, so a cache hit is brought up to
+date with a Query for the turns stored after the newest cached one (usually none).
+
+Long chats are compacted in the background (see lib/compaction.py): the oldest turns
+are summarised into a summary item whose sort key sits just after the last turn it
+covers. Reads walk back from the newest turn and stop at the first summary, so
+compacted turns are never read into a prompt; history then starts with the summary.
+
+The turns of an exchange are stored together as one compressed page item by default
+(see lib/encoding.py); plain turn items from before that are read the same way.
+
+Chats from before ConversationTurns are a single `messages` list of (text, human)
+pairs in `UserConversations`. Until tools/migrate_turns.py has copied them over (and
+marked the item `migrated_to`), a read that reaches the start of a chat without
+meeting a summary or a migrated turn also reads the legacy item, and its turns come
+first. Only chats at or below the phone's legacy watermark (see lib/sessions.py) can
+have one, so short chats started since then never touch the legacy table.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from juneau_common import aws
+from lib import encoding, sessions
+from lib.prompt import MAX_CONTEXT_TOKENS, count_tokens, turn_tokens
+
+TURNS_TABLE = "ConversationTurns"
+LEGACY_TABLE = "UserConversations"
+# Read UserConversations for chats that haven't been migrated; off once they all have been
+LEGACY_HISTORY = os.getenv("LEGACY_HISTORY", "true").lower() == "true"
+# Migrated turns are numbered from 1, real ones in microseconds since the epoch
+LEGACY_SEQ_END = 10 ** 12
+CONTEXT_TURNS = int(os.getenv("CONTEXT_TURNS", "40"))  # items (turns or pages of turns) read per Query page
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "256"))  # conversations kept per container
+# Cached history is read in full again after this long; turns added by other containers are checked on every read
+CONVERSATION_CACHE_TTL = float(os.getenv("CONVERSATION_CACHE_TTL", "120"))
+
+_seq_lock = threading.Lock()
+_last_seq = 0
+
+
+def conversation_key(phone: int, chat_id: int) -> str:
+    return f"{phone}#{chat_id}"
+
+
+def next_seq() -> int:
+    """Microseconds since the epoch, strictly increasing within this container."""
+    global _last_seq
+    with _seq_lock:
+        _last_seq = max(time.time_ns() // 1000, _last_seq + 1)
+        return _last_seq
+
+
+def new_turn(phone: int, chat_id: int, text: str, human: bool, language: Optional[str] = None) -> dict:
+    seq = next_seq()
+    turn = {
+        'conversation': conversation_key(phone, chat_id),
+        'seq': seq,
+        'phone': phone,
+        'chat_id': chat_id,
+        'text': text,
+        'human': human,
+        'ts': seq // 1000,  # milliseconds
+        'tokens': count_tokens(text, human),
+    }
+    if language:
+        turn['language'] = language
+    return turn
+
+
+def legacy_turns(phone: int, chat_id: int, messages: List) -> List[dict]:
+    """Turns of a UserConversations `messages` list, oldest first, numbered before every real turn."""
+    key = conversation_key(phone, chat_id)
+    return [
+        {
+            'conversation': key,
+            'seq': index + 1,
+            'phone': phone,
+            'chat_id': chat_id,
+            'text': text,
+            'human': bool(human),
+            'ts': 0,  # never recorded
+            'tokens': count_tokens(text, bool(human)),
+        }
+        for index, (text, human) in enumerate(messages)
+    ]
+
+
+def append_turn(turn: dict) -> dict:
+    aws.table(TURNS_TABLE).put_item(Item=turn)
+    return turn
+
+
+def recent_turns(phone: int, chat_id: int, limit: int = CONTEXT_TURNS,
+                 token_budget: Optional[int] = None) -> List[dict]:
+    """
+    The newest turns of a chat, oldest first. Without a budget this is one Query for
+    `limit` turns; with one, further pages are only read while the turns so far still
+    fit in `token_budget`.
+    """
+    table = aws.table(TURNS_TABLE)
+    query = {
+        'KeyConditionExpression': 'conversation = :conversation',
+        'ExpressionAttributeValues': {':conversation': conversation_key(phone, chat_id)},
+        'ScanIndexForward': False,
+        'Limit': limit,
+    }
+    newest_first = []
+    used = 0
+    while True:
+        response = table.query(**query)
+        items = response.get('Items', [])
+        summary_at = next((index for index, item in enumerate(items) if item.get('summary')), None)
+        if summary_at is not None:  # everything older is covered by the summary
+            summary = items[summary_at]
+            newest_first.extend(
+                # a page sorts at its newest turn, so its older turns may be summarised already
+                turn for turn in _turns(items[:summary_at]) if turn['seq'] > summary['compacted_through']
+            )
+            newest_first.append(summary)
+            break
+        turns = _turns(items)
+        newest_first.extend(turns)
+        used += sum(turn_tokens(turn) for turn in turns)
+        if 'LastEvaluatedKey' not in response:
+            if LEGACY_HISTORY and not (newest_first and newest_first[-1]['seq'] < LEGACY_SEQ_END) \
+                    and 0 <= chat_id <= sessions.sessions.legacy_through(phone):
+                newest_first.extend(_legacy_newest_first(phone, chat_id, limit - len(newest_first),
+                                                         None if token_budget is None else token_budget - used))
+            break
+        if token_budget is None or used >= token_budget:
+            break
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return list(reversed(newest_first))
+
+
+def newer_turns(phone: int, chat_id: int, after) -> Optional[List[dict]]:
+    """
+    Turns of a chat stored after sequence number `after`, oldest first, or None if a
+    summary was written since (the caller's copy of the older turns is then stale).
+    """
+    table = aws.table(TURNS_TABLE)
+    query = {
+        'KeyConditionExpression': 'conversation = :conversation AND seq > :after',
+        'ExpressionAttributeValues': {':conversation': conversation_key(phone, chat_id), ':after': after},
+    }
+    turns = []
+    while True:
+        response = table.query(**query)
+        for item in response.get('Items', []):
+            if item.get('summary'):
+                return None
+            # a page sorts at its newest turn; older turns in it may be ones we have
+            turns.extend(turn for turn in encoding.decode(item) if turn['seq'] > after)
+        if 'LastEvaluatedKey' not in response:
+            return turns
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _legacy_newest_first(phone: int, chat_id: int, limit: int, token_budget: Optional[int]) -> List[dict]:
+    """The newest legacy turns of a chat that fit in `limit` turns, or in `token_budget` tokens if given."""
+    if (limit if token_budget is None else token_budget) <= 0:
+        return []
+    try:
+        response = aws.table(LEGACY_TABLE).get_item(
+            Key={'phone': phone, 'chat_id': chat_id},
+            ProjectionExpression='messages, migrated_to',
+        )
+    except Exception as e:  # the newer turns are still worth answering from
+        print(f"Could not read legacy history of {conversation_key(phone, chat_id)}: {e}")
+        return []
+    item = response.get('Item')
+    if item is None:
+        if chat_id == 0:  # a phone without a counter that started after the migration
+            sessions.sessions.mark_no_legacy(phone)
+        return []
+    if 'migrated_to' in item:  # copied to a chat of its own; this chat_id is a newer chat
+        return []
+    turns = legacy_turns(phone, chat_id, item.get('messages', []))
+    if token_budget is None:
+        return list(reversed(turns[-limit:]))
+    return list(reversed(within_budget(turns, token_budget)))
+
+
+def _turns(items: List[dict]) -> List[dict]:
+    """Turns of items read newest first, newest first."""
+    return [turn for item in items for turn in reversed(encoding.decode(item))]
+
+
+def within_budget(turns: List[dict], token_budget: int) -> List[dict]:
+    """
+    The newest turns whose tokens add up to at most `token_budget` (plus the one that
+    crosses it). A leading summary is always kept.
+    """
+    if turns and turns[0].get('summary'):
+        return turns[:1] + within_budget(turns[1:], token_budget - turn_tokens(turns[0]))
+    used = 0
+    for index in range(len(turns) - 1, -1, -1):
+        used += turn_tokens(turns[index])
+        if used >= token_budget:
+            return turns[index:]
+    return turns
+
+
+def append_turns(turns: List[dict]):
+    """Write the turns of one conversation as a page item, or as plain items in one BatchWriteItem."""
+    if encoding.TURN_ENCODING == "page":
+        items = encoding.page_items(turns)
+    else:
+        items = turns
+    if len(items) == 1:
+        aws.table(TURNS_TABLE).put_item(Item=items[0])
+        return
+    with aws.table(TURNS_TABLE).batch_writer() as writer:
+        for item in items:
+            writer.put_item(Item=item)
+
+
+class ConversationRepository:
+    def __init__(self, limit: int = CONTEXT_TURNS,
+                 token_budget: int = MAX_CONTEXT_TOKENS,
+                 cache_size: int = CONVERSATION_CACHE_SIZE,
+                 cache_ttl: float = CONVERSATION_CACHE_TTL):
+        self.limit = limit
+        self.token_budget = token_budget
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()  # conversation key -> (cached_at, turns oldest first)
+        self._lock = threading.Lock()
+
+    def history(self, phone: int, chat_id: int, new_chat: bool = False) -> List[dict]:
+        """
+        Turns already stored for a chat, oldest first. No round trip for a new chat, and
+        on a cache hit only a Query for turns saved since (by another container).
+        """
+        key = conversation_key(phone, chat_id)
+        if new_chat:
+            self._remember(key, [])
+            return []
+        cached = self._cached(key)
+        if cached is not None:
+            newer = newer_turns(phone, chat_id, cached[-1]['seq'] if cached else 0)
+            if newer is not None:
+                if newer:
+                    self._extend(key, newer)
+                return within_budget(cached + newer, self.token_budget)
+        turns = recent_turns(phone, chat_id, self.limit, self.token_budget)
+        self._remember(key, turns)
+        return list(turns)
+
+    def save(self, *turns: dict):
+        """Persist the turns of an exchange in one write and add them to the cache."""
+        append_turns(list(turns))
+        if not turns:
+            return
+        self._extend(turns[0]['conversation'], list(turns))
+
+    def invalidate(self, phone: int = None, chat_id: int = None):
+        with self._lock:
+            if phone is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(conversation_key(phone, chat_id), None)
+
+    def _extend(self, key: str, turns: List[dict]):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                # Keep the original read time, which bounds how long a summary written elsewhere goes unseen
+                self._cache[key] = (entry[0], within_budget(entry[1] + turns, self.token_budget))
+                self._cache.move_to_end(key)
+
+    def _cached(self, key: str) -> Optional[List[dict]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.cache_ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return list(entry[1])
+
+    def _remember(self, key: str, turns: List[dict]):
+        with self._lock:
+            self._cache[key] = (time.monotonic(), within_budget(list(turns), self.token_budget))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+repository = ConversationRepository()
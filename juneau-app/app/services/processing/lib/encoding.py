@@ -0,0 +1,190 @@
+"""
+Compact binary encoding of conversation turns.
+
+A turn stored as its own item spells out every attribute name (`conversation`, `seq`,
+`phone`, `chat_id`, `text`, `human`, `ts`, `tokens`) next to its value, and every
+item is billed at least one WCU. Instead, the turns written together (the texts of
+an exchange and the reply) go into one page item: the usual key, sorted at the
+page's newest turn, plus a `page` binary attribute holding the packed turns.
+
+Page layout (little endian), version 1:
+
+    header   B version, B codec, H turn count
+    body     per turn: Q seq, q ts, I tokens, B flags (1: human), B language length,
+             I text length, then the language and the text as UTF-8
+
+The body is compressed with zlib when that makes it smaller, which is what the codec
+byte records. TURN_CODEC=zstd uses zstd instead (needs `zstandard` in every reader);
+on exchange-sized pages its frame overhead makes it slightly larger than zlib (see
+benchmarks/bench_encoding.py).
+
+Readers handle pages and plain turn items alike (`decode`), so pages can be turned
+on without migrating existing chats; tools/migrate_turns.py packs the old ones.
+TURN_ENCODING=item goes back to writing plain items. Summary items (see
+lib/compaction.py) are always plain.
+"""
+
+import os
+import struct
+import zlib
+from decimal import Decimal
+from typing import Iterable, List
+
+PAGE_VERSION = 1
+NONE, ZLIB, ZSTD = 0, 1, 2
+TURN_ENCODING = os.getenv("TURN_ENCODING", "page")  # "page" or "item"
+PAGE_MAX_BYTES = 128 * 1024  # packed turns per page before compression; items are capped at 400 KB
+
+_HEADER = struct.Struct("<BBH")
+_TURN = struct.Struct("<QqIBBI")
+_HUMAN = 1
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd pages need the zstandard package") from None
+    return zstandard
+
+
+def default_codec() -> int:
+    return {"none": NONE, "zlib": ZLIB, "zstd": ZSTD}[os.getenv("TURN_CODEC", "zlib")]
+
+
+def compress(body: bytes, codec: int) -> bytes:
+    if codec == ZSTD:
+        return _zstd().compress(body, 3)
+    if codec == ZLIB:
+        return zlib.compress(body, 6)
+    return body
+
+
+def decompress(body: bytes, codec: int) -> bytes:
+    if codec == ZSTD:
+        return _zstd().decompress(body)
+    if codec == ZLIB:
+        return zlib.decompress(body)
+    if codec == NONE:
+        return body
+    raise ValueError(f"Unknown page codec {codec}")
+
+
+def pack(turns: List[dict], codec: int = None) -> bytes:
+    """Turns (oldest first) as one version 1 page."""
+    parts = []
+    for turn in turns:
+        text = turn['text'].encode("utf-8")
+        language = (turn.get('language') or "").encode("utf-8")
+        parts.append(_TURN.pack(
+            int(turn['seq']), int(turn.get('ts', 0)), int(turn.get('tokens', 0)),
+            _HUMAN if turn['human'] else 0, len(language), len(text),
+        ))
+        parts.append(language)
+        parts.append(text)
+    body = b"".join(parts)
+    codec = default_codec() if codec is None else codec
+    packed = compress(body, codec)
+    if len(packed) >= len(body):  # short exchanges often don't compress
+        codec, packed = NONE, body
+    return _HEADER.pack(PAGE_VERSION, codec, len(turns)) + packed
+
+
+def unpack(data: bytes, conversation: str) -> List[dict]:
+    """The turns of a page, oldest first, as the same dicts plain turn items read as."""
+    version, codec, count = _HEADER.unpack_from(data)
+    if version != PAGE_VERSION:
+        raise ValueError(f"Unknown page version {version}")
+    body = decompress(bytes(data[_HEADER.size:]), codec)
+    phone, chat_id = (int(part) for part in conversation.split("#"))
+    turns = []
+    offset = 0
+    for _ in range(count):
+        seq, ts, tokens, flags, language_length, text_length = _TURN.unpack_from(body, offset)
+        offset += _TURN.size
+        language = body[offset:offset + language_length].decode("utf-8")
+        offset += language_length
+        turn = {
+            'conversation': conversation,
+            'seq': seq,
+            'phone': phone,
+            'chat_id': chat_id,
+            'text': body[offset:offset + text_length].decode("utf-8"),
+            'human': bool(flags & _HUMAN),
+            'ts': ts,
+            'tokens': tokens,
+        }
+        offset += text_length
+        if language:
+            turn['language'] = language
+        turns.append(turn)
+    return turns
+
+
+def packed_size(turn: dict) -> int:
+    return _TURN.size + len(turn['text'].encode("utf-8")) + len((turn.get('language') or "").encode("utf-8"))
+
+
+def page_items(turns: List[dict], codec: int = None) -> List[dict]:
+    """Page items for turns of one conversation (oldest first), each under PAGE_MAX_BYTES packed."""
+    items, page, size = [], [], 0
+    for turn in turns:
+        if page and size + packed_size(turn) > PAGE_MAX_BYTES:
+            items.append(page_item(page, codec))
+            page, size = [], 0
+        page.append(turn)
+        size += packed_size(turn)
+    if page:
+        items.append(page_item(page, codec))
+    return items
+
+
+def page_item(turns: List[dict], codec: int = None) -> dict:
+    return {
+        'conversation': turns[0]['conversation'],
+        'seq': turns[-1]['seq'],  # the newest turn, so reads walking back meet the page in order
+        'page': pack(turns, codec),
+    }
+
+
+def decode(item: dict) -> List[dict]:
+    """The turns stored in an item, oldest first: a page's, or the item itself."""
+    page = item.get('page')
+    if page is None:
+        return [item]
+    return unpack(getattr(page, 'value', page), item['conversation'])  # boto3 wraps binary values
+
+
+def item_size(item: dict) -> int:
+    """Approximate size DynamoDB bills an item at: attribute names plus values."""
+    return sum(len(name.encode("utf-8")) + _value_size(value) for name, value in item.items())
+
+
+def _value_size(value) -> int:
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        digits = len(str(abs(value)).replace(".", "").lstrip("0")) or 1
+        return 1 + (digits + 1) // 2
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, 'value'):  # boto3 Binary
+        return len(value.value)
+    if isinstance(value, dict):
+        return 3 + sum(len(name.encode("utf-8")) + 1 + _value_size(inner) for name, inner in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 3 + sum(1 + _value_size(inner) for inner in value)
+    raise TypeError(f"Can't size {type(value).__name__}")
+
+
+def write_units(items: Iterable[dict]) -> int:
+    """WCUs to put the items one by one: each rounds up to 1 KB."""
+    return sum(-(-item_size(item) // 1024) for item in items)
+
+
+def read_units(items: Iterable[dict], consistent: bool = False) -> float:
+    """RCUs for a Query returning the items: their total size rounds up to 4 KB."""
+    units = -(-sum(item_size(item) for item in items) // 4096)
+    return units if consistent else units / 2
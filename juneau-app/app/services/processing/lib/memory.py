@@ -0,0 +1,375 @@
+"""
+Long-term memory across a phone's chats.
+
+Every '✨' starts a new chat, and turns from earlier chats never reached the prompt.
+When a chat is left behind, a `juneau_memorize` job (queued on the processing
+queue like compaction jobs) cuts it into snippets: each exchange, plus the chat's
+summary if it was compacted. The job embeds them and appends them to the phone's
+memory index. When answering, the current texts are embedded and the most similar
+snippets from earlier chats go into the system message, within MEMORY_TOKENS.
+
+The index is plain NumPy: a matrix of unit vectors per phone, stored as float16 in an
+.npz object in MEMORY_BUCKET, loaded on first use and cached per container for
+MEMORY_CACHE_TTL. A search is one matrix-vector product and an argpartition, a few
+milliseconds at 10k+ snippets (see benchmarks/bench_memory.py). Saves are conditional
+on the ETag that was loaded, so two containers can't drop each other's snippets.
+
+Embeddings come from Gemini (`text-embedding-004`, cut to MEMORY_DIMENSIONS) or, locally
+and in tests, from `HashingEmbedder`: deterministic signed feature hashing of words
+and word pairs, with no network.
+
+Recall sits on the reply's hot path, so it runs in a worker thread and is abandoned
+after MEMORY_RECALL_TIMEOUT_SECONDS (the text is then answered without memories); its
+time also comes out of the model call's deadline (see `invoke_model`). The Gemini
+client's own timeout and retries can't be relied on for this: LangChain doesn't pass
+`request_options` on to the embedding calls.
+
+Memory is off unless MEMORY_BUCKET and MEMORY_SQS_NAME are set. NumPy is only
+imported once memory is used, keeping it off the cold start of handlers that don't.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from juneau_common import aws
+from juneau_common.metrics import COUNT, metrics
+from lib import conversations, models, prompt
+
+ENVIRONMENT = os.getenv("ENVIRONMENT", "local")
+MEMORIZE_ALERT_TYPE = "juneau_memorize"
+MEMORY_BUCKET = os.getenv("MEMORY_BUCKET")
+MEMORY_SQS_NAME = os.getenv("MEMORY_SQS_NAME")
+MEMORY_EMBEDDER = os.getenv("MEMORY_EMBEDDER", "hashing" if ENVIRONMENT == "local" else "gemini")
+MEMORY_DIMENSIONS = int(os.getenv("MEMORY_DIMENSIONS", "256"))
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "4"))
+MEMORY_TOKENS = int(os.getenv("MEMORY_TOKENS", "600"))  # prompt budget for recalled snippets
+MEMORY_MIN_SCORE = os.getenv("MEMORY_MIN_SCORE")  # cosine similarity; each embedder has its own default
+MEMORY_SNIPPET_CHARS = 600
+MEMORY_READ_TOKENS = 2 * prompt.MAX_CONTEXT_TOKENS  # per chat memorised; a compacted chat stops at its summary
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", "4"))  # phones whose index stays loaded per container
+MEMORY_CACHE_TTL = float(os.getenv("MEMORY_CACHE_TTL", "300"))
+MEMORY_SAVE_ATTEMPTS = 3
+MEMORY_RECALL_TIMEOUT_SECONDS = float(os.getenv("MEMORY_RECALL_TIMEOUT_SECONDS", "1.5"))  # index load and query embedding
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+
+_WORDS = re.compile(r"\w+")
+
+
+def normalise(vectors):
+    import numpy as np
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class HashingEmbedder:
+    """Deterministic stand-in for a real embedding model: signed hashing of words and word pairs."""
+    name = "hashing"
+    min_score = 0.2  # shared words only; even close paraphrases score low
+
+    def __init__(self, dimensions: int = MEMORY_DIMENSIONS):
+        self.dimensions = dimensions
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}:{self.dimensions}"
+
+    def embed(self, texts: Sequence[str], query: bool = False):
+        import numpy as np
+
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORDS.findall(text.lower())
+            for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=5).digest()
+                vectors[row, int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0 if digest[4] & 1 else -1.0
+        return normalise(vectors)
+
+
+class GeminiEmbedder:
+    name = "gemini"
+    min_score = 0.55  # unrelated texts commonly score 0.3-0.5
+
+    def __init__(self, dimensions: int = MEMORY_DIMENSIONS):
+        self.dimensions = dimensions
+        self._client = None  # (api_key, client)
+        self._lock = threading.Lock()
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}:{self.dimensions}"
+
+    def client(self):
+        api_key = models.gemini.api_key()
+        with self._lock:
+            if self._client is None or self._client[0] != api_key:
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+                self._client = (api_key, GoogleGenerativeAIEmbeddings(model=GEMINI_EMBEDDING_MODEL, google_api_key=api_key))
+            return self._client[1]
+
+    def embed(self, texts: Sequence[str], query: bool = False):
+        import numpy as np
+
+        vectors = self.client().embed_documents(
+            list(texts),
+            task_type="RETRIEVAL_QUERY" if query else "RETRIEVAL_DOCUMENT",
+            output_dimensionality=self.dimensions,
+        )
+        return normalise(np.asarray(vectors, dtype=np.float32))
+
+
+class MemoryIndex:
+    """One phone's snippets: unit vectors, their texts and the chat each came from."""
+
+    def __init__(self, embedder_id: str, vectors=None, texts: Sequence[str] = (), chat_ids=None,
+                 etag: Optional[str] = None):
+        import numpy as np
+
+        self.embedder_id = embedder_id
+        dimensions = int(embedder_id.rsplit(":", 1)[-1])
+        self.vectors = vectors if vectors is not None else np.zeros((0, dimensions), dtype=np.float32)
+        self.texts = list(texts)
+        self.chat_ids = chat_ids if chat_ids is not None else np.zeros(0, dtype=np.int64)
+        self.etag = etag  # of the stored object this was loaded from; None if there is none yet
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def has_chat(self, chat_id: int) -> bool:
+        return bool((self.chat_ids == chat_id).any())
+
+    def add(self, vectors, texts: Sequence[str], chat_id: int):
+        import numpy as np
+
+        self.vectors = np.vstack([self.vectors, vectors.astype(np.float32)])
+        self.texts.extend(texts)
+        self.chat_ids = np.concatenate([self.chat_ids, np.full(len(texts), chat_id, dtype=np.int64)])
+
+    def search(self, query, k: int = MEMORY_TOP_K, exclude_chat: Optional[int] = None,
+               min_score: float = 0.0) -> List[Tuple[float, str]]:
+        """The `k` snippets most similar to `query` (a unit vector), best first."""
+        import numpy as np
+
+        if not len(self):
+            return []
+        scores = self.vectors @ query
+        if exclude_chat is not None:
+            scores = np.where(self.chat_ids == exclude_chat, -np.inf, scores)
+        k = min(k, len(self))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[row]), self.texts[row]) for row in top if scores[row] >= min_score]
+
+    def to_bytes(self) -> bytes:
+        import numpy as np
+
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            vectors=self.vectors.astype(np.float16),
+            chat_ids=self.chat_ids,
+            # UTF-8 JSON as bytes: a NumPy string array would be UCS-4, four times the size to inflate
+            texts=np.frombuffer(json.dumps(self.texts, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+            embedder=np.array(self.embedder_id),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, etag: Optional[str] = None) -> "MemoryIndex":
+        import numpy as np
+
+        with np.load(io.BytesIO(data), allow_pickle=False) as stored:
+            return cls(
+                str(stored["embedder"]),
+                vectors=stored["vectors"].astype(np.float32),
+                texts=json.loads(stored["texts"].tobytes().decode("utf-8")),
+                chat_ids=stored["chat_ids"],
+                etag=etag,
+            )
+
+
+class MemoryStore:
+    """Per-phone indexes in S3, cached per container."""
+
+    def __init__(self, bucket: Optional[str], embedder, cache_size: int = MEMORY_CACHE_SIZE,
+                 cache_ttl: float = MEMORY_CACHE_TTL):
+        self.bucket = bucket
+        self.embedder = embedder
+        self.min_score = float(MEMORY_MIN_SCORE) if MEMORY_MIN_SCORE else embedder.min_score
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()  # phone -> (loaded_at, index)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(phone: int) -> str:
+        return f"memory/{phone}.npz"
+
+    def load(self, phone: int, fresh: bool = False) -> MemoryIndex:
+        if not fresh:
+            with self._lock:
+                entry = self._cache.get(phone)
+                if entry is not None and time.monotonic() - entry[0] <= self.cache_ttl:
+                    self._cache.move_to_end(phone)
+                    return entry[1]
+        s3 = aws.client("s3")
+        try:
+            response = s3.get_object(Bucket=self.bucket, Key=self.key(phone))
+        except s3.exceptions.NoSuchKey:
+            index = MemoryIndex(self.embedder.id)
+        else:
+            index = MemoryIndex.from_bytes(response["Body"].read(), response["ETag"])
+            if index.embedder_id != self.embedder.id:
+                logging.warning(f"Memory of {phone} was built with {index.embedder_id}; starting over")
+                index = MemoryIndex(self.embedder.id, etag=index.etag)
+        self._remember(phone, index)
+        return index
+
+    def save(self, phone: int, index: MemoryIndex) -> bool:
+        """Store `index` unless someone else stored theirs since it was loaded."""
+        from botocore.exceptions import ClientError
+
+        condition = {"IfMatch": index.etag} if index.etag else {"IfNoneMatch": "*"}
+        try:
+            response = aws.client("s3").put_object(
+                Bucket=self.bucket, Key=self.key(phone), Body=index.to_bytes(), **condition,
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict"):
+                return False
+            raise
+        index.etag = response["ETag"]
+        self._remember(phone, index)
+        return True
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _remember(self, phone: int, index: MemoryIndex):
+        with self._lock:
+            self._cache[phone] = (time.monotonic(), index)
+            self._cache.move_to_end(phone)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def enabled() -> bool:
+    return bool(MEMORY_BUCKET and MEMORY_SQS_NAME)
+
+
+def snippets(turns: List[dict], max_chars: int = MEMORY_SNIPPET_CHARS) -> List[str]:
+    """A chat's summary, if any, and each exchange (texts plus the reply) as one snippet."""
+    found, exchange = [], []
+    for turn in turns:
+        if turn.get('summary'):
+            found.append(f"Summary: {turn['text']}"[:max_chars])
+            continue
+        exchange.append(f"{'User' if turn['human'] else 'Assistant'}: {turn['text']}")
+        if not turn['human']:
+            found.append("\n".join(exchange)[:max_chars])
+            exchange = []
+    if exchange:
+        found.append("\n".join(exchange)[:max_chars])
+    return found
+
+
+def schedule(phone: int, chat_id: int, recipient: str) -> bool:
+    """Queue memorising a chat that was just left behind."""
+    if not enabled():
+        return False
+    aws.send_to_queue(
+        MEMORY_SQS_NAME,
+        MessageBody=json.dumps({"alert_type": MEMORIZE_ALERT_TYPE, "recipient": recipient,
+                                "phone": phone, "chat_id": chat_id}),
+    )
+    return True
+
+
+def memorize(phone: int, chat_id: int) -> int:
+    """Add a chat's snippets to the phone's index; returns how many were added."""
+    index = store.load(phone, fresh=True)
+    if index.has_chat(chat_id):
+        return 0  # redelivered job
+    texts = snippets(conversations.recent_turns(phone, chat_id, token_budget=MEMORY_READ_TOKENS))
+    if not texts:
+        return 0
+    with metrics.timer("MemoryEmbed"):
+        vectors = store.embedder.embed(texts)
+    for _ in range(MEMORY_SAVE_ATTEMPTS):
+        index.add(vectors, texts, chat_id)
+        if store.save(phone, index):
+            metrics.put("MemorySnippets", len(texts), COUNT)
+            logging.info(f"Memorised {len(texts)} snippets of chat {chat_id} for {phone} ({len(index)} in total)")
+            return len(texts)
+        index = store.load(phone, fresh=True)  # another container saved first; add ours to theirs
+        if index.has_chat(chat_id):
+            return 0
+    raise RuntimeError(f"Could not save the memory of {phone} after {MEMORY_SAVE_ATTEMPTS} attempts")
+
+
+def within(seconds: float, work):
+    """`work()`, run in a daemon thread and abandoned with TimeoutError after `seconds`."""
+    results = queue.Queue(maxsize=1)
+
+    def run():
+        try:
+            results.put((True, work()))
+        except Exception as e:
+            results.put((False, e))
+
+    threading.Thread(target=run, name="memory-recall", daemon=True).start()
+    try:
+        succeeded, value = results.get(timeout=seconds)
+    except queue.Empty:
+        raise TimeoutError(f"No result within {seconds:.1f}s") from None
+    if not succeeded:
+        raise value
+    return value
+
+
+def recall(phone: int, chat_id: int, texts: List[str], budget: int = MEMORY_TOKENS,
+           timeout: float = MEMORY_RECALL_TIMEOUT_SECONDS) -> List[str]:
+    """Snippets from the phone's earlier chats relevant to `texts`, within `budget` tokens and `timeout` seconds."""
+    if not enabled():
+        return []
+
+    def search():
+        index = store.load(phone)
+        if not len(index) or not (index.chat_ids != chat_id).any():
+            return []
+        query = store.embedder.embed(["\n".join(texts)], query=True)[0]
+        return index.search(query, exclude_chat=chat_id, min_score=store.min_score)
+
+    try:
+        with metrics.timer("MemoryRecall"):
+            hits = within(timeout, search)
+    except TimeoutError:
+        metrics.count("MemoryRecallTimeouts")
+        logging.warning(f"Memory recall for {phone} took longer than {timeout}s; answering without it")
+        return []
+    except Exception as e:  # answering without memories beats not answering
+        logging.warning(f"Memory recall failed for {phone}: {e!r}")
+        return []
+    recalled, used = [], 0
+    for _, text in hits:
+        used += prompt.count_tokens(text, human=False)
+        if used > budget:
+            break
+        recalled.append(text)
+    metrics.put("MemoryRecalled", len(recalled), COUNT)
+    return recalled
+
+
+EMBEDDERS = {"hashing": HashingEmbedder, "gemini": GeminiEmbedder}
+store = MemoryStore(MEMORY_BUCKET, EMBEDDERS[MEMORY_EMBEDDER]())
@@ -0,0 +1,244 @@
+"""
+Chat model backends with warm clients, per-call deadlines and optional hedging.
+
+Each backend keeps one LangChain client per container, rebuilt only when its API key
+rotates. Gemini is the primary; Anthropic becomes the secondary when
+ANTHROPIC_SECRET_NAME (or ANTHROPIC_API_KEY locally) is set. Calls run in worker
+threads and give up after MODEL_TIMEOUT_SECONDS, so one stuck request fails its
+record (SQS retries it) instead of using up the Lambda timeout.
+
+With MODEL_HEDGING on and a secondary configured, a call whose primary has produced
+no output after the HEDGE_PERCENTILE of its recent latencies also starts the
+secondary, and whichever answers first wins; the other is abandoned. "Output" is the
+whole reply for a plain call and the first chunk for a streamed one, so a streamed
+reply never mixes backends. A primary that fails before any output fails over to the
+secondary. The winner is counted as `ModelBackend.<name>`.
+
+Each backend maps the routing tiers (see lib/routing.py) to one of its models and
+keeps a client per model; hedging delays are learned per tier.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from juneau_common import secrets
+from juneau_common.metrics import metrics
+
+ENVIRONMENT = os.getenv("ENVIRONMENT", "local")
+LIGHT = "light"
+STANDARD = "standard"
+GEMINI_MODELS = {
+    LIGHT: os.getenv("GEMINI_LIGHT_MODEL", "gemini-2.0-flash-lite"),
+    STANDARD: "gemini-2.0-flash",  # 1M context window
+}
+ANTHROPIC_MODELS = {
+    LIGHT: os.getenv("ANTHROPIC_MODEL", "claude-3-5-haiku-latest"),
+    STANDARD: os.getenv("ANTHROPIC_MODEL", "claude-3-5-haiku-latest"),
+}
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", "20"))  # per call, across both backends
+MODEL_HEDGING = os.getenv("MODEL_HEDGING", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_DELAY_SECONDS = float(os.getenv("HEDGE_DELAY_SECONDS", "4"))  # until HEDGE_MIN_SAMPLES latencies are known
+HEDGE_MIN_SAMPLES = 10
+HEDGE_WINDOW = 200  # recent primary latencies kept per mode
+MODEL_MAX_RETRIES = 1  # the client defaults retry for longer than the deadline; failover and SQS retry instead
+
+
+class ModelTimeoutError(TimeoutError):
+    """No backend finished the reply within MODEL_TIMEOUT_SECONDS."""
+
+
+@dataclass
+class Reply:
+    text: str
+    backend: str
+    usage: List[Optional[dict]] = field(default_factory=list)  # usage_metadata per message/chunk
+    hedged: bool = False
+
+
+class Backend:
+    def __init__(self, name: str, build: Callable[[str, str], object], models: Dict[str, str],
+                 secret_name_variable: str, key_name: str):
+        self.name = name
+        self.build = build  # (API key, model name) -> LangChain chat model
+        self.models = models  # tier -> model name
+        self.secret_name_variable = secret_name_variable  # environment variable naming the secret
+        self.key_name = key_name  # key in that secret, and the environment variable used locally
+        self._clients = {}  # model name -> (api_key, client)
+        self._lock = threading.Lock()
+
+    def configured(self) -> bool:
+        variable = self.key_name if ENVIRONMENT == "local" else self.secret_name_variable
+        return bool(os.getenv(variable))
+
+    def api_key(self) -> Optional[str]:
+        if ENVIRONMENT == "local":
+            return os.getenv(self.key_name)
+        return secrets.get_secret(os.getenv(self.secret_name_variable)).get(self.key_name)
+
+    def client(self, tier: str = STANDARD):
+        """The container's client for `tier`, rebuilt if the key was rotated since it was made."""
+        model = self.models[tier]
+        api_key = self.api_key()
+        with self._lock:
+            cached = self._clients.get(model)
+            if cached is None or cached[0] != api_key:
+                cached = self._clients[model] = (api_key, self.build(api_key, model))
+            return cached[1]
+
+    def reset(self):
+        with self._lock:
+            self._clients.clear()
+
+
+def build_gemini(api_key: str, model: str):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(model=model, google_api_key=api_key,
+                                  timeout=MODEL_TIMEOUT_SECONDS, max_retries=MODEL_MAX_RETRIES)
+
+
+def build_anthropic(api_key: str, model: str):
+    from langchain_anthropic import ChatAnthropic
+
+    return ChatAnthropic(model=model, api_key=api_key,
+                         timeout=MODEL_TIMEOUT_SECONDS, max_retries=MODEL_MAX_RETRIES)
+
+
+def _text(content) -> str:
+    """Message content as text; some backends stream lists of content blocks."""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+
+
+class ModelPool:
+    def __init__(self, primary: Backend, secondary: Optional[Backend] = None, timeout: float = MODEL_TIMEOUT_SECONDS,
+                 hedging: bool = MODEL_HEDGING, percentile: float = HEDGE_PERCENTILE):
+        self.primary = primary
+        self.secondary = secondary
+        self.timeout = timeout
+        self.hedging = hedging
+        self.percentile = percentile
+        self._latencies: Dict[tuple, deque] = defaultdict(lambda: deque(maxlen=HEDGE_WINDOW))  # (mode, tier) -> seconds
+
+    def hedge_delay(self, mode: str, tier: str = STANDARD) -> float:
+        """Seconds to wait for the primary's first output before starting the secondary."""
+        samples = sorted(self._latencies[mode, tier])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DELAY_SECONDS
+        return samples[min(len(samples) - 1, int(self.percentile * len(samples)))]
+
+    def generate(self, messages: list, on_chunk: Optional[Callable[[str], None]] = None,
+                 tier: str = STANDARD, deadline: Optional[float] = None) -> Reply:
+        """
+        Reply to `messages` with each backend's model for `tier`. With `on_chunk` the reply
+        is streamed and every chunk of the winning backend is handed over as it arrives.
+        `deadline` (a `time.monotonic()` value) replaces the pool's timeout when the time
+        spent preparing the call counts against it too.
+        """
+        mode = "invoke" if on_chunk is None else "stream"
+        secondary = self.secondary if self.secondary and self.secondary.configured() else None
+        events = queue.Queue()
+        cancelled: Dict[str, threading.Event] = {}
+        started = time.monotonic()
+        deadline = started + self.timeout if deadline is None else min(deadline, started + self.timeout)
+        hedge_at = started + self.hedge_delay(mode, tier) if self.hedging and secondary else None
+
+        def start(backend: Backend):
+            cancelled[backend.name] = threading.Event()
+            threading.Thread(
+                target=self._attempt,
+                args=(backend, tier, messages, on_chunk is not None, events, cancelled[backend.name]),
+                name=f"model-{backend.name}", daemon=True,
+            ).start()
+
+        def abandon():
+            for flag in cancelled.values():
+                flag.set()
+
+        start(self.primary)
+        winner, hedged, errors = None, False, {}
+        parts, usage = [], []
+        while True:
+            now = time.monotonic()
+            wake = min(deadline, hedge_at) if hedge_at and winner is None else deadline
+            try:
+                name, kind, value, chunk_usage = events.get(timeout=max(0.0, wake - now))
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    abandon()
+                    metrics.count("ModelTimeouts")
+                    raise ModelTimeoutError(f"No reply from {', '.join(cancelled)} within {deadline - started:.0f}s")
+                hedge_at = None
+                hedged = True
+                metrics.count("ModelHedges")
+                start(secondary)
+                continue
+
+            if winner is None and kind == "chunk":
+                winner = name
+                for other, flag in cancelled.items():
+                    if other != name:
+                        flag.set()
+                if name == self.primary.name or self.primary.name not in errors:
+                    # When the secondary wins, the primary took at least this long
+                    self._latencies[mode, tier].append(time.monotonic() - started)
+            if winner is not None and name != winner:
+                continue
+
+            if kind == "chunk":
+                text = _text(value)
+                parts.append(text)
+                usage.append(chunk_usage)
+                if on_chunk is not None and text:
+                    on_chunk(text)
+            elif kind == "done":
+                metrics.count(f"ModelBackend.{winner}")
+                return Reply(text="".join(parts), backend=winner, usage=usage, hedged=hedged)
+            else:  # error
+                if winner is not None:
+                    raise value  # part of the reply may already be out; let the record be retried
+                errors[name] = value
+                logging.warning(f"Model backend {name} failed: {value!r}")
+                if secondary and secondary.name not in cancelled:
+                    hedge_at = None
+                    metrics.count("ModelFailovers")
+                    start(secondary)
+                elif len(errors) == len(cancelled):
+                    raise errors[self.primary.name]
+
+    @staticmethod
+    def _attempt(backend: Backend, tier: str, messages: list, stream: bool, events: queue.Queue,
+                 cancelled: threading.Event):
+        try:
+            model = backend.client(tier)
+            if stream:
+                for chunk in model.stream(messages):
+                    if cancelled.is_set():
+                        return
+                    events.put((backend.name, "chunk", chunk.content, chunk.usage_metadata))
+            else:
+                response = model.invoke(messages)
+                events.put((backend.name, "chunk", response.content, response.usage_metadata))
+            events.put((backend.name, "done", None, None))
+        except Exception as e:
+            events.put((backend.name, "error", e, None))
+
+    def reset(self):
+        """Drop the warm clients (e.g. after a SnapStart restore) and the latency history."""
+        for backend in (self.primary, self.secondary):
+            if backend:
+                backend.reset()
+        self._latencies.clear()
+
+
+gemini = Backend("gemini", build_gemini, GEMINI_MODELS, "GEMINI_SECRET_NAME", "GEMINI_API_KEY")
+anthropic = Backend("anthropic", build_anthropic, ANTHROPIC_MODELS, "ANTHROPIC_SECRET_NAME", "ANTHROPIC_API_KEY")
+pool = ModelPool(gemini, anthropic)  # anthropic only takes part once its key is configured
@@ -0,0 +1,80 @@
+"""
+Token-budgeted prompt assembly.
+
+Every stored turn carries a precomputed `tokens` count (same approximation as
+LangChain's `count_tokens_approximately`), so building the prompt walks backwards
+from the newest turn, stops as soon as the budget is used up, and only creates
+LangChain message objects for the turns that fit. The cost is proportional to the
+context window instead of the whole stored history.
+
+A chat's history may start with a summary of its compacted turns; it always goes
+into the system message, ahead of the turns that fit in what is left of the budget.
+Snippets recalled from the phone's earlier chats (see lib/memory.py) follow it there.
+"""
+
+import math
+from typing import List, Sequence
+
+MAX_CONTEXT_TOKENS = 16000  # Could do 1M, but that's not practical for response times nor for the texting modality; 16k should be plenty.
+CHARS_PER_TOKEN = 4.0
+SUMMARY_HEADER = "\nSummary of our earlier conversation:\n"
+MEMORIES_HEADER = "\nFrom earlier chats (may be relevant):\n"
+EXTRA_TOKENS_PER_MESSAGE = 3
+
+
+def count_tokens(text: str, human: bool) -> int:
+    """Approximate tokens for one message, matching `count_tokens_approximately`."""
+    role = "user" if human else "assistant"
+    return math.ceil((len(text) + len(role)) / CHARS_PER_TOKEN) + EXTRA_TOKENS_PER_MESSAGE
+
+
+def system_tokens(prompt: str) -> int:
+    return math.ceil((len(prompt) + len("system")) / CHARS_PER_TOKEN) + EXTRA_TOKENS_PER_MESSAGE
+
+
+def turn_tokens(turn: dict) -> int:
+    tokens = turn.get('tokens')
+    if tokens is None:  # turns written before token counts were stored
+        return count_tokens(turn['text'], turn['human'])
+    return int(tokens)
+
+
+def select_turns(turns: List[dict], budget: int) -> List[dict]:
+    """
+    The newest turns (oldest first) whose tokens fit in `budget`, starting on a human
+    turn. Turns must be ordered oldest first; older ones are never looked at once the
+    budget is reached.
+    """
+    used = 0
+    start = len(turns)
+    for index in range(len(turns) - 1, -1, -1):
+        used += turn_tokens(turns[index])
+        if used > budget:
+            break
+        start = index
+    while start < len(turns) and not turns[start]['human']:
+        start += 1
+    return turns[start:]
+
+
+def build_messages(system_prompt: str, turns: List[dict], budget: int = MAX_CONTEXT_TOKENS,
+                   memories: Sequence[str] = ()) -> list:
+    """System message (with the summary and memories, if any) plus the newest turns that fit in `budget`."""
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    if turns and turns[0].get('summary'):
+        system_prompt = f"{system_prompt}{SUMMARY_HEADER}{turns[0]['text']}"
+        turns = turns[1:]
+    if memories:
+        system_prompt += MEMORIES_HEADER + "\n".join(f"- {memory}" for memory in memories)
+    selected = select_turns(turns, budget - system_tokens(system_prompt))
+    messages = [SystemMessage(content=system_prompt)]
+    for turn in selected:
+        if turn['human'] and isinstance(messages[-1], HumanMessage):
+            # Rapid-fire texts answered together are stored separately but sent as one turn
+            messages[-1] = HumanMessage(content=f"{messages[-1].content}\n{turn['text']}")
+        elif turn['human']:
+            messages.append(HumanMessage(content=turn['text']))
+        else:
+            messages.append(AIMessage(content=turn['text']))
+    return messages
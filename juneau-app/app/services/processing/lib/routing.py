@@ -0,0 +1,121 @@
+"""
+Routing of inbound texts to a model tier and context budget.
+
+Most texts are short, and they shouldn't all pay for the standard model with the full
+context window. `route` looks only at cheap local features of the texts being
+answered and of the chat so far, and picks:
+
+- canned: a bare acknowledgement ("ok thx", "👍", "bye") that doesn't answer a
+  question from us gets a fixed reply without calling a model;
+- light: a short text with at most one question and no attachments, in a chat that
+  isn't deep yet, goes to the light model with a smaller context budget;
+- standard: everything else, as before routing existed.
+
+Every decision is logged as one `{"juneau_route": ...}` JSON line with its features
+and outcome (backend, latency, tokens), so the thresholds can be tuned from
+CloudWatch Logs Insights.
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from juneau_common.metrics import metrics
+from lib import prompt
+from lib.models import LIGHT, STANDARD
+
+CANNED = "canned"
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "true").lower() == "true"
+LIGHT_MAX_CHARS = int(os.getenv("ROUTE_LIGHT_MAX_CHARS", "160"))
+LIGHT_MAX_QUESTIONS = int(os.getenv("ROUTE_LIGHT_MAX_QUESTIONS", "1"))
+LIGHT_MAX_HISTORY_TURNS = int(os.getenv("ROUTE_LIGHT_MAX_HISTORY_TURNS", "30"))
+BUDGETS = {  # context tokens per tier
+    LIGHT: int(os.getenv("ROUTE_LIGHT_BUDGET", "4000")),
+    STANDARD: prompt.MAX_CONTEXT_TOKENS,
+}
+
+THANKS_WORDS = {"thanks", "thank", "thx", "ty", "tysm", "tks", "🙏"}
+BYE_WORDS = {"bye", "goodnight", "gn", "ttyl", "cya", "night"}
+ACK_WORDS = {
+    "ok", "okay", "okk", "k", "kk", "cool", "got", "sounds", "good", "great", "nice", "perfect",
+    "alright", "awesome", "lol", "haha", "👍", "👌", "😊", "❤️", "🙂",
+} | THANKS_WORDS | BYE_WORDS
+FILLER_WORDS = {"it", "you", "u", "so", "much", "a", "lot", "very"}  # only alongside an acknowledgement
+CANNED_REPLIES = {
+    "thanks": "Anytime!",
+    "bye": "Talk soon!",
+    "ok": "👍",
+}
+
+_PUNCTUATION = re.compile(r"[.,!;:~…\-]+")
+
+
+@dataclass
+class Route:
+    tier: str
+    budget: int
+    reason: str
+    features: Dict[str, Any] = field(default_factory=dict)
+    reply: Optional[str] = None  # the canned reply
+
+
+def features(texts: List[str], history: List[dict], attachments: int = 0) -> Dict[str, Any]:
+    text = "\n".join(texts)
+    history = [turn for turn in history if not turn.get('summary')]
+    last_reply = next((turn['text'] for turn in reversed(history) if not turn['human']), "")
+    return {
+        "chars": len(text),
+        "texts": len(texts),
+        "questions": text.count("?"),
+        "attachments": attachments,
+        "history_turns": len(history),
+        "after_question": last_reply.rstrip().endswith("?"),  # a bare "ok" may be answering us
+    }
+
+
+def acknowledgement(texts: List[str]) -> Optional[str]:
+    """The kind of canned reply `texts` call for, or None if they say anything more."""
+    words = _PUNCTUATION.sub(" ", " ".join(texts).lower()).split()
+    if not any(word in ACK_WORDS for word in words) or any(word not in ACK_WORDS | FILLER_WORDS for word in words):
+        return None
+    if any(word in BYE_WORDS for word in words):
+        return "bye"
+    if any(word in THANKS_WORDS for word in words):
+        return "thanks"
+    return "ok"
+
+
+def route(texts: List[str], history: List[dict], attachments: int = 0) -> Route:
+    """Tier and context budget for answering `texts` in a chat with `history` (oldest first)."""
+    found = features(texts, history, attachments)
+    if not MODEL_ROUTING:
+        return Route(STANDARD, BUDGETS[STANDARD], "routing off", found)
+    if not (found["attachments"] or found["questions"] or found["after_question"]):
+        kind = acknowledgement(texts)
+        if kind:
+            return Route(CANNED, 0, f"acknowledgement ({kind})", found, reply=CANNED_REPLIES[kind])
+    if found["attachments"]:
+        return Route(STANDARD, BUDGETS[STANDARD], "attachments", found)
+    if found["chars"] > LIGHT_MAX_CHARS:
+        return Route(STANDARD, BUDGETS[STANDARD], "long text", found)
+    if found["questions"] > LIGHT_MAX_QUESTIONS:
+        return Route(STANDARD, BUDGETS[STANDARD], "several questions", found)
+    if found["history_turns"] > LIGHT_MAX_HISTORY_TURNS:
+        return Route(STANDARD, BUDGETS[STANDARD], "deep history", found)
+    return Route(LIGHT, BUDGETS[LIGHT], "short text", found)
+
+
+def record(decision: Route, **outcome):
+    """Log the decision with its outcome and count it per tier."""
+    metrics.count(f"Route.{decision.tier}")
+    print(json.dumps({
+        "juneau_route": 1,
+        "tier": decision.tier,
+        "reason": decision.reason,
+        "budget": decision.budget,
+        "features": decision.features,
+        "outcome": outcome,
+    }, ensure_ascii=False, separators=(",", ":")), flush=True)
@@ -0,0 +1,141 @@
+"""
+Per-phone chat session counter in the `UserChats` table.
+
+Starting a new chat ('✨') is a single atomic `ADD` update that returns the new
+chat_id, so concurrent records for the same phone can never be handed the same id
+and no read is needed first. The current chat_id is cached per container, but only
+trusted within one invocation (the processing handler calls `invalidate` first) and
+for a few seconds at most: the next text after a '✨' is often handled by another
+container, and must not land in the chat that was just left.
+
+The counter used to be stored as `my_int_attribute`. Items that still only have it
+are read through that name, and their first rotation moves it over to `chat_id`
+with a conditional write, so an upgraded phone continues its count instead of
+starting again at chat 1. An item with both attributes was counted from 1 again by
+an earlier release; tools/migrate_turns.py looks for those.
+
+The item also carries the phone's legacy watermark, `legacy_through`: the highest
+chat_id that may still have history in UserConversations only (-1 for none). The
+upgrade records the legacy count there, tools/migrate_turns.py sets it to -1, and a
+new phone is marked -1 once its first read finds nothing, so chats started since
+never read the legacy table (see lib/conversations.py).
+"""
+
+import os
+import threading
+import time
+
+from juneau_common import aws
+
+CHATS_TABLE = "UserChats"
+CHAT_ID_CACHE_TTL = float(os.getenv("CHAT_ID_CACHE_TTL", "5"))
+LEGACY_COUNTER = 'my_int_attribute'  # the counter's name before it became `chat_id`
+LEGACY_WATERMARK = 'legacy_through'
+NO_LEGACY = -1
+
+
+def legacy_watermark(item: dict) -> int:
+    """The highest chat_id of a UserChats item's phone that may have legacy history."""
+    if LEGACY_WATERMARK in item:
+        return int(item[LEGACY_WATERMARK])
+    if LEGACY_COUNTER in item:  # not upgraded (or restarted): every chat so far is legacy
+        return int(item[LEGACY_COUNTER])
+    if 'chat_id' in item:  # counted since the rename only
+        return NO_LEGACY
+    return 0  # no counter: the phone's only chat may predate the rename, until `mark_no_legacy`
+
+
+class ChatSessions:
+    def __init__(self, cache_ttl: float = CHAT_ID_CACHE_TTL):
+        self.cache_ttl = cache_ttl
+        self._cache = {}  # phone -> (cached_at, chat_id, legacy watermark)
+        self._lock = threading.Lock()
+
+    def current(self, phone: int) -> int:
+        """The phone's current chat_id (0 if it never started one)."""
+        return self._entry(phone)[0]
+
+    def legacy_through(self, phone: int) -> int:
+        """The highest chat_id that may have history in UserConversations only, or -1."""
+        return self._entry(phone)[1]
+
+    def mark_no_legacy(self, phone: int):
+        """Record that a phone without a counter has no legacy history, so it isn't looked for again."""
+        table = aws.table(CHATS_TABLE)
+        try:
+            table.put_item(
+                Item={'phone': phone, 'chat_id': 0, LEGACY_WATERMARK: NO_LEGACY},
+                ConditionExpression='attribute_not_exists(phone)',
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            self.invalidate(phone)  # it has a counter after all; read it again next time
+            return
+        except Exception as e:  # the next read will try again
+            print(f"Could not mark {phone} as having no legacy history: {e}")
+            self.invalidate(phone)
+            return
+        self._remember(phone, 0, NO_LEGACY)
+
+    def _entry(self, phone: int):
+        with self._lock:
+            entry = self._cache.get(phone)
+        if entry is not None and time.monotonic() - entry[0] < self.cache_ttl:
+            return entry[1:]
+        response = aws.table(CHATS_TABLE).get_item(
+            Key={'phone': phone},
+            ProjectionExpression=f'chat_id, {LEGACY_COUNTER}, {LEGACY_WATERMARK}',
+        )
+        item = response.get('Item', {})
+        chat_id, watermark = int(item.get('chat_id', item.get(LEGACY_COUNTER, 0))), legacy_watermark(item)
+        self._remember(phone, chat_id, watermark)
+        return chat_id, watermark
+
+    def rotate(self, phone: int) -> int:
+        """Start a new chat and return its id, in one round trip unless the counter is legacy."""
+        table = aws.table(CHATS_TABLE)
+        try:
+            response = self._increment(
+                table, phone, f'attribute_exists(chat_id) OR attribute_not_exists({LEGACY_COUNTER})',
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            try:  # first rotation since the rename: continue from the legacy count
+                response = table.update_item(
+                    Key={'phone': phone},
+                    UpdateExpression=(f'SET chat_id = {LEGACY_COUNTER} + :one, {LEGACY_WATERMARK} = {LEGACY_COUNTER} '
+                                      f'REMOVE {LEGACY_COUNTER}'),
+                    ConditionExpression='attribute_not_exists(chat_id)',
+                    ExpressionAttributeValues={':one': 1},
+                    ReturnValues='ALL_NEW',
+                )
+            except table.meta.client.exceptions.ConditionalCheckFailedException:
+                response = self._increment(table, phone)  # another container upgraded it first
+        item = response['Attributes']
+        chat_id = int(item['chat_id'])
+        self._remember(phone, chat_id, legacy_watermark(item))
+        return chat_id
+
+    @staticmethod
+    def _increment(table, phone: int, condition: str = None) -> dict:
+        update = dict(
+            Key={'phone': phone},
+            UpdateExpression='ADD chat_id :one',
+            ExpressionAttributeValues={':one': 1},
+            ReturnValues='ALL_NEW',  # the watermark too
+        )
+        if condition:
+            update['ConditionExpression'] = condition
+        return table.update_item(**update)
+
+    def invalidate(self, phone: int = None):
+        with self._lock:
+            if phone is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(phone, None)
+
+    def _remember(self, phone: int, chat_id: int, watermark: int):
+        with self._lock:
+            self._cache[phone] = (time.monotonic(), chat_id, watermark)
+
+
+sessions = ChatSessions()
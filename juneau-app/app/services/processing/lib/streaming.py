@@ -0,0 +1,57 @@
+"""
+Split a streamed model reply into text-message sized chunks.
+
+Tokens are buffered until a paragraph break, or a sentence end once the buffer is
+long enough to be worth its own bubble, and each complete chunk is released right
+away so the first bubble can go out while the model is still generating.
+"""
+
+import os
+import re
+from typing import Iterator, List
+
+STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", "80"))  # don't send a bubble for every short sentence
+STREAM_MAX_CHARS = int(os.getenv("STREAM_MAX_CHARS", "600"))  # force a split on very long runs without punctuation
+
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"[.!?…](?:[\"')\]]*)\s+")
+
+
+class SentenceChunker:
+    def __init__(self, min_chars: int = STREAM_MIN_CHARS, max_chars: int = STREAM_MAX_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add streamed text and return any chunks that are now complete."""
+        self._buffer += text
+        return list(self._drain())
+
+    def flush(self) -> List[str]:
+        """Return whatever is left once the stream has ended."""
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+    def _drain(self) -> Iterator[str]:
+        while True:
+            cut = self._next_cut()
+            if cut is None:
+                return
+            chunk, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:]
+            if chunk:
+                yield chunk
+
+    def _next_cut(self):
+        paragraph = _PARAGRAPH.search(self._buffer)
+        if paragraph:
+            return paragraph.end()
+        cut = None
+        for sentence in _SENTENCE_END.finditer(self._buffer):
+            if sentence.end() >= self.min_chars:
+                cut = sentence.end()
+                break
+        if cut is None and len(self._buffer) > self.max_chars:
+            space = self._buffer.rfind(" ", 0, self.max_chars)
+            cut = space + 1 if space > 0 else self.max_chars
+        return cut
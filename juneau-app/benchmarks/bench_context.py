@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark: prompt assembly for long chats.
+
+Compares the old path in `invoke_model` (build a LangChain message for every stored
+turn, then `trim_messages` with `count_tokens_approximately`) against
+`lib.prompt.build_messages`, which walks back from the newest turn using the token
+counts stored on each turn.
+
+    python benchmarks/bench_context.py --turns 10000 --repeat 20
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+SERVICES_DIR = Path(__file__).resolve().parents[1] / "app" / "services"
+sys.path[:0] = [str(SERVICES_DIR / "common"), str(SERVICES_DIR / "processing")]
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, trim_messages, utils  # noqa: E402
+
+from lib.prompt import MAX_CONTEXT_TOKENS, build_messages, count_tokens  # noqa: E402
+
+SYSTEM_PROMPT = "As my AI assistant, answer my texts succinctly and try to match my tone.\n"
+WORDS = "sure thing let me check the calendar for tomorrow and get back to you about dinner plans".split()
+
+
+def make_history(turns: int, seed: int = 7):
+    rng = random.Random(seed)
+    history = []
+    for index in range(turns):
+        human = index % 2 == 0
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 60 if human else 120)))
+        history.append({'text': text, 'human': human, 'tokens': count_tokens(text, human)})
+    return history
+
+
+def trim_path(history):
+    messages = [SystemMessage(content=SYSTEM_PROMPT)]
+    for turn in history:
+        messages.append(HumanMessage(content=turn['text']) if turn['human'] else AIMessage(content=turn['text']))
+    return trim_messages(
+        messages,
+        max_tokens=MAX_CONTEXT_TOKENS,
+        strategy="last",
+        token_counter=utils.count_tokens_approximately,
+        start_on="human",
+        include_system=True,
+        allow_partial=False,
+    )
+
+
+def budget_path(history):
+    return build_messages(SYSTEM_PROMPT, history, budget=MAX_CONTEXT_TOKENS)
+
+
+def measure(fn, history, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(history)
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    fn(history)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    history = make_history(args.turns)
+    old, new = trim_path(history), budget_path(history)
+    same = [(type(m), m.content) for m in old] == [(type(m), m.content) for m in new]
+    print(f"{args.turns} turns, {len(new) - 1} fit in {MAX_CONTEXT_TOKENS} tokens, identical prompts: {same}")
+
+    print(f"{'path':<16}{'median ms':>12}{'peak KiB':>12}")
+    for name, fn in (("trim_messages", trim_path), ("build_messages", budget_path)):
+        median_ms, peak_kib = measure(fn, history, args.repeat)
+        print(f"{name:<16}{median_ms:>12.2f}{peak_kib:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark: stored size and DynamoDB capacity of conversation turns per encoding.
+
+Builds chats of realistic length (texts of a few to 60 words, replies up to 120, with
+English-like word frequencies) and compares, per chat:
+
+- list: the legacy UserConversations item, one `messages` list appended to per turn
+  (each append rewrites, and bills, the whole item);
+- item: one plain ConversationTurns item per turn;
+- page/<codec>: one page item per exchange (lib/encoding.py), uncompressed, zlib, zstd.
+
+Capacity units follow DynamoDB's rounding: a write is billed per item in 1 KB steps,
+an eventually consistent read of the whole chat in 4 KB steps of the total size.
+
+    python benchmarks/bench_encoding.py --chats 50 --exchanges 100 --repeat 200
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+SERVICES_DIR = Path(__file__).resolve().parents[1] / "app" / "services"
+sys.path[:0] = [str(SERVICES_DIR / "common"), str(SERVICES_DIR / "processing")]
+
+from lib import encoding  # noqa: E402
+from lib.conversations import new_turn  # noqa: E402
+
+WORDS = (
+    "the I you to a and it is that of for in me my this on we be have with just can so what do "
+    "not but are at was if your get like about know think it's all will would one up out time "
+    "go need want now how good some more want when tomorrow today dinner work plan meeting call "
+    "friday weekend trip flight hotel book table gym run week morning night email reply send "
+    "draft message text landlord rent budget groceries list recipe cook pasta chicken salad gift "
+    "mom dad sister birthday party wedding dentist doctor appointment schedule calendar remind "
+    "sure great thanks sounds here's option idea maybe better instead could should first then "
+    "next step try also because really still sorry yes no okay let me check again later soon"
+).split()
+
+
+def make_chat(exchanges: int, rng: random.Random, phone: int, chat_id: int):
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]  # Zipf-like
+
+    def sentence(low, high):
+        return " ".join(rng.choices(WORDS, weights, k=rng.randint(low, high))).capitalize() + "."
+
+    pages = []
+    for _ in range(exchanges):
+        texts = [new_turn(phone, chat_id, sentence(3, 60), human=True, language="en")
+                 for _ in range(rng.choice((1, 1, 1, 2)))]
+        pages.append(texts + [new_turn(phone, chat_id, sentence(10, 120), human=False)])
+    return pages
+
+
+def list_costs(pages):
+    """Bytes, WCUs and read RCUs of the legacy list item after every turn was appended."""
+    messages, wcu = [], 0
+    for page in pages:
+        for turn in page:
+            messages.append([turn['text'], turn['human']])
+            wcu += encoding.write_units([{'phone': turn['phone'], 'chat_id': turn['chat_id'], 'messages': messages}])
+    item = {'phone': pages[0][0]['phone'], 'chat_id': pages[0][0]['chat_id'], 'messages': messages}
+    return encoding.item_size(item), wcu, encoding.read_units([item])
+
+
+def item_costs(pages):
+    items = [turn for page in pages for turn in page]
+    return sum(map(encoding.item_size, items)), encoding.write_units(items), encoding.read_units(items)
+
+
+def page_costs(pages, codec):
+    items = [encoding.page_item(page, codec) for page in pages]
+    return sum(map(encoding.item_size, items)), encoding.write_units(items), encoding.read_units(items)
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--exchanges", type=int, default=100, help="exchanges per chat")
+    parser.add_argument("--repeat", type=int, default=200, help="timings of encoding one page")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    chats = [make_chat(args.exchanges, rng, 15550000000 + index, 0) for index in range(args.chats)]
+    codecs = [("page/none", encoding.NONE), ("page/zlib", encoding.ZLIB)]
+    try:
+        encoding.compress(b"", encoding.ZSTD)
+        codecs.append(("page/zstd", encoding.ZSTD))
+    except RuntimeError:
+        print("zstandard is not installed; skipping zstd")
+
+    rows = [("list", [list_costs(chat) for chat in chats], None),
+            ("item", [item_costs(chat) for chat in chats], None)]
+    rows += [(name, [page_costs(chat, codec) for chat in chats], codec) for name, codec in codecs]
+
+    turns = sum(len(page) for chat in chats for page in chat)
+    print(f"{args.chats} chats, {args.exchanges} exchanges and {turns / args.chats:.0f} turns each; per chat:")
+    print(f"{'encoding':<12}{'KiB':>9}{'WCU':>9}{'RCU read':>10}{'encode µs':>11}{'decode µs':>11}")
+    sample = chats[0][0]
+    for name, costs, codec in rows:
+        size, wcu, rcu = (statistics.mean(values) for values in zip(*costs))
+        if codec is None:
+            timing = ""
+        else:
+            item = encoding.page_item(sample, codec)
+            timing = (f"{timed(lambda: encoding.page_item(sample, codec), args.repeat):>11.1f}"
+                      f"{timed(lambda: encoding.decode(item), args.repeat):>11.1f}")
+        print(f"{name:<12}{size / 1024:>9.1f}{wcu:>9.0f}{rcu:>10.1f}{timing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark: long-term memory retrieval for a phone with many snippets.
+
+Builds a `lib.memory.MemoryIndex` of synthetic snippets with the deterministic
+hashing embedder, then times what a text pays on recall: loading the stored index
+(.npz bytes, as read from S3), embedding the query and the top-k search. Also
+reports the stored size and the recall of the search against a brute-force sort.
+
+    python benchmarks/bench_memory.py --snippets 10000 --dimensions 256 --repeat 50
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+SERVICES_DIR = Path(__file__).resolve().parents[1] / "app" / "services"
+sys.path[:0] = [str(SERVICES_DIR / "common"), str(SERVICES_DIR / "processing")]
+
+import numpy as np  # noqa: E402
+
+from lib.memory import MEMORY_TOP_K, HashingEmbedder, MemoryIndex  # noqa: E402
+
+WORDS = ("dinner plans tomorrow calendar gym groceries flight lisbon birthday gift mom dentist "
+         "budget rent landlord recipe pasta running shoes book club meeting project deadline "
+         "vacation beach hotel train tickets movie weekend coffee friend wedding").split()
+
+
+def make_snippets(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    return [
+        f"User: {' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 20)))}\n"
+        f"Assistant: {' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 40)))}"
+        for _ in range(count)
+    ]
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snippets", type=int, default=10000)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    embedder = HashingEmbedder(args.dimensions)
+    texts = make_snippets(args.snippets)
+    start = time.perf_counter()
+    index = MemoryIndex(embedder.id)
+    per_chat = max(1, args.snippets // args.chats)
+    for chat_id, offset in enumerate(range(0, len(texts), per_chat)):
+        chunk = texts[offset:offset + per_chat]
+        index.add(embedder.embed(chunk), chunk, chat_id)
+    build_ms = (time.perf_counter() - start) * 1000
+    stored = index.to_bytes()
+
+    queries = make_snippets(args.repeat, seed=11)
+    query_vectors = embedder.embed(queries, query=True)
+    found = exact = 0
+    for query in query_vectors:
+        hits = {text for _, text in index.search(query, min_score=-1.0)}
+        best = np.argsort(-(index.vectors @ query))[:MEMORY_TOP_K]
+        exact += len(best)
+        found += sum(index.texts[row] in hits for row in best)
+
+    load_ms, loaded = timed(lambda: MemoryIndex.from_bytes(stored), max(5, args.repeat // 10))
+    embed_ms, _ = timed(lambda: embedder.embed([queries[0]], query=True), args.repeat)
+    search_ms, _ = timed(lambda: loaded.search(query_vectors[0], exclude_chat=0), args.repeat)
+
+    print(f"{len(index)} snippets in {args.chats} chats, {args.dimensions} dimensions, "
+          f"built in {build_ms:.0f} ms, stored in {len(stored) / 1024:.0f} KiB, "
+          f"top-{MEMORY_TOP_K} recall vs brute force: {found / exact:.2f}")
+    print(f"{'step':<16}{'median ms':>12}")
+    for name, median_ms in (("load .npz", load_ms), ("embed query", embed_ms), ("search", search_ms)):
+        print(f"{name:<16}{median_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Puts the Lambda code on sys.path the way each function's bundle lays it out, so test
+modules import `juneau_common`, the processing `lib` package, the receiver's modules
+and the tools directly.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+SERVICES_DIR = ROOT / "app" / "services"
+
+for path in (
+    ROOT / "tools",
+    SERVICES_DIR / "loop_message" / "receiving",
+    SERVICES_DIR / "processing",
+    SERVICES_DIR / "common",
+):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+
+@pytest.fixture
+def mocked_aws(monkeypatch):
+    """moto in place of AWS, with fresh clients; yields `create_table(name, key, key_type)`."""
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    from juneau_common import aws
+
+    def create_table(name, key, key_type="S", sort_key=None, sort_key_type="N"):
+        schema = [{"AttributeName": key, "KeyType": "HASH"}]
+        attributes = [{"AttributeName": key, "AttributeType": key_type}]
+        if sort_key:
+            schema.append({"AttributeName": sort_key, "KeyType": "RANGE"})
+            attributes.append({"AttributeName": sort_key, "AttributeType": sort_key_type})
+        aws.client("dynamodb").create_table(
+            TableName=name, KeySchema=schema, AttributeDefinitions=attributes, BillingMode="PAY_PER_REQUEST",
+        )
+        return aws.table(name)
+
+    with moto.mock_aws():
+        aws.reset()
+        yield create_table
+    aws.reset()
+
+
+@pytest.fixture
+def dedupe_table(mocked_aws):
+    """A moto-backed WebhookDedupe table with an empty dedupe cache."""
+    from juneau_common.idempotency import DEDUPE_TABLE, deduplicator
+
+    deduplicator.invalidate()
+    yield mocked_aws(DEDUPE_TABLE, "id")
+    deduplicator.invalidate()
@@ -0,0 +1,54 @@
+"""
+Queue URL caching in juneau_common.aws, against moto.
+"""
+
+import pytest
+
+from juneau_common import aws
+
+
+@pytest.fixture
+def sqs(mocked_aws, monkeypatch):
+    """The shared SQS client, counting its calls by operation."""
+    client = aws.client("sqs")
+    calls = {"get_queue_url": 0, "send_message": 0}
+    for operation in calls:
+        def counted(original=getattr(client, operation), operation=operation, **kwargs):
+            calls[operation] += 1
+            return original(**kwargs)
+        monkeypatch.setattr(client, operation, counted)
+    client.calls = calls
+    return client
+
+
+def test_a_queue_url_is_looked_up_once(sqs):
+    url = sqs.create_queue(QueueName="processing")["QueueUrl"]
+
+    for text in ("one", "two", "three"):
+        aws.send_to_queue("processing", MessageBody=text)
+
+    assert aws.queue_url("processing") == url
+    assert sqs.calls == {"get_queue_url": 1, "send_message": 3}
+
+
+def test_a_stale_url_is_looked_up_again_and_the_send_retried_once(sqs):
+    url = sqs.create_queue(QueueName="processing")["QueueUrl"]
+    aws._queue_urls["processing"] = url.replace("processing", "recreated")  # the queue it named is gone
+
+    aws.send_to_queue("processing", MessageBody="hi")
+
+    assert aws.queue_url("processing") == url
+    assert sqs.calls == {"get_queue_url": 1, "send_message": 2}
+    assert len(sqs.receive_message(QueueUrl=url)["Messages"]) == 1
+
+
+def test_a_queue_that_is_really_gone_is_not_retried_again(sqs):
+    url = sqs.create_queue(QueueName="processing")["QueueUrl"]
+    aws.send_to_queue("processing", MessageBody="hi")
+    sqs.delete_queue(QueueUrl=url)
+
+    with pytest.raises(sqs.exceptions.QueueDoesNotExist):
+        aws.send_to_queue("processing", MessageBody="hi")
+
+    assert sqs.calls == {"get_queue_url": 2, "send_message": 2}
+    assert "processing" not in aws._queue_urls
@@ -0,0 +1,102 @@
+"""
+Failure isolation and per-key ordering in juneau_common.batch.
+"""
+
+import threading
+import time
+
+import pytest
+
+from juneau_common.batch import group_records, process_batch
+
+
+def record(message_id, recipient=None, fail=False):
+    return {"messageId": message_id, "body": {"recipient": recipient, "fail": fail}}
+
+
+def by_recipient(record):
+    return record["body"]["recipient"]
+
+
+def handle(record):
+    if record["body"]["fail"]:
+        raise ValueError(f"{record['messageId']} is bad")
+    return {"success": True}
+
+
+def test_groups_keep_arrival_order_and_keyless_records_stand_alone():
+    records = [record("1", "a"), record("2", "b"), record("3", "a"), record("4"), record("5")]
+
+    groups = group_records(records, by_recipient)
+
+    assert [[r["messageId"] for r in group] for group in groups] == [["1", "3"], ["2"], ["4"], ["5"]]
+    assert group_records(records, None) == [[r] for r in records]
+
+
+def test_a_failed_record_is_reported_alone():
+    records = [record("1", "a"), record("2", "b", fail=True), record("3", "c")]
+
+    result = process_batch(records, handle, key=by_recipient)
+
+    assert result.response() == {"batchItemFailures": [{"itemIdentifier": "2"}]}
+    assert result.outcomes["1"] == {"success": True}
+    assert result.outcomes["2"] == {"success": False, "error": "2 is bad"}
+
+
+def test_later_records_of_a_failed_key_are_retried_too():
+    records = [record("1", "a", fail=True), record("2", "b"), record("3", "a"), record("4", "a")]
+    handled = []
+
+    result = process_batch(records, lambda r: handled.append(r["messageId"]) or handle(r), key=by_recipient)
+
+    assert handled == ["1", "2"]
+    assert result.failures == ["1", "3", "4"]
+    assert result.outcomes["3"]["error"] == "Skipped after 1 failed"
+
+
+def test_failures_are_listed_in_batch_order_across_workers():
+    def slow_first(record):
+        if record["messageId"] == "1":
+            time.sleep(0.05)
+        raise ValueError("nope")
+
+    records = [record(str(index), recipient=str(index)) for index in range(1, 5)]
+
+    result = process_batch(records, slow_first, key=by_recipient, max_workers=4)
+
+    assert result.failures == ["1", "2", "3", "4"]
+
+
+def test_keys_run_concurrently_but_each_key_in_order():
+    seen = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(2, timeout=2)
+
+    def handle_in_parallel(record):
+        if record["messageId"] in ("a1", "b1"):
+            barrier.wait()  # only passes if both keys are being handled at once
+        with lock:
+            seen.append(record["messageId"])
+
+    records = [record("a1", "a"), record("b1", "b"), record("a2", "a"), record("b2", "b")]
+
+    result = process_batch(records, handle_in_parallel, key=by_recipient, max_workers=2)
+
+    assert result.failures == []
+    assert seen.index("a1") < seen.index("a2") and seen.index("b1") < seen.index("b2")
+
+
+@pytest.mark.parametrize("failing_unit, failures", [(0, ["1", "2", "3"]), (1, ["3"])])
+def test_coalesced_units_succeed_or_fail_as_a_whole(failing_unit, failures):
+    records = [record("1", "a"), record("2", "a"), record("3", "a")]
+    units = []
+
+    def handle_unit(unit):
+        units.append([r["messageId"] for r in unit])
+        if len(units) - 1 == failing_unit:
+            raise ValueError("unit failed")
+
+    result = process_batch(records, handle_unit, key=by_recipient, coalesce=lambda group: [group[:2], group[2:]])
+
+    assert result.failures == failures
+    assert units[0] == ["1", "2"]
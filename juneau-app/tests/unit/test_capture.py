@@ -0,0 +1,50 @@
+"""
+Webhook capture must not leak anything personal while keeping the traffic's shape.
+"""
+
+import json
+
+from capture import fake_phone, sanitise
+from replay import read_capture
+
+
+def test_sanitise_keeps_shape_not_content():
+    payload = {
+        "alert_type": "message_inbound",
+        "recipient": "+18015551234",
+        "text": "✨ Dinner at 7? Call Ana",
+        "message_id": "59c55Ce8-41d6",
+        "sender_name": "juneau@example.com",
+        "attachments": ["https://example.com/a.png", "https://example.com/b.png"],
+        "language": {"code": "en"},
+    }
+    clean = sanitise(payload)
+
+    assert clean["text"] == "✨ xxxxxx xx 0? xxxx xxx"
+    assert len(clean["text"]) == len(payload["text"])
+    assert clean["recipient"] == fake_phone("+18015551234")
+    assert clean["recipient"].startswith("+1555") and len(clean["recipient"]) == 12
+    assert clean["message_id"] != payload["message_id"]
+    assert clean["attachments"] == 2
+    assert clean["language"] == {"code": "en"}
+    assert "sender_name" not in clean
+    assert "8015551234" not in json.dumps(clean)
+
+
+def test_same_phone_same_fake_number():
+    assert fake_phone("+18015551234") == fake_phone("+18015551234")
+    assert fake_phone("+18015551234") != fake_phone("+18015551235")
+
+
+def test_read_capture_from_log_export(tmp_path):
+    capture_file = tmp_path / "capture.log"
+    capture_file.write_text(
+        '2026-01-01T00:00:01Z\t{"juneau_capture":1,"t":2000,"payload":{"alert_type":"message_sent"}}\n'
+        'START RequestId: abc\n'
+        '{"juneau_capture":1,"t":1000,"payload":{"alert_type":"message_inbound"}}\n',
+        encoding="utf-8",
+    )
+    assert read_capture(str(capture_file)) == [
+        (1000, {"alert_type": "message_inbound"}),
+        (2000, {"alert_type": "message_sent"}),
+    ]
@@ -0,0 +1,100 @@
+"""
+Coalescing rapid-fire texts in the processing lambda: which records are answered
+together, per phone and per chat, and in what order; and the claims that keep a
+redelivered text from being answered twice.
+"""
+
+import importlib.util
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+PROCESSING = Path(__file__).resolve().parents[2] / "app" / "services" / "processing" / "lambda.py"
+
+
+@pytest.fixture
+def processing(monkeypatch):
+    monkeypatch.setenv("ENVIRONMENT", "test")  # no .env.development
+    spec = importlib.util.spec_from_file_location("processing_lambda_under_test", PROCESSING)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def inbound(message_id, recipient="+15555555555", text=None, alert_type="message_inbound"):
+    body = {"alert_type": alert_type, "recipient": recipient, "text": text or message_id, "message_id": message_id}
+    return {"messageId": message_id, "body": json.dumps(body)}
+
+
+def ids(units):
+    return [[record["messageId"] for record in unit] for unit in units]
+
+
+def test_consecutive_texts_merge_in_arrival_order(processing):
+    records = [inbound("1"), inbound("2"), inbound("3")]
+
+    assert ids(processing.coalesce_inbound(records)) == [["1", "2", "3"]]
+
+
+def test_a_sparkle_starts_a_separate_chat(processing):
+    records = [inbound("1"), inbound("2", text="✨ new topic"), inbound("3")]
+
+    assert ids(processing.coalesce_inbound(records)) == [["1"], ["2", "3"]]
+
+
+def test_other_alerts_and_full_units_are_not_merged(processing, monkeypatch):
+    monkeypatch.setattr(processing, "COALESCE_MAX_MESSAGES", 2)
+    records = [inbound("1"), inbound("status", alert_type="message_sent"), inbound("2"), inbound("3"), inbound("4")]
+
+    assert ids(processing.coalesce_inbound(records)) == [["1"], ["status"], ["2", "3"], ["4"]]
+
+
+def test_each_phone_gets_one_reply_for_its_own_texts(processing, monkeypatch):
+    answered = []
+    monkeypatch.setattr(processing.deduplicator, "claim", lambda key, lease=None: True)
+    monkeypatch.setattr(processing.deduplicator, "complete", lambda key: None)
+    monkeypatch.setattr(processing, "message_inbound", lambda *payloads: answered.append([p["text"] for p in payloads]))
+    monkeypatch.setattr(processing, "process_webhook", lambda payload: answered.append([payload["text"]]))
+    records = [inbound("a1", "+1111"), inbound("b1", "+2222"), inbound("a2", "+1111"),
+               inbound("a3", "+1111", text="✨ a3"), inbound("b2", "+2222")]
+
+    monkeypatch.setattr(processing.sessions, "invalidate", lambda: answered.append("counters re-read"))
+
+    response = processing.lambda_handler({"Records": records}, None)
+
+    assert response == {"batchItemFailures": []}
+    assert answered.pop(0) == "counters re-read"
+    assert sorted(answered) == [["a1", "a2"], ["b1", "b2"], ["✨ a3"]]
+
+
+def test_a_crashed_attempt_does_not_turn_the_redelivery_into_a_duplicate(processing, dedupe_table, monkeypatch):
+    payload = json.loads(inbound("m-1")["body"])
+    payloads, keys = processing.claim_inbound([payload])
+    assert payloads == [payload]  # ...and then the invocation timed out
+
+    assert processing.claim_inbound([payload]) == ([], [])  # a copy while it may still be running
+
+    # SQS redelivers once the visibility timeout (3 min) has passed since the receive
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 180)
+    assert processing.claim_inbound([payload]) == ([payload], keys)
+
+
+def test_replies_are_queued_in_order_once_per_chunk(processing, mocked_aws, monkeypatch):
+    from juneau_common import aws
+
+    url = aws.client("sqs").create_queue(QueueName="sending.fifo", Attributes={"FifoQueue": "true"})["QueueUrl"]
+    monkeypatch.setattr(processing, "SQS_NAME", "sending.fifo")
+
+    def reply(*chunks):
+        for sequence, chunk in enumerate(chunks):
+            processing.send_message("+15555555555", chunk, "Juneau", reply_id="loop-1", sequence=sequence)
+
+    reply("First,", "then")
+    reply("First,", "then", "finally.")  # the retry of a reply that failed half way
+    processing.send_message("+15555555555", "Whole reply", "Juneau", reply_id="loop-2")
+
+    received = aws.client("sqs").receive_message(QueueUrl=url, MaxNumberOfMessages=10)["Messages"]
+    assert [json.loads(message["Body"])["text"] for message in received] == ["First,", "then", "finally.", "Whole reply"]
@@ -0,0 +1,36 @@
+"""
+How a compacted chat is split, kept in budget and put into the prompt.
+"""
+
+from lib import compaction, conversations, prompt
+
+
+def chat(count, text="tell me more about the plan for the weekend"):
+    return [conversations.new_turn(15555555555, 0, text, human=index % 2 == 0) for index in range(count)]
+
+
+def test_split_keeps_the_newest_turns_from_a_human_turn():
+    turns = chat(20)
+    old, kept = compaction.split(turns, keep_tokens=100)
+
+    assert old + kept == turns
+    assert kept[0]['human']
+    assert sum(prompt.turn_tokens(turn) for turn in kept) <= 100
+
+
+def test_summary_leads_the_prompt_and_survives_trimming():
+    summary = {'summary': True, 'human': False, 'text': "Planning a trip to Lisbon in May.", 'tokens': 12}
+    turns = [summary] + chat(40)
+
+    trimmed = conversations.within_budget(turns, 100)
+    messages = prompt.build_messages("Be brief.", trimmed, budget=200)
+
+    assert trimmed[0] is summary
+    assert "Planning a trip to Lisbon in May." in messages[0].content
+    assert all(summary['text'] not in message.content for message in messages[1:])
+    assert messages[1].type == "human"
+
+
+def test_short_chats_are_not_queued(monkeypatch):
+    monkeypatch.setattr(compaction, "COMPACTION_SQS_NAME", "processing")
+    assert not compaction.schedule(15555555555, 0, chat(4), "+15555555555")
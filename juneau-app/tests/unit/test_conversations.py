@@ -0,0 +1,164 @@
+"""
+Reading chats that are still in the legacy UserConversations table, and the
+repository's per-container history cache.
+"""
+
+import time
+
+import pytest
+
+from lib import conversations, encoding, sessions
+
+PHONE, NEW_PHONE = 15555555555, 15550000009
+
+
+@pytest.fixture
+def tables(mocked_aws):
+    turns = mocked_aws(conversations.TURNS_TABLE, "conversation", "S", sort_key="seq")
+    legacy = mocked_aws(conversations.LEGACY_TABLE, "phone", "N", sort_key="chat_id")
+    legacy.put_item(Item={"phone": PHONE, "chat_id": 2, "messages": [["hi", True], ["hello!", False]]})
+    counters = mocked_aws(sessions.CHATS_TABLE, "phone", "N")
+    counters.put_item(Item={"phone": PHONE, "my_int_attribute": 2})  # chats 0-2 are legacy
+    sessions.sessions.invalidate()
+    return turns, legacy
+
+
+def texts(turns):
+    return [turn['text'] for turn in turns]
+
+
+def test_a_chat_without_turns_reads_its_legacy_messages(tables):
+    assert texts(conversations.recent_turns(PHONE, 2)) == ["hi", "hello!"]
+    assert conversations.recent_turns(PHONE, 3) == []
+
+
+def test_new_turns_follow_the_legacy_messages(tables):
+    conversations.append_turns([conversations.new_turn(PHONE, 2, "still there?", human=True),
+                                conversations.new_turn(PHONE, 2, "yes", human=False)])
+
+    history = conversations.ConversationRepository().history(PHONE, 2)
+
+    assert texts(history) == ["hi", "hello!", "still there?", "yes"]
+    assert texts(conversations.recent_turns(PHONE, 2, limit=3)) == ["hello!", "still there?", "yes"]
+
+
+def test_chats_past_the_legacy_watermark_never_read_the_legacy_table(tables, monkeypatch):
+    read = []
+    monkeypatch.setattr(conversations, "_legacy_newest_first", lambda *args: read.append(args[:2]) or [])
+
+    assert conversations.recent_turns(PHONE, 3) == []
+    sessions.sessions.rotate(PHONE)  # chat 3, moving the legacy count over
+    assert conversations.recent_turns(PHONE, 3) == []
+    conversations.recent_turns(PHONE, 2)
+
+    assert read == [(PHONE, 2)]
+
+
+def test_a_phone_new_since_the_migration_is_marked_on_its_first_read(tables):
+    counters = conversations.aws.table(sessions.CHATS_TABLE)
+
+    assert conversations.recent_turns(NEW_PHONE, 0) == []
+
+    assert counters.get_item(Key={"phone": NEW_PHONE})["Item"]["legacy_through"] == -1
+    assert sessions.ChatSessions().legacy_through(NEW_PHONE) == -1
+    assert sessions.ChatSessions().rotate(NEW_PHONE) == 1
+
+
+def test_migrated_chats_are_not_read_twice(tables, monkeypatch):
+    turns, _ = tables
+    migrated = conversations.legacy_turns(PHONE, 2, [["hi", True], ["hello!", False]])
+    turns.put_item(Item=encoding.page_item(migrated))
+
+    assert texts(conversations.recent_turns(PHONE, 2)) == ["hi", "hello!"]
+
+    monkeypatch.setattr(conversations, "LEGACY_HISTORY", False)
+    turns.delete_item(Key={"conversation": migrated[-1]['conversation'], "seq": migrated[-1]['seq']})
+    assert conversations.recent_turns(PHONE, 2) == []
+
+
+def test_a_cached_history_picks_up_turns_saved_by_another_container(tables):
+    here, there = conversations.ConversationRepository(), conversations.ConversationRepository()
+    here.save(conversations.new_turn(PHONE, 5, "first", human=True), conversations.new_turn(PHONE, 5, "one", human=False))
+    assert texts(here.history(PHONE, 5)) == ["first", "one"]
+
+    there.save(conversations.new_turn(PHONE, 5, "second", human=True), conversations.new_turn(PHONE, 5, "two", human=False))
+
+    assert texts(here.history(PHONE, 5)) == ["first", "one", "second", "two"]
+    assert texts(here.history(PHONE, 5)) == ["first", "one", "second", "two"]  # not appended twice
+
+
+def test_a_summary_written_since_the_cache_read_forces_a_full_read(tables):
+    turns, _ = tables
+    repository = conversations.ConversationRepository()
+    old = [conversations.new_turn(PHONE, 5, "first", human=True), conversations.new_turn(PHONE, 5, "one", human=False)]
+    repository.save(*old)
+    repository.history(PHONE, 5)
+
+    newer = conversations.new_turn(PHONE, 5, "second", human=True)
+    turns.put_item(Item=newer)
+    turns.put_item(Item={'conversation': newer['conversation'], 'seq': newer['seq'] + 1, 'summary': True,
+                         'human': False, 'text': "Earlier.", 'compacted_through': newer['seq']})
+
+    assert texts(repository.history(PHONE, 5)) == ["Earlier."]
+
+
+@pytest.fixture
+def full_reads(monkeypatch):
+    """Chats whose history was read in full (recent_turns), in order."""
+    reads = []
+    recent_turns = conversations.recent_turns
+
+    def counted(phone, chat_id, *args):
+        reads.append(chat_id)
+        return recent_turns(phone, chat_id, *args)
+    monkeypatch.setattr(conversations, "recent_turns", counted)
+    return reads
+
+
+def exchange(chat_id, text, reply):
+    return conversations.new_turn(PHONE, chat_id, text, human=True), conversations.new_turn(PHONE, chat_id, reply, human=False)
+
+
+def test_a_new_chat_is_never_read_and_saves_go_through_the_cache(tables, full_reads):
+    repository = conversations.ConversationRepository()
+
+    assert repository.history(PHONE, 6, new_chat=True) == []
+    repository.save(*exchange(6, "hi", "hello"))
+    repository.save(*exchange(6, "how are you?", "well"))
+
+    assert texts(repository.history(PHONE, 6)) == ["hi", "hello", "how are you?", "well"]
+    assert full_reads == []
+    assert texts(conversations.ConversationRepository().history(PHONE, 6)) == ["hi", "hello", "how are you?", "well"]
+
+
+def test_a_save_to_an_uncached_chat_does_not_start_a_partial_cache(tables, full_reads):
+    conversations.append_turns(list(exchange(7, "earlier", "yes")))
+    repository = conversations.ConversationRepository()
+
+    repository.save(*exchange(7, "later", "ok"))
+
+    assert texts(repository.history(PHONE, 7)) == ["earlier", "yes", "later", "ok"]
+    assert full_reads == [7]
+
+
+def test_cached_chats_expire_and_the_least_recently_used_is_evicted(tables, full_reads, monkeypatch):
+    repository = conversations.ConversationRepository(cache_size=2, cache_ttl=60)
+    for chat_id in (5, 6, 5, 7):  # 5 is used again before 7 arrives, so 6 goes
+        repository.history(PHONE, chat_id)
+    repository.history(PHONE, 5)
+    repository.history(PHONE, 6)
+    assert full_reads == [5, 6, 7, 6]
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    repository.history(PHONE, 6)
+    assert full_reads == [5, 6, 7, 6, 6]
+
+
+def test_cached_history_is_trimmed_to_the_token_budget(tables):
+    repository = conversations.ConversationRepository(token_budget=30)
+    repository.history(PHONE, 8, new_chat=True)
+    for index in range(5):
+        repository.save(*exchange(8, f"text {index}", f"reply {index}"))
+
+    assert texts(repository.history(PHONE, 8)) == ["reply 2", "text 3", "reply 3", "text 4", "reply 4"]
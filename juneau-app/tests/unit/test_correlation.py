@@ -0,0 +1,70 @@
+"""
+The correlation envelope through SQS message attributes and Loop's passthrough, and
+the TTL cache of juneau_common.secrets.
+"""
+
+from types import SimpleNamespace
+
+from juneau_common import correlation, secrets
+
+
+def delivered(attributes):
+    """An SQS record as Lambda hands it over for a message sent with `attributes`."""
+    return {
+        "messageId": "m-1",
+        "messageAttributes": {
+            name: {"dataType": value["DataType"], "stringValue": value["StringValue"]}
+            for name, value in attributes.items()
+        },
+    }
+
+
+def test_envelope_round_trips_through_message_attributes():
+    envelope = correlation.start("loop-message-1")
+
+    received = correlation.from_record(delivered(correlation.attributes(envelope, "processing")))
+    forwarded = correlation.from_record(delivered(correlation.attributes(received, "sending")))
+
+    assert forwarded["id"] == "loop-message-1" and forwarded["received"] == envelope["received"]
+    assert [hop["stage"] for hop in forwarded["hops"]] == ["processing", "sending"]
+    assert all("dequeued" in hop for hop in forwarded["hops"])
+    assert envelope["hops"] == []  # forwarding doesn't change the caller's envelope
+
+
+def test_records_without_a_usable_envelope_have_none():
+    assert correlation.attributes(None, "sending") == {}
+    assert correlation.from_record({"messageId": "m-1"}) is None
+    assert correlation.from_record({"messageAttributes": {"Correlation": {"stringValue": "{not json"}}}) is None
+
+
+def test_passthrough_ties_the_status_webhook_back():
+    envelope = correlation.start("loop-message-1")
+
+    parsed = correlation.from_passthrough(correlation.passthrough(envelope))
+
+    assert parsed["correlation_id"] == "loop-message-1" and parsed["received"] == envelope["received"]
+    assert correlation.from_passthrough("order #42") is None
+    assert correlation.from_passthrough('{"other": 1}') is None
+
+
+def test_secrets_are_cached_until_the_ttl_runs_out(monkeypatch):
+    fetched = []
+
+    def get_secret_value(SecretId):
+        fetched.append(SecretId)
+        return {"SecretString": f'{{"LOOP_API_KEY": "key-{len(fetched)}"}}'}
+
+    now = [1000.0]
+    monkeypatch.setattr(secrets.aws, "client", lambda name: SimpleNamespace(get_secret_value=get_secret_value))
+    monkeypatch.setattr(secrets.time, "monotonic", lambda: now[0])
+    secrets.invalidate()
+
+    assert secrets.get_secret("dev/juneau/loop", ttl=60) == {"LOOP_API_KEY": "key-1"}
+    now[0] += 59
+    assert secrets.get_secret("dev/juneau/loop", ttl=60) == {"LOOP_API_KEY": "key-1"}
+    now[0] += 2
+    assert secrets.get_secret("dev/juneau/loop", ttl=60) == {"LOOP_API_KEY": "key-2"}
+    secrets.invalidate("dev/juneau/loop")
+    assert secrets.get_secret("dev/juneau/loop", ttl=60) == {"LOOP_API_KEY": "key-3"}
+    assert fetched == ["dev/juneau/loop"] * 3
+    secrets.invalidate()
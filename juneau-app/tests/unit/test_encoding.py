@@ -0,0 +1,76 @@
+"""
+Page encoding of conversation turns, and reading pages next to plain turn items.
+"""
+
+from decimal import Decimal
+
+import pytest
+
+from lib import conversations, encoding
+
+
+class FakeTable:
+    """Answers descending Queries from items in memory."""
+
+    def __init__(self, items):
+        self.items = sorted(items, key=lambda item: item['seq'], reverse=True)
+
+    def query(self, **query):
+        return {'Items': [dict(item) for item in self.items]}
+
+    def get_item(self, **get):
+        return {}
+
+
+def exchange(*texts):
+    return [conversations.new_turn(15555555555, 3, text, human=index < len(texts) - 1, language=None)
+            for index, text in enumerate(texts)]
+
+
+@pytest.mark.parametrize("codec", [encoding.NONE, encoding.ZLIB])
+def test_pages_round_trip(codec):
+    turns = exchange("Où est la gare ? 🚉", "and a second text", "Straight ahead, then left. " * 20)
+    turns[0]['language'] = "fr"
+
+    item = encoding.page_item(turns, codec)
+
+    assert item['seq'] == turns[-1]['seq']
+    assert encoding.decode(item) == turns
+
+
+def test_a_page_is_never_larger_than_its_uncompressed_form(monkeypatch):
+    turns = exchange("hi", "Sure, here's the plan. " * 20)
+    assert encoding.pack(turns, encoding.ZLIB)[1] == encoding.ZLIB
+
+    monkeypatch.setattr(encoding, "compress", lambda body, codec: body + b"overhead")
+    assert encoding.pack(turns, encoding.ZLIB) == encoding.pack(turns, encoding.NONE)
+
+
+def test_pages_and_plain_items_read_as_one_history(monkeypatch):
+    old = exchange("plain text", "plain reply")
+    new = exchange("paged text", "paged reply")
+    table = FakeTable(old + [encoding.page_item(new)])
+    monkeypatch.setattr(conversations.aws, "table", lambda name: table)
+
+    assert [turn['text'] for turn in conversations.recent_turns(15555555555, 3)] == [
+        "plain text", "plain reply", "paged text", "paged reply",
+    ]
+
+
+def test_turns_of_a_page_covered_by_a_summary_are_skipped(monkeypatch):
+    turns = exchange("first", "second", "reply")
+    summary = {'conversation': turns[0]['conversation'], 'seq': Decimal(turns[0]['seq']) + Decimal("0.5"),
+               'summary': True, 'human': False, 'text': "Earlier.", 'compacted_through': Decimal(turns[0]['seq'])}
+    table = FakeTable([summary, encoding.page_item(turns)])
+    monkeypatch.setattr(conversations.aws, "table", lambda name: table)
+
+    assert [turn['text'] for turn in conversations.recent_turns(15555555555, 3)] == ["Earlier.", "second", "reply"]
+
+
+def test_a_page_is_billed_once_and_smaller_than_its_turns():
+    turns = exchange("can you draft a note to my landlord about the heating?",
+                     "Sure. Here's a short note you can send today. " * 8)
+    page = encoding.page_item(turns)
+
+    assert encoding.write_units([page]) < encoding.write_units(turns)
+    assert encoding.item_size(page) < sum(map(encoding.item_size, turns))
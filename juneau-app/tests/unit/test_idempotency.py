@@ -0,0 +1,76 @@
+"""
+Claims, leases and the local cache of juneau_common.idempotency, against moto.
+"""
+
+import time
+
+from juneau_common.idempotency import DONE, PENDING, Deduplicator, payload_key
+
+
+def status(table, key):
+    return table.get_item(Key={"id": key}).get("Item", {}).get("status")
+
+
+def test_payload_keys_qualify_the_message_with_the_alert():
+    assert payload_key({"alert_type": "message_sent", "message_id": "m"}) == "message_sent:m"
+    assert payload_key({"webhook_id": "w"}) == "webhook:w"
+    assert payload_key({}) is None
+
+
+def test_a_pending_claim_blocks_a_second_one_until_completed(dedupe_table):
+    first, second = Deduplicator(lease=60), Deduplicator(lease=60)  # two containers
+
+    assert first.claim("processing:m-1")
+    assert status(dedupe_table, "processing:m-1") == PENDING
+    assert not second.claim("processing:m-1")
+
+    first.complete("processing:m-1")
+    assert status(dedupe_table, "processing:m-1") == DONE
+    assert not second.claim("processing:m-1")
+    assert not first.claim("processing:m-1")  # answered from the local cache
+
+
+def test_a_released_claim_can_be_claimed_again(dedupe_table):
+    first, second = Deduplicator(), Deduplicator()
+
+    assert first.claim("processing:m-1")
+    first.release("processing:m-1")
+
+    assert status(dedupe_table, "processing:m-1") is None
+    assert second.claim("processing:m-1")
+
+
+def test_an_expired_lease_is_reclaimed(dedupe_table, monkeypatch):
+    first, second = Deduplicator(lease=5), Deduplicator(lease=5)
+    assert first.claim("processing:m-1")  # and then the attempt crashed
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 6)
+
+    assert second.claim("processing:m-1")
+    assert not first.claim("processing:m-1")  # the new lease holds
+
+
+def test_a_done_claim_never_expires_into_a_reclaim(dedupe_table, monkeypatch):
+    assert Deduplicator().claim("edge:m-1", done=True)
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 3600)
+
+    assert not Deduplicator().claim("edge:m-1")
+
+
+def test_the_local_cache_evicts_the_least_recently_used_key(dedupe_table):
+    deduplicator = Deduplicator(cache_size=2)
+    for key in ("a", "b"):
+        deduplicator.claim(key, done=True)
+    deduplicator.claim("a")  # a hit moves "a" to the newest end
+    deduplicator.claim("c", done=True)
+
+    assert list(deduplicator._seen) == ["a", "c"]
+
+
+def test_dynamodb_errors_fail_open(dedupe_table):
+    dedupe_table.delete()
+
+    assert Deduplicator().claim("processing:m-1")
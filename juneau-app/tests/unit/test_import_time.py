@@ -0,0 +1,71 @@
+"""
+Import-time budget for the lambda handlers.
+
+Everything a handler imports at module level is paid on every cold start, so heavy
+dependencies (LangChain, Gemini, boto3, ...) should only be loaded on first use.
+Each handler is imported in a fresh interpreter with `-X importtime`; the test fails
+when the import takes longer than the budget and prints the slowest modules.
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SERVICES_DIR = Path(__file__).resolve().parents[2] / "app" / "services"
+COMMON_DIR = SERVICES_DIR / "common"
+
+# Milliseconds; override with IMPORT_BUDGET_MS on slow CI machines
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "400"))
+
+HANDLERS = [
+    "loop_message/receiving/webhook.py",
+    "processing/lambda.py",
+    "loop_message/sending/lambda.py",
+    "loop_message/status/lambda.py",
+]
+
+MEASURE = """
+import importlib.util, sys, time
+path = sys.argv[1]
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("handler", path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def slowest_imports(importtime_output: str, count: int = 10):
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+@pytest.mark.parametrize("handler", HANDLERS)
+def test_handler_import_within_budget(handler, tmp_path):
+    path = SERVICES_DIR / handler
+    env = dict(
+        os.environ,
+        ENVIRONMENT="local",
+        PYTHONPATH=os.pathsep.join([str(COMMON_DIR), str(path.parent)]),
+    )
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", MEASURE, str(path)],
+        capture_output=True,
+        text=True,
+        cwd=tmp_path,  # no .env.development here, so nothing local leaks into the measurement
+        env=env,
+    )
+    assert completed.returncode == 0, completed.stderr[-2000:]
+    elapsed_ms = float(completed.stdout.strip().splitlines()[-1])
+    slowest = "\n".join(f"{us / 1000:8.1f} ms  {name}" for us, name in slowest_imports(completed.stderr))
+    assert elapsed_ms <= IMPORT_BUDGET_MS, (
+        f"Importing {handler} took {elapsed_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms). Slowest imports:\n{slowest}"
+    )
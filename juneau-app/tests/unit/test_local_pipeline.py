@@ -0,0 +1,37 @@
+"""
+Smoke test of the local pipeline harness: a few conversations go through receiving,
+processing and sending against moto and the fake model and Loop API.
+"""
+
+import contextlib
+import io
+import os
+
+import pytest
+
+pytest.importorskip("moto")
+
+from local_pipeline import LocalPipeline, run_load  # noqa: E402
+
+
+def test_every_message_gets_a_reply():
+    with contextlib.redirect_stdout(io.StringIO()), LocalPipeline(concurrency=2) as pipeline:
+        report = run_load(pipeline, conversations=3, messages=2, timeout=30)
+
+    assert report["handler_errors"] == []
+    assert report["delivered"] == report["messages"] == 6
+    assert report["latency_ms"]["p50"] > 0
+    # Every inbound text costs at least the edge enqueue and the queued reply
+    assert report["calls_per_message"]["SQS"] >= 2
+    assert report["calls_per_message"]["DynamoDB"] > 0
+
+
+def test_the_environment_is_restored_afterwards(monkeypatch):
+    monkeypatch.setenv("SQS_NAME", "real-processing-queue")
+    monkeypatch.delenv("MEMORY_BUCKET", raising=False)
+    before = dict(os.environ)
+
+    with contextlib.redirect_stdout(io.StringIO()), LocalPipeline(concurrency=1):
+        assert os.environ["SQS_NAME"] == "processing"
+
+    assert dict(os.environ) == before
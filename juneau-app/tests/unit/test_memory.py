@@ -0,0 +1,82 @@
+"""
+Snippets, search and storage of the long-term memory index, with the hashing embedder.
+"""
+
+import time
+
+from lib import memory, prompt
+
+
+def index_of(chats):
+    embedder = memory.HashingEmbedder(64)
+    index = memory.MemoryIndex(embedder.id)
+    for chat_id, texts in enumerate(chats):
+        index.add(embedder.embed(texts), texts, chat_id)
+    return embedder, index
+
+
+def test_hashing_embedder_is_deterministic_and_normalised():
+    embedder = memory.HashingEmbedder(64)
+    first, second = embedder.embed(["dinner in Lisbon on Friday"]), embedder.embed(["dinner in Lisbon on Friday"])
+
+    assert (first == second).all()
+    assert abs(float((first[0] ** 2).sum()) - 1) < 1e-5
+
+
+def test_search_ranks_related_snippets_and_skips_the_current_chat():
+    embedder, index = index_of([
+        ["User: my dentist appointment is on Tuesday\nAssistant: Noted, Tuesday at the dentist."],
+        ["User: book a table for dinner in Lisbon\nAssistant: Which night works for dinner?"],
+        ["User: dinner in Lisbon again\nAssistant: Same place as last time?"],
+    ])
+    query = embedder.embed(["where was that dinner in Lisbon"], query=True)[0]
+
+    hits = index.search(query, k=3, exclude_chat=2, min_score=-1.0)
+
+    assert [text for _, text in hits] == [index.texts[1], index.texts[0]]
+    assert hits[0][0] > hits[1][0]
+
+
+def test_index_round_trips_through_npz_without_pickle():
+    _, index = index_of([["User: hi\nAssistant: hello 👋"], ["Summary: Planning a trip to Lisbon."]])
+
+    loaded = memory.MemoryIndex.from_bytes(index.to_bytes(), etag='"abc"')
+
+    assert loaded.texts == index.texts and loaded.embedder_id == index.embedder_id
+    assert loaded.has_chat(1) and not loaded.has_chat(2)
+    assert abs(loaded.vectors - index.vectors).max() < 1e-3  # stored as float16
+
+
+def test_snippets_pair_texts_with_replies_and_keep_the_summary():
+    turns = [{'summary': True, 'human': False, 'text': "Trip to Lisbon."}] + [
+        {'human': human, 'text': text}
+        for human, text in ((True, "hi"), (True, "you there?"), (False, "Yes!"), (True, "bye"))
+    ]
+
+    assert memory.snippets(turns) == [
+        "Summary: Trip to Lisbon.", "User: hi\nUser: you there?\nAssistant: Yes!", "User: bye",
+    ]
+
+
+def test_memories_go_into_the_system_message():
+    turns = [{'human': True, 'text': "what did we pick?", 'tokens': 8}]
+    messages = prompt.build_messages("Be brief.", turns, memories=["User: dinner at Tasca\nAssistant: Booked."])
+
+    assert messages[0].content.endswith(f"{prompt.MEMORIES_HEADER}- User: dinner at Tasca\nAssistant: Booked.")
+    assert messages[1].content == "what did we pick?"
+
+
+def test_a_slow_recall_is_abandoned(monkeypatch):
+    class SlowEmbedder(memory.HashingEmbedder):
+        def embed(self, texts, query=False):
+            time.sleep(1)
+            return super().embed(texts, query)
+
+    _, index = index_of([["User: dinner in Lisbon\nAssistant: Friday it is."]])
+    monkeypatch.setattr(memory, "enabled", lambda: True)
+    monkeypatch.setattr(memory.store, "embedder", SlowEmbedder(64))
+    monkeypatch.setattr(memory.store, "load", lambda phone: index)
+
+    started = time.monotonic()
+    assert memory.recall(15555555555, 1, ["dinner?"], timeout=0.1) == []
+    assert time.monotonic() - started < 0.5
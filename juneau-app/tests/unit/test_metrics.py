@@ -0,0 +1,85 @@
+"""
+Offline checks of the Embedded Metric Format lines written by juneau_common.metrics.
+"""
+
+import json
+import time
+from types import SimpleNamespace
+
+from juneau_common.metrics import COUNT, MAX_VALUES_PER_METRIC, Metrics
+
+
+def emitted(capsys):
+    lines = [line for line in capsys.readouterr().out.splitlines() if line]
+    return [json.loads(line) for line in lines]
+
+
+def test_flush_writes_one_emf_line(capsys):
+    metrics = Metrics(namespace="JuneauTest", service="processing")
+    metrics.begin()
+    with metrics.timer("ModelCall"):
+        time.sleep(0.01)
+    metrics.put("InputTokens", 120, COUNT)
+    metrics.property("RequestId", "abc")
+    metrics.flush()
+
+    (document,) = emitted(capsys)
+    directive = document["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == "JuneauTest"
+    assert directive["Dimensions"] == [["Service"]]
+    assert {"Name": "ModelCall", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert {"Name": "InputTokens", "Unit": "Count"} in directive["Metrics"]
+    assert document["Service"] == "processing"
+    assert document["RequestId"] == "abc"
+    assert document["ModelCall"] >= 10
+    assert document["InputTokens"] == 120
+    assert isinstance(document["_aws"]["Timestamp"], int)
+
+
+def test_repeated_values_become_an_array(capsys):
+    metrics = Metrics()
+    metrics.begin()
+    for value in range(MAX_VALUES_PER_METRIC + 5):
+        metrics.put("DynamoDB.Query", value)
+    metrics.flush()
+
+    (document,) = emitted(capsys)
+    assert document["DynamoDB.Query"] == list(range(MAX_VALUES_PER_METRIC))
+
+
+def test_unsampled_invocations_emit_nothing(capsys):
+    metrics = Metrics(sample_rate=0)
+    with metrics.invocation():
+        with metrics.timer("Auth"):
+            pass
+        metrics.count("Records")
+    assert emitted(capsys) == []
+
+
+def test_emit_decorator_flushes_once_per_invocation(capsys):
+    metrics = Metrics()
+
+    @metrics.emit
+    def handler(event, context):
+        metrics.count("Records", len(event["Records"]))
+        return "ok"
+
+    assert handler({"Records": [1, 2]}, SimpleNamespace(aws_request_id="req-1")) == "ok"
+    assert handler({"Records": [1]}, None) == "ok"
+
+    first, second = emitted(capsys)
+    assert first["Records"] == 2 and first["RequestId"] == "req-1"
+    assert second["Records"] == 1 and "RequestId" not in second
+
+
+def test_queue_age_from_sqs_attributes(capsys):
+    metrics = Metrics()
+    metrics.begin()
+    sent = int(time.time() * 1000) - 1500
+    metrics.record_queue_age({"attributes": {"SentTimestamp": str(sent), "ApproximateReceiveCount": "2"}})
+    metrics.record_queue_age({"body": "{}"})  # no attributes, e.g. a local test event
+    metrics.flush()
+
+    (document,) = emitted(capsys)
+    assert 1500 <= document["QueueAge"] < 5000
+    assert document["Redelivered"] == 1
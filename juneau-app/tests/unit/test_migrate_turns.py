@@ -0,0 +1,80 @@
+"""
+Migrating UserConversations chats into ConversationTurns against moto, with chat
+counters from before and after the rename to `chat_id`.
+"""
+
+import boto3
+import pytest
+
+from lib import conversations, sessions
+from migrate_turns import migrate
+
+# Counter never upgraded, counter restarted at 1 by an earlier release, no counter at all
+KEPT, RESTARTED, UNCOUNTED = 15550000001, 15550000002, 15550000003
+
+
+@pytest.fixture
+def tables(mocked_aws):
+    turns = mocked_aws(conversations.TURNS_TABLE, "conversation", "S", sort_key="seq")
+    legacy = mocked_aws(conversations.LEGACY_TABLE, "phone", "N", sort_key="chat_id")
+    counters = mocked_aws(sessions.CHATS_TABLE, "phone", "N")
+    for phone, chats in ((KEPT, 2), (RESTARTED, 3), (UNCOUNTED, 1)):
+        for chat_id in range(chats):
+            legacy.put_item(Item={"phone": phone, "chat_id": chat_id, "messages": [
+                [f"legacy {chat_id}", True], [f"reply {chat_id}", False],
+            ]})
+    counters.put_item(Item={"phone": KEPT, "my_int_attribute": 1})
+    counters.put_item(Item={"phone": RESTARTED, "my_int_attribute": 2, "chat_id": 1})
+    conversations.append_turns([conversations.new_turn(RESTARTED, 1, "newer chat", human=True)])
+    sessions.sessions.invalidate()
+    return turns, legacy, counters
+
+
+def texts(phone, chat_id):
+    return [turn['text'] for turn in conversations.recent_turns(phone, chat_id)]
+
+
+def test_legacy_chats_keep_their_ids_and_the_counter_is_seeded(tables, monkeypatch):
+    _, _, counters = tables
+
+    migrate("lists", boto3.session.Session())
+    monkeypatch.setattr(conversations, "LEGACY_HISTORY", False)  # read from the pages alone
+
+    assert texts(KEPT, 0) == ["legacy 0", "reply 0"] and texts(KEPT, 1) == ["legacy 1", "reply 1"]
+    assert counters.get_item(Key={"phone": KEPT})["Item"] == {"phone": KEPT, "chat_id": 1, "legacy_through": -1}
+    assert counters.get_item(Key={"phone": UNCOUNTED})["Item"] == {"phone": UNCOUNTED, "chat_id": 0, "legacy_through": -1}
+    assert sessions.sessions.current(KEPT) == 1
+    assert sessions.ChatSessions().rotate(KEPT) == 2
+
+
+def test_legacy_chats_of_a_restarted_counter_move_below_0(tables):
+    _, legacy, counters = tables
+
+    migrate("lists", boto3.session.Session())
+
+    assert texts(RESTARTED, 1) == ["newer chat"]  # no longer mixed with legacy chat 1
+    assert [texts(RESTARTED, chat_id) for chat_id in (-3, -2, -1)] == [
+        ["legacy 0", "reply 0"], ["legacy 1", "reply 1"], ["legacy 2", "reply 2"],
+    ]
+    assert counters.get_item(Key={"phone": RESTARTED})["Item"] == {"phone": RESTARTED, "chat_id": 1, "legacy_through": -1}
+    assert legacy.get_item(Key={"phone": RESTARTED, "chat_id": 1})["Item"]["migrated_to"] == -2
+
+
+def test_a_rerun_writes_the_same_pages(tables):
+    turns, _, _ = tables
+    migrate("lists", boto3.session.Session())
+    first = turns.scan()["Items"]
+
+    report = migrate("lists", boto3.session.Session())
+
+    assert report["conversations"] == 6
+    assert sorted(map(str, turns.scan()["Items"])) == sorted(map(str, first))
+
+
+def test_a_dry_run_changes_nothing(tables):
+    before = [table.scan()["Items"] for table in tables]
+
+    report = migrate("lists", boto3.session.Session(), dry_run=True)
+
+    assert report["conversations"] == 6 and report["turns"] == 12
+    assert [table.scan()["Items"] for table in tables] == before
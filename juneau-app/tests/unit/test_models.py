@@ -0,0 +1,81 @@
+"""
+Deadlines, hedging and failover in the processing lambda's model pool, with fake backends.
+"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from lib.models import HEDGE_DELAY_SECONDS, Backend, ModelPool, ModelTimeoutError
+
+
+class FakeModel:
+    def __init__(self, reply, latency=0.0, error=None):
+        self.reply, self.latency, self.error = reply, latency, error
+
+    def invoke(self, messages):
+        time.sleep(self.latency)
+        if self.error:
+            raise self.error
+        return SimpleNamespace(content=self.reply, usage_metadata={"input_tokens": 1, "output_tokens": 2})
+
+    def stream(self, messages):
+        time.sleep(self.latency)
+        if self.error:
+            raise self.error
+        for word in self.reply.split(" "):
+            yield SimpleNamespace(content=word + " ", usage_metadata=None)
+
+
+def backend(name, monkeypatch, **behaviour):
+    monkeypatch.setenv(f"{name.upper()}_API_KEY", "test")
+    return Backend(name, lambda api_key, model: FakeModel(**behaviour), {"light": name, "standard": name},
+                   f"{name.upper()}_SECRET_NAME", f"{name.upper()}_API_KEY")
+
+
+def test_slow_primary_is_hedged(monkeypatch):
+    pool = ModelPool(backend("slow", monkeypatch, reply="late", latency=1.0),
+                     backend("fast", monkeypatch, reply="early reply"), timeout=5, hedging=True)
+    monkeypatch.setattr(pool, "hedge_delay", lambda mode, tier: 0.05)
+
+    started = time.monotonic()
+    chunks = []
+    reply = pool.generate([], on_chunk=chunks.append)
+
+    assert time.monotonic() - started < 0.5
+    assert (reply.backend, reply.hedged, reply.text) == ("fast", True, "early reply ")
+    assert chunks == ["early ", "reply "]
+
+
+def test_failed_primary_fails_over_without_hedging(monkeypatch):
+    pool = ModelPool(backend("broken", monkeypatch, reply="", error=RuntimeError("503")),
+                     backend("spare", monkeypatch, reply="hello"), timeout=5, hedging=False)
+
+    reply = pool.generate([])
+
+    assert (reply.backend, reply.hedged, reply.text) == ("spare", False, "hello")
+
+
+def test_deadline_applies_to_the_whole_call(monkeypatch):
+    pool = ModelPool(backend("stuck", monkeypatch, reply="never", latency=2.0), timeout=0.2)
+
+    with pytest.raises(ModelTimeoutError):
+        pool.generate([])
+
+
+def test_time_spent_before_the_call_comes_out_of_the_deadline(monkeypatch):
+    pool = ModelPool(backend("slowish", monkeypatch, reply="hi", latency=0.3), timeout=5)
+
+    started = time.monotonic()
+    with pytest.raises(ModelTimeoutError):
+        pool.generate([], deadline=time.monotonic() + 0.1)  # most of the budget went on recall
+    assert time.monotonic() - started < 0.3
+
+
+def test_hedge_delay_follows_recent_latencies(monkeypatch):
+    pool = ModelPool(backend("gemini", monkeypatch, reply="hi"), percentile=0.9)
+    pool._latencies["invoke", "standard"].extend(index / 10 for index in range(1, 21))
+
+    assert pool.hedge_delay("invoke") == pytest.approx(1.9)
+    assert pool.hedge_delay("invoke", "light") == HEDGE_DELAY_SECONDS  # learned per tier
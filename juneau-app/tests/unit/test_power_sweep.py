@@ -0,0 +1,100 @@
+"""
+Costing and choosing memory settings in tools/power_sweep.py, and sweeping a deployed
+function without touching it.
+"""
+
+import base64
+
+import pytest
+
+import power_sweep
+from power_sweep import recommend, summarise, sweep_deployed
+
+
+def row(memory_mb, duration_ms, cost):
+    return {"memory_mb": memory_mb, "duration_ms": duration_ms, "cost_per_1k_messages": cost}
+
+
+def test_a_row_costs_the_warm_duration_and_a_share_of_the_init():
+    warm = summarise(1024, [100.0, 200.0], 0.0, messages=1, architecture="arm64", cold_start_rate=0.0)
+    cold = summarise(1024, [100.0, 200.0], 1000.0, messages=1, architecture="arm64", cold_start_rate=0.1)
+
+    assert warm["duration_ms"] == 150.0 and warm["p95_ms"] == 200.0
+    # 150 ms at 1 GB, plus the request
+    assert warm["cost_per_1k_messages"] == pytest.approx((0.15 * 0.0000133334 + 0.2 / 1_000_000) * 1000, abs=1e-6)
+    # a tenth of the invocations also pay for 1 s of init
+    assert cold["cost_per_1k_messages"] - warm["cost_per_1k_messages"] == pytest.approx(0.1 * 0.0000133334 * 1000,
+                                                                                         abs=1e-6)
+
+
+def test_the_cost_is_per_message_of_a_batch():
+    single = summarise(512, [100.0], 0.0, messages=1, architecture="x86_64", cold_start_rate=0.0)
+    batch = summarise(512, [100.0], 0.0, messages=10, architecture="x86_64", cold_start_rate=0.0)
+
+    assert batch["cost_per_1k_messages"] == pytest.approx(single["cost_per_1k_messages"] / 10, abs=1e-6)
+
+
+def test_the_cheapest_setting_within_the_tolerance_is_recommended():
+    rows = [row(128, 900.0, 0.002), row(512, 220.0, 0.0019), row(1024, 205.0, 0.0035), row(1769, 200.0, 0.006)]
+
+    assert recommend(rows, tolerance=0.10)["memory_mb"] == 512
+    assert recommend(rows, tolerance=0.0)["memory_mb"] == 1769
+    assert recommend(rows, tolerance=5.0)["memory_mb"] == 512  # cheaper than 128 MB, which runs 4x longer
+
+
+def test_equal_costs_prefer_the_smaller_setting():
+    assert recommend([row(1024, 100.0, 0.001), row(512, 100.0, 0.001)], tolerance=0.1)["memory_mb"] == 512
+
+
+class FakeLambda:
+    """Records the calls a sweep makes; every invocation reports 100 ms, the first of a version cold."""
+
+    def __init__(self):
+        self.calls = []
+        self.versions = {}
+
+    def __getattr__(self, operation):
+        answer = getattr(type(self), "_" + operation, lambda self, **_: {})
+
+        def call(**kwargs):
+            self.calls.append((operation, kwargs))
+            return answer(self, **kwargs)
+        return call
+
+    def _get_function(self, FunctionName):
+        return {"Code": {"ImageUri": "image"}, "Configuration": {
+            "FunctionName": FunctionName, "Role": "role", "PackageType": "Image", "Timeout": 30,
+            "MemorySize": 128, "Architectures": ["arm64"],
+        }}
+
+    def _get_function_configuration(self, FunctionName):
+        return {"Architectures": ["arm64"]}
+
+    def _publish_version(self, FunctionName, Description):
+        version = str(len(self.versions) + 1)
+        self.versions[version] = 0
+        return {"Version": version}
+
+    def _invoke(self, FunctionName, Qualifier, Payload, LogType):
+        self.versions[Qualifier] += 1
+        report = "REPORT\tDuration: 100.0 ms\tBilled Duration: 100 ms"
+        if self.versions[Qualifier] == 1:
+            report += "\tInit Duration: 400.0 ms"
+        return {"LogResult": base64.b64encode(report.encode()).decode()}
+
+    def get_waiter(self, name):
+        return type("Waiter", (), {"wait": lambda waiter, **kwargs: None})()
+
+
+def test_a_deployed_sweep_invokes_a_version_of_a_copy_per_setting():
+    client = FakeLambda()
+    session = type("Session", (), {"client": lambda session, service: client})()
+
+    rows = sweep_deployed(session, "live", {}, [256, 512], invocations=3, cold_start_rate=0.05)
+
+    assert [(row["memory_mb"], row["duration_ms"], row["init_ms"]) for row in rows] == [(256, 100.0, 400.0),
+                                                                                       (512, 100.0, 400.0)]
+    touched = {kwargs["FunctionName"] for operation, kwargs in client.calls if operation != "get_function"}
+    assert touched == {"live" + power_sweep.COPY_SUFFIX}
+    assert [kwargs["Qualifier"] for operation, kwargs in client.calls if operation == "invoke"] == ["1"] * 3 + ["2"] * 3
+    assert client.calls[-1][0] == "delete_function"
@@ -0,0 +1,54 @@
+"""
+Choosing the turns that fit a prompt's token budget in lib.prompt.
+"""
+
+from lib.prompt import build_messages, count_tokens, select_turns
+
+
+def turn(text, human, tokens=10):
+    return {"text": text, "human": human, "tokens": tokens}
+
+
+def texts(turns):
+    return [turn["text"] for turn in turns]
+
+
+CHAT = [turn("hi", True), turn("hello", False), turn("weather?", True), turn("sunny", False),
+        turn("thanks", True), turn("any time", False)]
+
+
+def test_the_newest_turns_that_fit_are_kept():
+    assert texts(select_turns(CHAT, 60)) == texts(CHAT)
+    assert texts(select_turns(CHAT, 40)) == ["weather?", "sunny", "thanks", "any time"]
+    assert texts(select_turns(CHAT, 49)) == ["weather?", "sunny", "thanks", "any time"]  # a turn fits whole or not at all
+
+
+def test_the_window_starts_on_a_human_turn():
+    assert texts(select_turns(CHAT, 30)) == ["thanks", "any time"]  # not with the reply "sunny"
+    assert select_turns(CHAT, 10) == []  # only a reply fits
+    assert select_turns(CHAT, 0) == []
+
+
+def test_older_turns_are_not_looked_at_once_the_budget_is_used():
+    class Untouchable(dict):
+        def get(self, key, default=None):
+            raise AssertionError("read a turn past the budget")
+
+    assert texts(select_turns([Untouchable(), turn("old", False)] + CHAT[2:], 40)) == texts(CHAT[2:])
+
+
+def test_turns_without_a_stored_count_are_counted_from_their_text():
+    old = {"text": "x" * 40, "human": True}
+
+    assert count_tokens(old["text"], True) == 14
+    assert texts(select_turns([old, turn("reply", False)], 24)) == ["x" * 40, "reply"]
+    assert select_turns([old, turn("reply", False)], 23) == []
+
+
+def test_rapid_fire_texts_are_sent_as_one_message_after_the_summary():
+    summary = {"text": "We talked about boilers.", "human": False, "summary": True, "tokens": 8}
+    messages = build_messages("You are Juneau.", [summary, turn("one", True), turn("two", True), turn("ok", False)])
+
+    assert [message.type for message in messages] == ["system", "human", "ai"]
+    assert messages[0].content.endswith("We talked about boilers.")
+    assert messages[1].content == "one\ntwo"
@@ -0,0 +1,38 @@
+"""
+Tier decisions of the processing lambda's router for typical texts.
+"""
+
+import pytest
+
+from lib import routing
+
+
+@pytest.mark.parametrize("text, tier", [
+    ("ok thx", routing.CANNED),
+    ("Thanks so much!", routing.CANNED),
+    ("👍", routing.CANNED),
+    ("ok?", routing.LIGHT),
+    ("so", routing.LIGHT),
+    ("what should I cook tonight?", routing.LIGHT),
+    ("Can you plan my week? What about the gym? And groceries?", routing.STANDARD),
+    ("Here is the whole story. " * 10, routing.STANDARD),
+])
+def test_tier_by_text(text, tier):
+    assert routing.route([text], history=[]).tier == tier
+
+
+def test_acknowledging_a_question_goes_to_a_model():
+    history = [
+        {"human": True, "text": "write my landlord a note"},
+        {"human": False, "text": "Here's a draft. Want me to make it firmer?"},
+    ]
+    decision = routing.route(["ok"], history)
+    assert decision.tier == routing.LIGHT
+    assert decision.features["after_question"]
+
+
+def test_attachments_and_deep_chats_get_the_standard_tier():
+    assert routing.route(["what is this"], [], attachments=1).reason == "attachments"
+    history = [{"human": index % 2 == 0, "text": "hi"} for index in range(routing.LIGHT_MAX_HISTORY_TURNS + 1)]
+    decision = routing.route(["and then"], history)
+    assert (decision.tier, decision.budget) == (routing.STANDARD, routing.BUDGETS[routing.STANDARD])
@@ -0,0 +1,138 @@
+"""
+Retries, throttling and deferral in the sending lambda, with Loop and SQS stubbed out.
+"""
+
+import importlib.util
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+SENDING = Path(__file__).resolve().parents[2] / "app" / "services" / "loop_message" / "sending" / "lambda.py"
+
+
+@pytest.fixture
+def sending(monkeypatch):
+    monkeypatch.setenv("ENVIRONMENT", "local")
+    monkeypatch.setenv("LOOP_API_KEY", "key")
+    monkeypatch.setenv("LOOP_AUTH_KEY", "auth")
+    spec = importlib.util.spec_from_file_location("sending_lambda_under_test", SENDING)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sleeps = []
+    monkeypatch.setattr(module.time, "sleep", sleeps.append)
+    module.sleeps = sleeps
+    return module
+
+
+def respond(module, monkeypatch, *responses):
+    """Make Loop answer with `responses` in turn: status codes, or exceptions to raise."""
+    calls = []
+
+    def post(url, headers, json, timeout):
+        calls.append(json)
+        answer = responses[len(calls) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        status, headers = answer if isinstance(answer, tuple) else (answer, {})
+        body = {"success": status < 400, "message_id": "loop-1"}
+        return SimpleNamespace(status_code=status, headers=headers, json=lambda: body, text="")
+
+    monkeypatch.setattr(module.http_session, "post", post)
+    return calls
+
+
+def test_5xx_and_connection_errors_are_retried_with_backoff(sending, monkeypatch):
+    calls = respond(sending, monkeypatch, 503, sending.requests.ConnectionError("reset"), 200)
+
+    result = sending.send_message("+15555555555", "hi")
+
+    assert result["message_id"] == "loop-1" and len(calls) == 3
+    assert len(sending.sleeps) == 2
+    assert all(0 <= delay <= sending.LOOP_BACKOFF_CAP for delay in sending.sleeps)
+
+
+def test_5xx_gives_up_after_the_last_attempt(sending, monkeypatch):
+    calls = respond(sending, monkeypatch, *[502] * sending.LOOP_MAX_ATTEMPTS)
+
+    with pytest.raises(sending.LoopSendError) as error:
+        sending.send_message("+15555555555", "hi")
+
+    assert error.value.status_code == 502 and len(calls) == sending.LOOP_MAX_ATTEMPTS
+
+
+def test_4xx_is_not_retried(sending, monkeypatch):
+    calls = respond(sending, monkeypatch, 400)
+
+    with pytest.raises(sending.LoopSendError):
+        sending.send_message("+15555555555", "hi")
+    assert len(calls) == 1
+
+
+def test_a_rejected_record_is_dropped_instead_of_failing_the_batch(sending, monkeypatch):
+    calls = respond(sending, monkeypatch, 400, 200, *[503] * sending.LOOP_MAX_ATTEMPTS)
+    records = [{"messageId": f"m-{index}", "body": json.dumps({"recipient": "+15555555555", "text": text})}
+               for index, text in enumerate(["rejected", "next", "unavailable"])]
+
+    response = sending.lambda_handler({"Records": records}, None)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "m-2"}]}  # only the 5xx is retried
+    assert [call["text"] for call in calls] == ["rejected", "next"] + ["unavailable"] * sending.LOOP_MAX_ATTEMPTS
+
+
+def test_429_raises_at_once_and_holds_back_later_sends(sending, monkeypatch):
+    calls = respond(sending, monkeypatch, (429, {"Retry-After": "30"}), 200)
+
+    with pytest.raises(sending.LoopThrottledError) as error:
+        sending.send_message("+15555555555", "hi")
+    assert error.value.retry_after == 30 and sending.sleeps == []
+
+    with pytest.raises(sending.LoopThrottledError):
+        sending.send_message("+15555555555", "again")
+    assert len(calls) == 1  # still throttled: Loop wasn't called
+
+
+def test_throttled_record_is_hidden_for_the_retry_after(sending, monkeypatch):
+    respond(sending, monkeypatch, (429, {"Retry-After": "30"}))
+    visibility = []
+    sqs = SimpleNamespace(change_message_visibility=lambda **kwargs: visibility.append(kwargs))
+    monkeypatch.setattr(sending.aws, "client", lambda name: sqs)
+    monkeypatch.setattr(sending.aws, "queue_url", lambda name: f"https://sqs/{name}")
+    record = {
+        "messageId": "m-1",
+        "receiptHandle": "handle-1",
+        "eventSourceARN": "arn:aws:sqs:us-east-1:123456789012:sending",
+        "attributes": {"ApproximateReceiveCount": "1"},
+        "body": json.dumps({"recipient": "+15555555555", "text": "hi"}),
+    }
+
+    with pytest.raises(sending.LoopThrottledError):
+        sending.send_record(record)
+
+    (call,) = visibility
+    assert call["QueueUrl"] == "https://sqs/sending" and call["ReceiptHandle"] == "handle-1"
+    assert 30 <= call["VisibilityTimeout"] <= 30 + sending.THROTTLE_BASE_DELAY
+
+
+def test_deferral_backs_off_with_the_receive_count(sending, monkeypatch):
+    monkeypatch.setattr(sending.aws, "client", lambda name: SimpleNamespace(change_message_visibility=lambda **_: None))
+    monkeypatch.setattr(sending.aws, "queue_url", lambda name: name)
+    record = {"receiptHandle": "h", "eventSourceARN": "arn:aws:sqs:us-east-1:1:sending",
+              "attributes": {"ApproximateReceiveCount": "20"}}
+
+    assert sending.defer_record(record) == sending.THROTTLE_MAX_DELAY
+    assert sending.defer_record({"body": "{}"}) is None  # not from SQS
+
+
+def test_chunks_of_a_reply_are_put_back_in_sequence_order(sending):
+    def chunk(message_id, reply_id=None, sequence=None):
+        body = {"recipient": "+15555555555", "text": message_id, "reply_id": reply_id, "sequence": sequence}
+        return {"messageId": message_id, "body": json.dumps({k: v for k, v in body.items() if v is not None})}
+
+    records = [chunk("r1-2", "r1", 2), chunk("plain"), chunk("r2-1", "r2", 1), chunk("r1-1", "r1", 1),
+               {"messageId": "broken", "body": "{not json"}, chunk("r1-3", "r1", 3)]
+
+    ordered = sending.delivery_order(records)
+
+    assert [record["messageId"] for record in ordered] == ["r1-1", "r1-2", "r1-3", "plain", "r2-1", "broken"]
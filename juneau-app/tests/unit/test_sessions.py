@@ -0,0 +1,64 @@
+"""
+The per-phone chat counter in UserChats, including counters from before the rename.
+"""
+
+import time
+
+from lib.sessions import CHAT_ID_CACHE_TTL, CHATS_TABLE, ChatSessions
+
+
+def test_a_new_phone_starts_at_chat_1(mocked_aws):
+    mocked_aws(CHATS_TABLE, "phone", "N")
+    sessions = ChatSessions()
+
+    assert sessions.current(15555555555) == 0
+    assert [sessions.rotate(15555555555) for _ in range(3)] == [1, 2, 3]
+    assert ChatSessions().current(15555555555) == 3
+
+
+def test_a_legacy_counter_is_read_and_continued(mocked_aws):
+    table = mocked_aws(CHATS_TABLE, "phone", "N")
+    table.put_item(Item={"phone": 15555555555, "my_int_attribute": 4})
+    sessions = ChatSessions()
+
+    assert sessions.current(15555555555) == 4
+    assert sessions.rotate(15555555555) == 5
+    assert ChatSessions().rotate(15555555555) == 6  # the ADD path, now that chat_id exists
+    assert ChatSessions().current(15555555555) == 6
+    assert table.get_item(Key={"phone": 15555555555})["Item"] == {"phone": 15555555555, "chat_id": 6, "legacy_through": 4}
+
+
+def test_an_upgrade_raced_by_another_container_still_counts_on(mocked_aws, monkeypatch):
+    table = mocked_aws(CHATS_TABLE, "phone", "N")
+    table.put_item(Item={"phone": 15555555555, "my_int_attribute": 4})
+    increment = ChatSessions._increment
+
+    def raced(table, phone, condition=None):
+        try:
+            return increment(table, phone, condition)
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            # Another container upgrades the counter before our own upgrade goes through
+            table.update_item(Key={"phone": phone}, UpdateExpression="SET chat_id = my_int_attribute + :one",
+                              ExpressionAttributeValues={":one": 1})
+            raise
+
+    monkeypatch.setattr(ChatSessions, "_increment", staticmethod(raced))
+
+    assert ChatSessions().rotate(15555555555) == 6
+
+
+def test_a_rotation_in_another_container_is_seen_by_the_next_invocation(mocked_aws, monkeypatch):
+    mocked_aws(CHATS_TABLE, "phone", "N")
+    here, there = ChatSessions(), ChatSessions()
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    assert here.current(15555555555) == 0
+
+    assert there.rotate(15555555555) == 1  # '✨' handled by the other container
+
+    assert here.current(15555555555) == 0  # same invocation, within the TTL
+    here.invalidate()  # the next invocation starts
+    assert here.current(15555555555) == 1
+    there.rotate(15555555555)
+    now[0] += CHAT_ID_CACHE_TTL
+    assert here.current(15555555555) == 2  # and the TTL bounds it either way
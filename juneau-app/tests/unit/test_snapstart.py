@@ -0,0 +1,35 @@
+"""
+SnapStart hooks in juneau_common.snapstart, run by hand as the Lambda runtime would.
+"""
+
+import os
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from juneau_common import aws, secrets, snapstart  # noqa: E402
+
+
+def test_restore_refreshes_secrets_and_aws_session(monkeypatch):
+    snapstart.run_before_snapshot()
+    primed = aws.session()
+    sqs = aws.client("sqs")
+    monkeypatch.setitem(secrets._cache, "dev/juneau/loop", (0.0, {"LOOP_API_KEY": "frozen"}))
+
+    snapstart.run_after_restore()
+
+    assert "dev/juneau/loop" not in secrets._cache
+    assert aws.session() is not primed
+    assert aws.client("sqs") is not sqs
+    # Service models parsed while priming are reused by the new session
+    assert aws._loader is not None
+
+
+def test_failing_priming_hook_does_not_stop_the_snapshot(monkeypatch):
+    ran = []
+
+    def broken():
+        raise RuntimeError("no network while priming")
+
+    monkeypatch.setattr(snapstart, "_before", [broken, lambda: ran.append("next")])
+    snapstart.run_before_snapshot()
+    assert ran == ["next"]
@@ -0,0 +1,68 @@
+"""
+The status lane's consumer: delivery statuses and reactions in batches, and the
+delivery latency of replies that carry our correlation passthrough.
+"""
+
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+from juneau_common import correlation
+from juneau_common.metrics import metrics
+
+STATUS = Path(__file__).resolve().parents[2] / "app" / "services" / "loop_message" / "status" / "lambda.py"
+
+
+@pytest.fixture
+def status():
+    spec = importlib.util.spec_from_file_location("status_lambda_under_test", STATUS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def latencies(monkeypatch):
+    recorded = {}
+    monkeypatch.setattr(metrics, "put", lambda name, value, unit=None: recorded.setdefault(name, []).append(value))
+    return recorded
+
+
+def record(message_id, alert_type="message_sent", envelope=None, **payload):
+    body = {"alert_type": alert_type, "message_id": message_id, "success": True, **payload}
+    message = {"messageId": message_id, "body": json.dumps(body)}
+    if envelope:
+        attribute = correlation.attributes(envelope, "status")[correlation.ATTRIBUTE]
+        message["messageAttributes"] = {correlation.ATTRIBUTE: {"stringValue": attribute["StringValue"]}}
+    return message
+
+
+def test_a_batch_of_statuses_is_handled_and_a_bad_record_retried(status):
+    records = [record("sent"), record("failed", "message_failed", error_code=100),
+               record("reaction", "message_reaction", reaction="love"), {"messageId": "garbled", "body": "{"}]
+
+    response = status.lambda_handler({"Records": records}, None)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "garbled"}]}
+
+
+def test_a_passthrough_closes_the_loop_on_delivery(status, latencies):
+    # the text's webhook at 1 s, the reply handed to Loop at 4 s, its status webhook at 6.5 s
+    passthrough = json.dumps({"correlation_id": "loop-1", "received": 1_000, "sent": 4_000})
+    webhook = dict(correlation.start("loop-2"), received=6_500)
+
+    status.lambda_handler({"Records": [record("reply-1", envelope=webhook, passthrough=passthrough)]}, None)
+
+    assert latencies["Latency.Delivered"] == [5_500]
+    assert latencies["Latency.LoopDelivery"] == [2_500]
+
+
+def test_statuses_without_our_passthrough_record_no_latency(status, latencies):
+    records = [record("plain"), record("foreign", passthrough="someone else's"),
+               record("failed", "message_failed", passthrough=correlation.passthrough(correlation.start()))]
+
+    status.lambda_handler({"Records": records}, None)
+
+    assert "Latency.Delivered" not in latencies
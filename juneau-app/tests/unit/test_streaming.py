@@ -0,0 +1,44 @@
+"""
+Splitting a streamed reply into text-message chunks.
+"""
+
+from lib.streaming import SentenceChunker
+
+
+def stream(chunker, *pieces):
+    chunks = []
+    for piece in pieces:
+        chunks += chunker.feed(piece)
+    return chunks + chunker.flush()
+
+
+def test_short_sentences_are_held_until_the_chunk_is_long_enough():
+    chunker = SentenceChunker(min_chars=20, max_chars=200)
+
+    assert chunker.feed("Hi. ") == []
+    assert chunker.feed("This is a longer sentence. And") == ["Hi. This is a longer sentence."]
+    assert chunker.flush() == ["And"]
+    assert chunker.flush() == []
+
+
+def test_a_paragraph_break_always_ends_a_chunk():
+    chunker = SentenceChunker(min_chars=200, max_chars=400)
+
+    assert stream(chunker, "Sure", ".\n", "\nFirst, ", "check the boiler.") == ["Sure.", "First, check the boiler."]
+
+
+def test_runs_without_punctuation_are_split_at_a_space():
+    chunks = stream(SentenceChunker(min_chars=20, max_chars=30), "word " * 10)
+
+    assert chunks == ["word word word word word word", "word word word word"]
+    assert all(len(chunk) <= 30 for chunk in chunks)
+
+
+def test_chunks_rebuild_the_reply_whatever_the_token_boundaries():
+    reply = "Okay! Here's the plan for today. First we go to the market.\n\nThen lunch? Sounds good."
+    tokens = [reply[index:index + 3] for index in range(0, len(reply), 3)]
+
+    chunks = stream(SentenceChunker(min_chars=10, max_chars=40), *tokens)
+
+    assert " ".join(chunks).split() == reply.split()
+    assert all(len(chunk) <= 40 for chunk in chunks)
@@ -0,0 +1,155 @@
+"""
+The receiving edge's lanes and its dedupe claim around the enqueue, and the native
+handler's API Gateway (HTTP API v2) events.
+"""
+
+import base64
+import json
+import time
+
+import pytest
+
+import webhook
+from juneau_common import aws
+from juneau_common.idempotency import deduplicator
+
+PAYLOAD = {"alert_type": "message_inbound", "message_id": "loop-1", "recipient": "+15555555555", "text": "hi"}
+
+
+@pytest.fixture
+def queue(dedupe_table, monkeypatch):
+    """Sends go through a stub; set `failures` to make the next sends raise."""
+    sent = []
+    state = {"failures": 0}
+
+    def send_to_queue(queue_name, **message):
+        if state["failures"]:
+            state["failures"] -= 1
+            raise RuntimeError("SQS is unavailable")
+        sent.append(dict(message, queue=queue_name))
+        return {"MessageId": f"sqs-{len(sent)}"}
+
+    monkeypatch.setattr(aws, "send_to_queue", send_to_queue)
+    state["sent"] = sent
+    return state
+
+
+def http_event(method="POST", path="/loop", body=PAYLOAD, authorization="Bearer secret", base64_encoded=False):
+    body = json.dumps(body)
+    if base64_encoded:
+        body = base64.b64encode(body.encode()).decode()
+    headers = {"Authorization": authorization} if authorization else {}
+    return {"rawPath": path, "requestContext": {"http": {"method": method, "path": path}},
+            "headers": headers, "body": body, "isBase64Encoded": base64_encoded}
+
+
+@pytest.fixture
+def handler(queue, monkeypatch):
+    """The native handler, with a bearer token and queue configured; returns (status, body)."""
+    monkeypatch.setenv("LOOP_BEARER_TOKEN", "secret")
+    monkeypatch.setenv("SQS_NAME", "processing")
+
+    def handle(event):
+        response = webhook.lambda_handler(event, None)
+        return response["statusCode"], json.loads(response["body"])
+    return handle
+
+
+@pytest.fixture
+def lanes(queue, monkeypatch):
+    monkeypatch.setenv("SQS_NAME", "processing")
+    monkeypatch.setenv("STATUS_SQS_NAME", "status")
+    return queue
+
+
+def test_texts_and_statuses_go_to_their_own_lanes(lanes):
+    for alert_type in ("message_inbound", "message_sent", "message_failed", "message_timeout", "message_reaction"):
+        webhook.ingest(dict(PAYLOAD, alert_type=alert_type))
+
+    assert [message["queue"] for message in lanes["sent"]] == ["processing"] + ["status"] * 4
+    assert {json.loads(message["MessageAttributes"]["Correlation"]["StringValue"])["hops"][-1]["stage"]
+            for message in lanes["sent"][1:]} == {"status"}
+
+
+@pytest.mark.parametrize("alert_type", ["group_created", "conversation_inited", "unknown"])
+def test_alerts_nothing_acts_on_are_dropped(lanes, alert_type):
+    payload = {key: value for key, value in PAYLOAD.items() if key != "alert_type"}
+    if alert_type != "unknown":  # no alert type at all
+        payload["alert_type"] = alert_type
+    before = webhook.dropped[alert_type]
+
+    response = webhook.ingest(payload)
+
+    assert response["status"] == "success"
+    assert lanes["sent"] == []
+    assert webhook.dropped[alert_type] == before + 1
+
+
+def test_statuses_are_dropped_without_a_status_queue(lanes, monkeypatch):
+    monkeypatch.delenv("STATUS_SQS_NAME")
+
+    assert webhook.ingest(dict(PAYLOAD, alert_type="message_sent"))["message"] == "Ignored message_sent webhook"
+    webhook.ingest(PAYLOAD)
+
+    assert [message["queue"] for message in lanes["sent"]] == ["processing"]
+
+
+def test_a_failed_send_lets_loops_retry_through(queue):
+    queue["failures"] = 1
+
+    with pytest.raises(webhook.WebhookError):
+        webhook.enqueue(PAYLOAD, "processing")
+
+    assert webhook.enqueue(PAYLOAD, "processing") == "sqs-1"
+    assert webhook.enqueue(PAYLOAD, "processing") is None  # now it is a duplicate
+
+
+def test_a_claim_left_by_a_timed_out_attempt_runs_out(queue, monkeypatch):
+    assert deduplicator.claim("edge:message_inbound:loop-1", lease=webhook.EDGE_LEASE_SECONDS)  # then the lambda died
+
+    assert webhook.enqueue(PAYLOAD, "processing") is None
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + webhook.EDGE_LEASE_SECONDS + 1)
+    assert webhook.enqueue(PAYLOAD, "processing") == "sqs-1"
+
+
+def test_the_edge_writes_only_its_lease(queue, dedupe_table, monkeypatch):
+    assert webhook.enqueue(PAYLOAD, "processing") == "sqs-1"
+
+    item = dedupe_table.get_item(Key={"id": "edge:message_inbound:loop-1"})["Item"]
+    assert item["status"] == "pending"  # never completed: one write per message at the edge
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + webhook.EDGE_LEASE_SECONDS + 1)
+    assert webhook.enqueue(PAYLOAD, "processing") is None  # this container still knows it
+    deduplicator.invalidate()  # another container: processing's claim drops this copy
+    assert webhook.enqueue(PAYLOAD, "processing") == "sqs-2"
+
+
+def test_the_native_handler_enqueues_an_authorized_webhook(handler, queue):
+    status, body = handler(http_event())
+
+    assert status == 200 and body["message"] == "Message sent to SQS: sqs-1"
+    assert [json.loads(message["MessageBody"]) for message in queue["sent"]] == [PAYLOAD]
+
+
+def test_the_native_handler_decodes_a_base64_body(handler, queue):
+    status, _ = handler(http_event(base64_encoded=True))
+
+    assert status == 200
+    assert json.loads(queue["sent"][0]["MessageBody"]) == PAYLOAD
+
+
+@pytest.mark.parametrize("authorization, expected", [(None, 401), ("Bearer wrong", 403)])
+def test_the_native_handler_rejects_a_bad_token(handler, queue, authorization, expected):
+    status, body = handler(http_event(authorization=authorization))
+
+    assert status == expected and "detail" in body
+    assert queue["sent"] == []
+
+
+def test_the_native_handler_answers_health_checks_and_unknown_paths(handler):
+    assert handler(http_event("GET", "/")) == (200, {"message": "Webhook server is running"})
+    assert handler(http_event("POST", "/elsewhere")) == (404, {"detail": "Not Found"})
+    assert handler(http_event("GET", "/loop"))[0] == 404
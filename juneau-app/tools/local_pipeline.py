@@ -0,0 +1,479 @@
+#!/usr/bin/env python
+"""
+Local end-to-end harness: receiving -> processing -> sending, without AWS, Gemini or Loop.
+
+The three handlers run unchanged in this process against in-memory SQS and DynamoDB
+(moto), a fake Gemini chat model with configurable latency and a fake Loop API served
+over HTTP on localhost. Pollers stand in for the SQS event sources and invoke each
+handler with Lambda-shaped batches.
+
+On top of that, a load generator runs N concurrent conversations and reports the
+webhook-to-send latency (until Loop receives the first bubble of the reply), the
+throughput and the number of DynamoDB and SQS calls made per message:
+
+    pip install -r requirements-dev.txt
+    python tools/local_pipeline.py --conversations 20 --messages 5 --model-latency 0.3
+
+The numbers include moto's own overhead, so they are a baseline to compare runs
+against rather than a prediction of deployed latency.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import types
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SERVICES_DIR = Path(__file__).resolve().parents[1] / "app" / "services"
+sys.path[:0] = [
+    str(SERVICES_DIR / "common"),
+    str(SERVICES_DIR / "processing"),
+    str(SERVICES_DIR / "loop_message" / "receiving"),
+]
+
+BEARER_TOKEN = "local-pipeline"
+QUEUES = ("processing", "sending", "status")
+QUEUE_NAMES = {"processing": "processing", "sending": "sending.fifo", "status": "status"}
+MEMORY_BUCKET = "local-pipeline-memory"
+REPLY = ("Sure thing, I can help with that right now. Let me think it over for a second before answering. "
+         "Here is what I would do next, step by step, so nothing gets missed.")
+
+
+class FakeChatModel:
+    """Stands in for ChatGoogleGenerativeAI: fixed reply after `latency`, streamed word by word."""
+    latency = 0.0
+    token_latency = 0.0
+
+    def __init__(self, model=None, google_api_key=None, **kwargs):
+        self.model = model
+
+    def _usage(self, messages, reply):
+        input_tokens = sum(len(message.content) // 4 for message in messages)
+        output_tokens = len(reply) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def invoke(self, messages):
+        from langchain_core.messages import AIMessage
+
+        time.sleep(self.latency)
+        return AIMessage(content=REPLY, usage_metadata=self._usage(messages, REPLY))
+
+    def stream(self, messages):
+        from langchain_core.messages import AIMessageChunk
+
+        time.sleep(self.latency)
+        words = REPLY.split(" ")
+        for index, word in enumerate(words):
+            time.sleep(self.token_latency)
+            last = index == len(words) - 1
+            yield AIMessageChunk(
+                content=word if last else word + " ",
+                usage_metadata=self._usage(messages, REPLY) if last else None,
+            )
+
+
+class FakeLoop:
+    """Minimal Loop send API on localhost that records when each message arrives."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.received: List[dict] = []
+        self.first_send: Dict[str, float] = {}  # correlation id -> perf_counter of its first bubble
+        self._arrived: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api/v1/message/send/"
+
+    def _handler(self):
+        loop = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                time.sleep(loop.latency)
+                loop.record(body)
+                response = json.dumps({"success": True, "message_id": uuid.uuid4().hex}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def record(self, body: dict):
+        arrived = time.perf_counter()
+        try:
+            correlation_id = json.loads(body.get("passthrough") or "{}").get("correlation_id")
+        except ValueError:
+            correlation_id = None
+        with self._lock:
+            self.received.append(body)
+            if correlation_id and correlation_id not in self.first_send:
+                self.first_send[correlation_id] = arrived
+                self._event(correlation_id).set()
+
+    def _event(self, correlation_id: str) -> threading.Event:
+        return self._arrived.setdefault(correlation_id, threading.Event())
+
+    def wait(self, correlation_id: str, timeout: float) -> Optional[float]:
+        with self._lock:
+            event = self._event(correlation_id)
+        if not event.wait(timeout):
+            return None
+        return self.first_send[correlation_id]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def load_handler(name: str, path: Path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class QueuePoller(threading.Thread):
+    """Plays the SQS event source: receive a batch, invoke the handler, delete what succeeded."""
+
+    def __init__(self, sqs, queue_url: str, queue_arn: str, handler, batch_size: int, stop: threading.Event):
+        super().__init__(daemon=True)
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.queue_arn = queue_arn
+        self.handler = handler
+        self.batch_size = batch_size
+        self.stop_event = stop
+        self.errors: List[str] = []
+
+    def run(self):
+        while not self.stop_event.is_set():
+            messages = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=self.batch_size,
+                AttributeNames=["All"],
+                MessageAttributeNames=["All"],
+            ).get("Messages", [])
+            if not messages:
+                time.sleep(0.005)
+                continue
+            records = [self.record(message) for message in messages]
+            try:
+                response = self.handler({"Records": records}, None) or {}
+            except Exception as e:  # a crashed invocation: the whole batch becomes visible again
+                self.errors.append(str(e))
+                continue
+            failed = {failure["itemIdentifier"] for failure in response.get("batchItemFailures", [])}
+            for message in messages:
+                if message["MessageId"] not in failed:
+                    self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"])
+
+    def record(self, message: dict) -> dict:
+        return {
+            "messageId": message["MessageId"],
+            "receiptHandle": message["ReceiptHandle"],
+            "body": message["Body"],
+            "attributes": message.get("Attributes", {}),
+            "messageAttributes": {
+                name: {"stringValue": value.get("StringValue"), "dataType": value["DataType"]}
+                for name, value in message.get("MessageAttributes", {}).items()
+            },
+            "eventSource": "aws:sqs",
+            "eventSourceARN": self.queue_arn,
+        }
+
+
+class LocalPipeline:
+    def __init__(self, model_latency: float = 0.0, token_latency: float = 0.0, loop_latency: float = 0.0,
+                 stream_replies: bool = False, concurrency: int = 5, batch_size: int = 5,
+                 handler_wrapper=None):
+        self.model_latency = model_latency
+        self.token_latency = token_latency
+        self.loop_latency = loop_latency
+        self.stream_replies = stream_replies
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.handler_wrapper = handler_wrapper  # (name, lambda_handler) -> lambda_handler, e.g. to time invocations
+        self.calls = Counter()  # "<Service>.<Operation>" -> calls made by the handlers
+        self._stop = threading.Event()
+        self._pollers: List[QueuePoller] = []
+        self._saved_modules = {}
+        self._saved_environ = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._saved_environ = dict(os.environ)  # the handlers are configured through it; `stop` puts it back
+        os.environ.update({
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_ACCESS_KEY_ID": "local",
+            "AWS_SECRET_ACCESS_KEY": "local",
+            "ENVIRONMENT": "local",
+            "GEMINI_API_KEY": "local",
+            "LOOP_API_KEY": "local",
+            "LOOP_AUTH_KEY": "local",
+            "LOOP_BEARER_TOKEN": BEARER_TOKEN,
+            "STREAM_REPLIES": str(self.stream_replies).lower(),
+            # Both handlers share juneau_common.batch's executor in this process, so keep the sizes equal
+            "PROCESSING_CONCURRENCY": str(self.concurrency),
+            "SENDING_CONCURRENCY": str(self.concurrency),
+        })
+        from moto import mock_aws
+
+        self._mock = mock_aws()
+        self._mock.start()
+        import boto3
+        from juneau_common import aws
+        from juneau_common.idempotency import deduplicator
+        from juneau_common.metrics import metrics
+
+        aws.reset()
+        aws.session().events.register("before-call", self._count_call, unique_id="local-pipeline-calls")
+        metrics.sample_rate = 0  # keep EMF lines out of the way
+        deduplicator.invalidate()
+        self._create_tables(boto3.client("dynamodb"))
+        self.sqs = boto3.client("sqs")
+        boto3.client("s3").create_bucket(Bucket=MEMORY_BUCKET)
+        self.queues = {}
+        for name in QUEUES:
+            attributes = {"VisibilityTimeout": "30"}
+            if name == "sending":  # FIFO, as in the stack
+                attributes["FifoQueue"] = "true"
+            url = self.sqs.create_queue(QueueName=QUEUE_NAMES[name], Attributes=attributes)["QueueUrl"]
+            arn = self.sqs.get_queue_attributes(QueueUrl=url, AttributeNames=["QueueArn"])["Attributes"]["QueueArn"]
+            self.queues[name] = (url, arn)
+
+        FakeChatModel.latency = self.model_latency
+        FakeChatModel.token_latency = self.token_latency
+        fake_gemini = types.ModuleType("langchain_google_genai")
+        fake_gemini.ChatGoogleGenerativeAI = FakeChatModel
+        self._saved_modules["langchain_google_genai"] = sys.modules.get("langchain_google_genai")
+        sys.modules["langchain_google_genai"] = fake_gemini
+
+        self.loop = FakeLoop(self.loop_latency)
+        self.loop.start()
+        os.environ["LOOP_API_URL"] = self.loop.url
+
+        # Each handler reads its queue names when it runs (receiving) or at import (the others)
+        os.environ["SQS_NAME"] = QUEUE_NAMES["sending"]
+        os.environ["COMPACTION_SQS_NAME"] = "processing"
+        os.environ["MEMORY_SQS_NAME"] = "processing"
+        os.environ["MEMORY_BUCKET"] = MEMORY_BUCKET
+        self.processing = load_handler("local_pipeline_processing", SERVICES_DIR / "processing" / "lambda.py")
+        self.sending = load_handler("local_pipeline_sending", SERVICES_DIR / "loop_message" / "sending" / "lambda.py")
+        self.status = load_handler("local_pipeline_status", SERVICES_DIR / "loop_message" / "status" / "lambda.py")
+        self.receiving = load_handler("local_pipeline_webhook", SERVICES_DIR / "loop_message" / "receiving" / "webhook.py")
+        os.environ["SQS_NAME"] = "processing"
+        os.environ["STATUS_SQS_NAME"] = "status"
+        from lib import conversations, models, sessions
+
+        conversations.repository.invalidate()
+        sessions.sessions.invalidate()
+        models.pool.reset()  # its warm client may be a model from before the fake was installed
+        if self.handler_wrapper:
+            for name in ("receiving", "processing", "sending", "status"):
+                module = getattr(self, name)
+                module.lambda_handler = self.handler_wrapper(name, module.lambda_handler)
+
+        for name, handler in (("processing", self.processing), ("sending", self.sending), ("status", self.status)):
+            url, arn = self.queues[name]
+            for _ in range(self.concurrency):
+                poller = QueuePoller(boto3.client("sqs"), url, arn, handler.lambda_handler, self.batch_size, self._stop)
+                poller.start()
+                self._pollers.append(poller)
+
+    def stop(self):
+        self._stop.set()
+        for poller in self._pollers:
+            poller.join(timeout=5)
+        self.loop.stop()
+        for name, module in self._saved_modules.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        from juneau_common import aws
+
+        aws.reset()
+        self._mock.stop()
+        if self._saved_environ is not None:
+            os.environ.clear()
+            os.environ.update(self._saved_environ)
+            self._saved_environ = None
+
+    @property
+    def errors(self) -> List[str]:
+        return [error for poller in self._pollers for error in poller.errors]
+
+    def _count_call(self, model, **kwargs):
+        self.calls[f"{model.service_model.service_id}.{model.name}"] += 1
+
+    def _create_tables(self, dynamodb):
+        tables = {
+            "UserChats": [("phone", "N", "HASH")],
+            "ConversationTurns": [("conversation", "S", "HASH"), ("seq", "N", "RANGE")],
+            "UserConversations": [("phone", "N", "HASH"), ("chat_id", "N", "RANGE")],  # legacy history
+            "WebhookDedupe": [("id", "S", "HASH")],
+        }
+        for table_name, keys in tables.items():
+            dynamodb.create_table(
+                TableName=table_name,
+                KeySchema=[{"AttributeName": name, "KeyType": key_type} for name, _, key_type in keys],
+                AttributeDefinitions=[{"AttributeName": name, "AttributeType": kind} for name, kind, _ in keys],
+                BillingMode="PAY_PER_REQUEST",
+            )
+
+    def post_webhook(self, payload: dict) -> dict:
+        """Call the receiving handler with an API Gateway HTTP API event."""
+        return self.receiving.lambda_handler({
+            "rawPath": "/loop",
+            "requestContext": {"http": {"method": "POST", "path": "/loop"}},
+            "headers": {"authorization": f"Bearer {BEARER_TOKEN}", "content-type": "application/json"},
+            "body": json.dumps(payload),
+            "isBase64Encoded": False,
+        }, None)
+
+
+    def warm_up(self, timeout: float = 60.0):
+        """One message through the whole pipeline so lazy imports (LangChain, ...) are not measured."""
+        message_id = f"warm-up-{uuid.uuid4().hex[:8]}"
+        self.post_webhook({
+            "alert_type": "message_inbound",
+            "message_id": message_id,
+            "recipient": "+15550000000",
+            "text": "warm up",
+        })
+        if self.loop.wait(message_id, timeout) is None:
+            raise RuntimeError(f"Warm-up message was not delivered: {self.errors}")
+
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+def run_load(pipeline: LocalPipeline, conversations: int, messages: int, timeout: float = 30.0) -> dict:
+    """
+    Run `conversations` concurrent chats of `messages` texts each. Every chat waits for
+    the reply before sending its next text, like a person would.
+    """
+    latencies: List[float] = []
+    lost = []
+    lock = threading.Lock()
+
+    def conversation(index: int):
+        recipient = f"+1555{index:07d}"
+        for turn in range(messages):
+            message_id = f"load-{index}-{turn}-{uuid.uuid4().hex[:8]}"
+            started = time.perf_counter()
+            pipeline.post_webhook({
+                "alert_type": "message_inbound",
+                "message_id": message_id,
+                "webhook_id": uuid.uuid4().hex,
+                "recipient": recipient,
+                "text": f"message {turn} from conversation {index}",
+                "message_type": "text",
+                "api_version": "1.0",
+            })
+            delivered = pipeline.loop.wait(message_id, timeout)
+            with lock:
+                if delivered is None:
+                    lost.append(message_id)
+                else:
+                    latencies.append((delivered - started) * 1000)
+
+    calls_before = Counter(pipeline.calls)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=conversations) as executor:
+        list(executor.map(conversation, range(conversations)))
+    elapsed = time.perf_counter() - started
+    calls = pipeline.calls - calls_before
+
+    total = conversations * messages
+    per_message = {name: round(count / total, 2) for name, count in sorted(calls.items())}
+    return {
+        "messages": total,
+        "delivered": len(latencies),
+        "lost": len(lost),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 1),
+            "p95": round(percentile(latencies, 0.95), 1),
+            "p99": round(percentile(latencies, 0.99), 1),
+            "max": round(max(latencies), 1) if latencies else float("nan"),
+        },
+        "calls_per_message": {
+            "DynamoDB": round(sum(count for name, count in calls.items() if name.startswith("DynamoDB.")) / total, 2),
+            "SQS": round(sum(count for name, count in calls.items() if name.startswith("SQS.")) / total, 2),
+            "by_operation": per_message,
+        },
+        "handler_errors": pipeline.errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Juneau pipeline locally under load")
+    parser.add_argument("--conversations", type=int, default=10, help="concurrent conversations")
+    parser.add_argument("--messages", type=int, default=3, help="texts per conversation")
+    parser.add_argument("--model-latency", type=float, default=0.2, help="seconds before the fake model answers")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed words")
+    parser.add_argument("--loop-latency", type=float, default=0.05, help="seconds the fake Loop API takes per send")
+    parser.add_argument("--stream", action="store_true", help="stream replies bubble by bubble")
+    parser.add_argument("--concurrency", type=int, default=5, help="concurrent invocations per stage")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for each reply")
+    parser.add_argument("--cold", action="store_true", help="include the first, cold message in the numbers")
+    parser.add_argument("--verbose", action="store_true", help="show the handlers' own output")
+    args = parser.parse_args()
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    pipeline = LocalPipeline(
+        model_latency=args.model_latency,
+        token_latency=args.token_latency,
+        loop_latency=args.loop_latency,
+        stream_replies=args.stream,
+        concurrency=args.concurrency,
+    )
+    with quiet, pipeline:
+        if not args.cold:
+            pipeline.warm_up()
+        report = run_load(pipeline, args.conversations, args.messages, args.timeout)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
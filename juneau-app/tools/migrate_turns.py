@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Pack stored conversation turns into compressed pages (see processing/lib/encoding.py).
+
+Two sources can be migrated:
+
+- `items`: plain turn items in ConversationTurns, written before pages existed. Each
+  exchange (a run of texts and the reply to them) becomes one page item that replaces
+  its turns in a single transaction, so readers never see a turn twice or not at all.
+  Summary items are left as they are.
+- `lists`: chats in the legacy UserConversations table, stored as one `messages` list of
+  (text, human) pairs. They are copied into ConversationTurns as pages sorted before
+  every newer turn of the same chat, and each legacy item is marked `migrated_to` so
+  processing stops reading it (its messages are kept).
+
+  Chat ids must keep meaning the same chat. A phone whose UserChats counter is still
+  the legacy `my_int_attribute` keeps its ids, and `chat_id` is seeded past the highest
+  one. A phone that has both attributes had its count restarted at 1 by an earlier
+  release, so its newer chats reuse legacy ids: those legacy chats are moved to
+  negative ids instead (in order, the newest at -1), which the counter never reaches.
+
+Readers understand both encodings, so this can run while the stack is live, and again
+(turns already in pages are skipped, copied lists are rewritten in place).
+
+    # what would change, with the item size and capacity units saved
+    python tools/migrate_turns.py items --dry-run --profile juneau --region us-east-1
+    python tools/migrate_turns.py lists --profile juneau --region us-east-1
+"""
+
+import argparse
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+SERVICES_DIR = Path(__file__).resolve().parents[1] / "app" / "services"
+sys.path[:0] = [str(SERVICES_DIR / "common"), str(SERVICES_DIR / "processing")]
+
+from lib import conversations, encoding, sessions  # noqa: E402
+
+TRANSACTION_ITEMS = 100  # DynamoDB's limit per TransactWriteItems
+
+
+def scan(table) -> Iterator[dict]:
+    query = {}
+    while True:
+        response = table.scan(**query)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def exchanges(turns: List[dict]) -> List[List[dict]]:
+    """Turns (oldest first) split after each reply, the way they are saved today."""
+    groups, current = [], []
+    for turn in turns:
+        current.append(turn)
+        if not turn['human']:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return [group[index:index + TRANSACTION_ITEMS - 1] for group in groups
+            for index in range(0, len(group), TRANSACTION_ITEMS - 1)]
+
+
+def plain_turns(table) -> Dict[str, List[dict]]:
+    """Plain, non-summary turn items per conversation, oldest first."""
+    found = defaultdict(list)
+    for item in scan(table):
+        if 'page' not in item and not item.get('summary'):
+            found[item['conversation']].append(item)
+    for turns in found.values():
+        turns.sort(key=lambda turn: turn['seq'])
+    return found
+
+
+def legacy_turns(table, counters, stored: Dict[str, List[dict]], dry_run: bool = False) -> Dict[str, List[dict]]:
+    """Turns of every UserConversations chat under its chat id from now on (see `chat_ids`)."""
+    chats = defaultdict(list)
+    for item in scan(table):
+        chats[int(item['phone'])].append(item)
+    found = {}
+    for phone, items in chats.items():
+        renumbered = chat_ids(table, counters, phone, items, dry_run)
+        for item in items:
+            chat_id = renumbered[int(item['chat_id'])]
+            key = conversations.conversation_key(phone, chat_id)
+            found[key] = conversations.legacy_turns(phone, chat_id, item.get('messages', []))
+            stored[key] = [item]
+    return found
+
+
+def chat_ids(table, counters, phone: int, items: List[dict], dry_run: bool = False) -> Dict[int, int]:
+    """
+    Legacy chat id -> chat id for one phone, recorded on each legacy item as
+    `migrated_to` before its UserChats counter is brought in line (seeded past the
+    legacy ids if it was never upgraded), so a rerun after a failure renumbers alike.
+    """
+    legacy = sorted(int(item['chat_id']) for item in items)
+    migrated = {int(item['chat_id']): int(item['migrated_to']) for item in items if 'migrated_to' in item}
+    counter = counters.get_item(Key={'phone': phone}).get('Item', {})
+    if 'chat_id' in counter and sessions.LEGACY_COUNTER in counter:
+        # Restarted at 1: chats 1..chat_id are newer ones, so the legacy chats move below 0
+        renumbered = {chat_id: chat_id - legacy[-1] - 1 for chat_id in legacy}
+    else:
+        renumbered = {chat_id: chat_id for chat_id in legacy}
+    renumbered.update(migrated)  # a rerun keeps the ids of the first run
+    if dry_run:
+        return renumbered
+    for legacy_id, chat_id in renumbered.items():
+        if legacy_id not in migrated:
+            table.update_item(
+                Key={'phone': phone, 'chat_id': legacy_id},
+                UpdateExpression='SET migrated_to = :chat_id',
+                ExpressionAttributeValues={':chat_id': chat_id},
+            )
+    # ...and its legacy watermark cleared, so processing stops looking in UserConversations
+    watermark = {':none': sessions.NO_LEGACY}
+    if 'chat_id' not in counter:
+        update = dict(
+            UpdateExpression=(f'SET chat_id = :seed, {sessions.LEGACY_WATERMARK} = :none '
+                              f'REMOVE {sessions.LEGACY_COUNTER}'),
+            ConditionExpression='attribute_not_exists(chat_id)',
+            ExpressionAttributeValues={':seed': max(legacy[-1], int(counter.get(sessions.LEGACY_COUNTER, 0))),
+                                       **watermark},
+        )
+    elif sessions.LEGACY_COUNTER in counter:  # marks the phone as renumbered
+        update = dict(
+            UpdateExpression=f'SET {sessions.LEGACY_WATERMARK} = :none REMOVE {sessions.LEGACY_COUNTER}',
+            ConditionExpression='attribute_exists(chat_id)',
+            ExpressionAttributeValues=watermark,
+        )
+    else:
+        update = dict(UpdateExpression=f'SET {sessions.LEGACY_WATERMARK} = :none', ExpressionAttributeValues=watermark)
+    try:
+        counters.update_item(Key={'phone': phone}, **update)
+    except counters.meta.client.exceptions.ConditionalCheckFailedException:
+        # rotated in the meantime, which moved the legacy count over
+        counters.update_item(Key={'phone': phone}, UpdateExpression=f'SET {sessions.LEGACY_WATERMARK} = :none',
+                             ExpressionAttributeValues=watermark)
+    return renumbered
+
+
+def migrate(source: str, session, dry_run: bool = False) -> dict:
+    dynamodb = session.resource("dynamodb")
+    turns_table = dynamodb.Table(conversations.TURNS_TABLE)
+    if source == "items":
+        found = stored = plain_turns(turns_table)
+    else:
+        stored = {}  # the items as they are now, for the report
+        found = legacy_turns(dynamodb.Table(conversations.LEGACY_TABLE), dynamodb.Table(sessions.CHATS_TABLE),
+                             stored, dry_run)
+    client = session.client("dynamodb")
+    serializer = _serializer()
+    report = defaultdict(float)
+    for key, turns in found.items():
+        groups = exchanges(turns)
+        pages = [encoding.page_item(group) for group in groups]
+        report["turns"] += len(turns)
+        report["pages"] += len(pages)
+        report["bytes_before"] += sum(encoding.item_size(item) for item in stored[key])
+        report["bytes_after"] += sum(encoding.item_size(page) for page in pages)
+        report["wcu_before"] += encoding.write_units(stored[key])
+        report["wcu_after"] += encoding.write_units(pages)
+        report["rcu_before"] += encoding.read_units(stored[key])  # reading the whole chat once
+        report["rcu_after"] += encoding.read_units(pages)
+        if dry_run:
+            continue
+        for group, page in zip(groups, pages):
+            actions = [{"Put": {"TableName": conversations.TURNS_TABLE,
+                                "Item": {name: serializer.serialize(value) for name, value in page.items()}}}]
+            if source == "items":
+                # the page takes the key of its newest turn, so the Put replaces that one
+                actions += [
+                    {"Delete": {"TableName": conversations.TURNS_TABLE, "Key": {
+                        "conversation": serializer.serialize(turn['conversation']),
+                        "seq": serializer.serialize(turn['seq']),
+                    }}}
+                    for turn in group[:-1]
+                ]
+            client.transact_write_items(TransactItems=actions)
+    report["conversations"] = len(found)
+    return dict(report)
+
+
+def _serializer():
+    from boto3.dynamodb.types import TypeSerializer
+
+    return TypeSerializer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", choices=["items", "lists"], help="plain turn items, or UserConversations lists")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--profile", help="AWS profile")
+    parser.add_argument("--region", help="AWS region")
+    args = parser.parse_args()
+
+    import boto3
+
+    session = boto3.session.Session(profile_name=args.profile, region_name=args.region)
+    report = migrate(args.source, session, dry_run=args.dry_run)
+    print(f"{'Would pack' if args.dry_run else 'Packed'} {int(report.get('turns', 0))} turns of "
+          f"{report['conversations']} conversations into {int(report.get('pages', 0))} pages")
+    for name in ("bytes", "wcu", "rcu"):
+        before, after = report.get(f"{name}_before", 0), report.get(f"{name}_after", 0)
+        saved = 1 - after / before if before else 0
+        print(f"{name:<6}{before:>14,.1f}{after:>14,.1f}{saved:>10.0%} saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""
+Memory/power sweep for the JuneauAppStack functions.
+
+Lambda allocates CPU in proportion to memory (one full vCPU at 1769 MB), so a function
+pinned at 128 MB may spend most of its time CPU-starved in imports and prompt
+building. For every function and memory setting this reports the average duration,
+the cold start (init) time and the cost per 1k messages, and recommends the cheapest
+setting whose duration is within --tolerance of the fastest.
+
+Two ways to measure:
+
+    # deployed: publish a version of a copy of each function per memory setting, invoke
+    # it and read the REPORT lines (the live function and its aliases are left alone)
+    python tools/power_sweep.py deployed --event processing=events/processing.json
+    # local: measure CPU and wall time in tools/local_pipeline.py and scale the CPU part
+    python tools/power_sweep.py local --messages 20
+
+The local numbers are an estimate: CPU time is stretched by 1769 / memory below a full
+vCPU, waiting (model, Loop, DynamoDB) is not, and moto's own CPU counts as ours.
+
+--write stores the recommendations in cdk.json under <environment>.MEMORY_SIZES,
+which the stack reads for each function's memory_size.
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+TOOLS_DIR = Path(__file__).resolve().parent
+APP_DIR = TOOLS_DIR.parent
+SERVICES_DIR = APP_DIR / "app" / "services"
+sys.path.insert(0, str(TOOLS_DIR))
+
+FUNCTIONS = {  # stack key -> (logical id prefix in CloudFormation, handler file)
+    "receiving": ("ReceiveLoopMessage", SERVICES_DIR / "loop_message" / "receiving" / "webhook.py"),
+    "processing": ("ProcessingMessageFunction", SERVICES_DIR / "processing" / "lambda.py"),
+    "sending": ("SendLoopMessageFunction", SERVICES_DIR / "loop_message" / "sending" / "lambda.py"),
+    "status": ("StatusMessageFunction", SERVICES_DIR / "loop_message" / "status" / "lambda.py"),
+}
+DEFAULT_MEMORY_SIZES = [128, 256, 512, 1024, 1769, 3008]
+FULL_VCPU_MB = 1769
+PRICE_PER_GB_SECOND = {"arm64": 0.0000133334, "x86_64": 0.0000166667}  # us-east-1
+PRICE_PER_REQUEST = 0.20 / 1_000_000
+COPY_SUFFIX = "-power-sweep"
+
+REPORT_FIELDS = {
+    "duration": r"\tDuration: ([\d.]+) ms",
+    "billed": r"Billed Duration: (\d+) ms",
+    "max_memory": r"Max Memory Used: (\d+) MB",
+    "init": r"Init Duration: ([\d.]+) ms",
+}
+
+# Harmless default events; processing and sending would reply to real people, so pass --event for them
+DEFAULT_EVENTS = {
+    "receiving": {"rawPath": "/", "requestContext": {"http": {"method": "GET", "path": "/"}}, "headers": {}},
+    "status": {"Records": [{
+        "messageId": "power-sweep",
+        "body": json.dumps({"alert_type": "message_sent", "success": True, "message_id": "power-sweep"}),
+    }]},
+}
+
+
+def messages_in(event: dict) -> int:
+    return max(len(event.get("Records", [])), 1)
+
+
+def invocation_cost(billed_ms: float, memory_mb: int, architecture: str) -> float:
+    return math.ceil(billed_ms) / 1000 * memory_mb / 1024 * PRICE_PER_GB_SECOND[architecture] + PRICE_PER_REQUEST
+
+
+def summarise(memory_mb: int, durations: List[float], init_ms: float, messages: float,
+              architecture: str, cold_start_rate: float) -> dict:
+    """One row of the sweep: warm duration, init, and cost per 1k messages including a share of cold starts."""
+    mean = statistics.mean(durations)
+    per_invocation = invocation_cost(mean, memory_mb, architecture)
+    # Init is billed too; spread it over the invocations that pay for it
+    per_invocation += cold_start_rate * math.ceil(init_ms) / 1000 * memory_mb / 1024 * PRICE_PER_GB_SECOND[architecture]
+    return {
+        "memory_mb": memory_mb,
+        "duration_ms": round(mean, 1),
+        "p95_ms": round(sorted(durations)[max(0, math.ceil(0.95 * len(durations)) - 1)], 1),
+        "init_ms": round(init_ms, 1),
+        "cost_per_1k_messages": round(per_invocation / messages * 1000, 6),
+    }
+
+
+def recommend(rows: List[dict], tolerance: float) -> dict:
+    """The cheapest setting whose duration is within `tolerance` of the fastest one."""
+    fastest = min(row["duration_ms"] for row in rows)
+    candidates = [row for row in rows if row["duration_ms"] <= fastest * (1 + tolerance)]
+    return min(candidates, key=lambda row: (row["cost_per_1k_messages"], row["memory_mb"]))
+
+
+# Deployed sweep
+
+def function_names(session, stack_name: str) -> Dict[str, str]:
+    resources = session.client("cloudformation").describe_stack_resources(StackName=stack_name)["StackResources"]
+    names = {}
+    for key, (prefix, _) in FUNCTIONS.items():
+        for resource in resources:
+            if resource["ResourceType"] == "AWS::Lambda::Function" and resource["LogicalResourceId"].startswith(prefix):
+                names[key] = resource["PhysicalResourceId"]
+    return names
+
+
+def parse_report(log_result: str) -> Dict[str, float]:
+    log = base64.b64decode(log_result).decode("utf-8", "replace")
+    report = {}
+    for field, pattern in REPORT_FIELDS.items():
+        found = re.search(pattern, log)
+        if found:
+            report[field] = float(found.group(1))
+    return report
+
+
+def copy_function(client, name: str) -> str:
+    """A copy of a deployed function (code, role, settings; no triggers) to reconfigure freely."""
+    function = client.get_function(FunctionName=name)
+    config = function["Configuration"]
+    copy = name[:64 - len(COPY_SUFFIX)] + COPY_SUFFIX
+    if "ImageUri" in function["Code"]:
+        code = {"ImageUri": function["Code"]["ImageUri"]}
+    else:
+        with urllib.request.urlopen(function["Code"]["Location"]) as response:
+            code = {"ZipFile": response.read()}
+    settings = dict(
+        FunctionName=copy, Role=config["Role"], Code=code, PackageType=config.get("PackageType", "Zip"),
+        Timeout=config["Timeout"], MemorySize=config["MemorySize"],
+        Environment={"Variables": config.get("Environment", {}).get("Variables", {})},
+        Architectures=config.get("Architectures", ["x86_64"]),
+        Layers=[layer["Arn"] for layer in config.get("Layers", [])],
+    )
+    if settings["PackageType"] == "Zip":
+        settings.update(Runtime=config["Runtime"], Handler=config["Handler"])
+    if config.get("SnapStart", {}).get("ApplyOn", "None") != "None":  # measure restores, as the live alias does
+        settings["SnapStart"] = {"ApplyOn": config["SnapStart"]["ApplyOn"]}
+    client.create_function(**settings)
+    client.get_waiter("function_active_v2").wait(FunctionName=copy)
+    return copy
+
+
+def sweep_deployed(session, name: str, event: dict, memory_sizes: List[int], invocations: int,
+                   cold_start_rate: float) -> List[dict]:
+    client = session.client("lambda")
+    copy = copy_function(client, name)
+    rows = []
+    try:
+        architecture = (client.get_function_configuration(FunctionName=copy).get("Architectures") or ["x86_64"])[0]
+        for memory_mb in memory_sizes:
+            # Each version starts with no warm environments, so its first call is a cold start
+            client.update_function_configuration(FunctionName=copy, MemorySize=memory_mb)
+            client.get_waiter("function_updated_v2").wait(FunctionName=copy)
+            version = client.publish_version(FunctionName=copy, Description=f"power sweep {memory_mb} MB")["Version"]
+            client.get_waiter("published_version_active").wait(FunctionName=copy, Qualifier=version)
+            durations, init_ms = [], 0.0
+            for _ in range(invocations):
+                response = client.invoke(FunctionName=copy, Qualifier=version, Payload=json.dumps(event).encode(),
+                                         LogType="Tail")
+                report = parse_report(response.get("LogResult", ""))
+                if "init" in report:
+                    init_ms = max(init_ms, report["init"])
+                    continue  # the cold call's duration includes first-use imports; keep warm calls only
+                if "duration" in report:
+                    durations.append(report["duration"])
+            if durations:
+                rows.append(summarise(memory_mb, durations, init_ms, messages_in(event), architecture, cold_start_rate))
+    finally:
+        client.delete_function(FunctionName=copy)  # and every version published from it
+    return rows
+
+
+# Local estimate
+
+MEASURE_INIT = """
+import importlib.util, json, sys, time
+wall, cpu = time.perf_counter(), time.process_time()
+spec = importlib.util.spec_from_file_location("handler", sys.argv[1])
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print(json.dumps({"wall": (time.perf_counter() - wall) * 1000, "cpu": (time.process_time() - cpu) * 1000}))
+"""
+
+
+def measure_init(path: Path, repeat: int = 3) -> Dict[str, float]:
+    env = dict(os.environ, ENVIRONMENT="lambda", PYTHONPATH=os.pathsep.join([
+        str(SERVICES_DIR / "common"), str(path.parent),
+    ]))
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", MEASURE_INIT, str(path)], env=env,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "wall": statistics.median(sample["wall"] for sample in samples),
+        "cpu": statistics.median(sample["cpu"] for sample in samples),
+    }
+
+
+def stretched(wall_ms: float, cpu_ms: float, memory_mb: int) -> float:
+    """Wall time at `memory_mb` if only the CPU-bound part slows down with a smaller CPU share."""
+    share = min(memory_mb / FULL_VCPU_MB, 1.0)
+    return cpu_ms / share + max(wall_ms - cpu_ms, 0.0)
+
+
+def measure_local(messages: int, model_latency: float, loop_latency: float) -> Dict[str, List[dict]]:
+    """Wall and CPU time of every invocation of each handler while the pipeline answers `messages` texts."""
+    from local_pipeline import LocalPipeline, run_load
+
+    samples = {key: [] for key in FUNCTIONS}
+
+    def timed(name, handler):
+        def wrapper(event, context):
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                return handler(event, context)
+            finally:
+                samples[name].append({
+                    "wall": (time.perf_counter() - wall) * 1000,
+                    "cpu": (time.thread_time() - cpu) * 1000,
+                    "messages": messages_in(event),
+                })
+        return wrapper
+
+    # One poller per stage and no worker threads, so each invocation's CPU is on the calling thread
+    pipeline = LocalPipeline(model_latency=model_latency, loop_latency=loop_latency, concurrency=1,
+                             batch_size=1, handler_wrapper=timed)
+    with contextlib.redirect_stdout(io.StringIO()), pipeline:
+        pipeline.warm_up()
+        deadline = time.monotonic() + 5
+        while not samples["sending"] and time.monotonic() < deadline:  # Loop can answer before the handler returns
+            time.sleep(0.01)
+        for key in samples:
+            samples[key] = [{**sample, "first": True} for sample in samples[key]]
+        run_load(pipeline, conversations=1, messages=messages)
+    return samples
+
+
+def sweep_local(key: str, samples: List[dict], init: Dict[str, float], memory_sizes: List[int],
+                cold_start_rate: float) -> List[dict]:
+    warm = [sample for sample in samples if not sample.get("first")]
+    first = [sample for sample in samples if sample.get("first")]
+    if not warm:
+        return []
+    messages = statistics.mean(sample["messages"] for sample in warm)
+    rows = []
+    for memory_mb in memory_sizes:
+        durations = [stretched(sample["wall"], sample["cpu"], memory_mb) for sample in warm]
+        # Lazy imports land in the first invocation, so count them as part of the cold start
+        init_ms = stretched(init["wall"], init["cpu"], memory_mb)
+        init_ms += sum(stretched(sample["wall"], sample["cpu"], memory_mb) for sample in first[:1])
+        rows.append(summarise(memory_mb, durations, init_ms, messages, "arm64", cold_start_rate))
+    return rows
+
+
+def write_recommendations(environment: str, recommendations: Dict[str, int], path: Path = APP_DIR / "cdk.json"):
+    config = json.loads(path.read_text())
+    memory_sizes = config["context"][environment].setdefault("MEMORY_SIZES", {})
+    memory_sizes.update(recommendations)
+    path.write_text(json.dumps(config, indent=2))
+
+
+def print_table(key: str, rows: List[dict], best: dict):
+    print(f"\n{key}")
+    print(f"  {'memory':>7} {'duration':>10} {'p95':>9} {'init':>9} {'$/1k msgs':>11}")
+    for row in rows:
+        marker = "  <- recommended" if row is best else ""
+        print(f"  {row['memory_mb']:>5}MB {row['duration_ms']:>8.1f}ms {row['p95_ms']:>7.1f}ms "
+              f"{row['init_ms']:>7.1f}ms {row['cost_per_1k_messages']:>11.6f}{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep Lambda memory settings for the Juneau functions")
+    parser.add_argument("mode", choices=["deployed", "local"])
+    parser.add_argument("--functions", nargs="+", default=list(FUNCTIONS), choices=list(FUNCTIONS))
+    parser.add_argument("--memory", nargs="+", type=int, default=DEFAULT_MEMORY_SIZES, help="memory sizes in MB")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown vs. the fastest setting")
+    parser.add_argument("--cold-start-rate", type=float, default=0.05, help="share of invocations that are cold")
+    parser.add_argument("--stack", default="JuneauAppStack", help="CloudFormation stack (deployed)")
+    parser.add_argument("--profile", help="AWS profile (deployed)")
+    parser.add_argument("--region", help="AWS region (deployed)")
+    parser.add_argument("--invocations", type=int, default=10, help="invocations per setting (deployed)")
+    parser.add_argument("--event", action="append", default=[], metavar="FUNCTION=PATH",
+                        help="event JSON to invoke a function with (deployed)")
+    parser.add_argument("--messages", type=int, default=10, help="texts to push through the pipeline (local)")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="fake model latency in seconds (local)")
+    parser.add_argument("--loop-latency", type=float, default=0.1, help="fake Loop latency in seconds (local)")
+    parser.add_argument("--write", action="store_true", help="store the recommendations in cdk.json")
+    parser.add_argument("--environment", default="development", help="cdk.json context block for --write")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results: Dict[str, dict] = {}
+    if args.mode == "deployed":
+        import boto3
+
+        session = boto3.session.Session(profile_name=args.profile, region_name=args.region)
+        names = function_names(session, args.stack)
+        events = dict(DEFAULT_EVENTS)
+        for option in args.event:
+            key, path = option.split("=", 1)
+            events[key] = json.loads(Path(path).read_text())
+        for key in args.functions:
+            if key not in names or key not in events:
+                print(f"Skipping {key}: {'not deployed' if key not in names else 'pass --event ' + key + '=<file>'}",
+                      file=sys.stderr)
+                continue
+            rows = sweep_deployed(session, names[key], events[key], args.memory, args.invocations,
+                                  args.cold_start_rate)
+            if rows:
+                results[key] = {"rows": rows}
+    else:
+        logging.disable(logging.INFO)  # the handlers log every step
+        samples = measure_local(args.messages, args.model_latency, args.loop_latency)
+        for key in args.functions:
+            rows = sweep_local(key, samples[key], measure_init(FUNCTIONS[key][1]), args.memory, args.cold_start_rate)
+            if rows:
+                results[key] = {"rows": rows}
+
+    for key, result in results.items():
+        result["recommended_mb"] = recommend(result["rows"], args.tolerance)["memory_mb"]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, result in results.items():
+            best = next(row for row in result["rows"] if row["memory_mb"] == result["recommended_mb"])
+            print_table(key, result["rows"], best)
+
+    if args.write and results:
+        write_recommendations(args.environment, {key: result["recommended_mb"] for key, result in results.items()})
+        print(f"\nWrote MEMORY_SIZES for {args.environment} to cdk.json", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
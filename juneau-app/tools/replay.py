@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Replay captured webhook traffic (WEBHOOK_CAPTURE=true, see receiving/capture.py)
+against a /loop endpoint at its original pace, N times faster, or as fast as possible.
+
+    # a local FastAPI receiver, twice as fast as it was captured
+    python tools/replay.py capture.jsonl --url http://localhost:5280/loop --speed 2
+    # the in-process pipeline from tools/local_pipeline.py, no pacing
+    python tools/replay.py capture.jsonl --local --speed 0
+
+The capture can be a file written through CAPTURE_PATH or an export of the receiver's
+CloudWatch log group; any line containing a {"juneau_capture": ...} record is used.
+Message and webhook ids get a per-run suffix so the receiver's dedupe doesn't drop
+the replay (use --keep-ids to exercise dedupe instead).
+
+Captured phone numbers are fake +1555 numbers, but a deployed stack will still try
+to answer them: replay against one whose sending lane points at a fake Loop API.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from local_pipeline import percentile  # noqa: E402
+
+MARKER = '{"juneau_capture"'
+
+
+def read_capture(path: str, limit: Optional[int] = None) -> List[Tuple[int, dict]]:
+    """(receive time in ms, payload) for every capture record in `path`, oldest first."""
+    records = []
+    with open(path, encoding="utf-8") as capture_file:
+        for line in capture_file:
+            start = line.find(MARKER)
+            if start < 0:
+                continue
+            try:
+                record = json.loads(line[start:])
+            except ValueError:
+                continue
+            records.append((int(record["t"]), record["payload"]))
+    records.sort(key=lambda record: record[0])
+    return records[:limit] if limit else records
+
+
+def prepare(payload: dict, run_id: Optional[str]) -> dict:
+    payload = dict(payload)
+    if run_id:
+        for field in ("message_id", "webhook_id"):
+            if field in payload:
+                payload[field] = f"{payload[field]}-{run_id}"
+    if isinstance(payload.get("attachments"), int):  # captures only keep the count
+        payload["attachments"] = [f"https://example.com/attachment-{index}.png"
+                                  for index in range(payload["attachments"])]
+    return payload
+
+
+class HttpTarget:
+    def __init__(self, url: str, token: str, concurrency: int, timeout: float):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def post(self, payload: dict) -> int:
+        return self.session.post(self.url, json=payload, timeout=self.timeout).status_code
+
+    def close(self):
+        self.session.close()
+
+
+class LocalTarget:
+    def __init__(self):
+        from local_pipeline import LocalPipeline
+
+        self.pipeline = LocalPipeline()
+        self.pipeline.start()
+
+    def post(self, payload: dict) -> int:
+        return self.pipeline.post_webhook(payload)["statusCode"]
+
+    def close(self):
+        self.pipeline.stop()
+
+
+def replay(records: List[Tuple[int, dict]], target, speed: float = 1.0, concurrency: int = 20,
+           run_id: Optional[str] = None) -> dict:
+    """
+    Send every record, keeping the captured gaps divided by `speed` (0: no pacing), and
+    report latency and errors per request.
+    """
+    latencies, lags = [], []
+    statuses, mix = Counter(), Counter()
+    lock = threading.Lock()
+
+    def send(due: float, payload: dict):
+        started = time.perf_counter()
+        try:
+            status = target.post(payload)
+        except Exception as e:
+            status = type(e).__name__
+        finished = time.perf_counter()
+        with lock:
+            latencies.append((finished - started) * 1000)
+            lags.append(max(0.0, started - due) * 1000)
+            statuses[status] += 1
+
+    if not records:
+        return {"requests": 0}
+    first = records[0][0]
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for captured_at, payload in records:
+            due = began + ((captured_at - first) / 1000 / speed if speed > 0 else 0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            mix[payload.get("alert_type", "unknown")] += 1
+            executor.submit(send, due, prepare(payload, run_id))
+    elapsed = time.perf_counter() - began
+
+    errors = sum(count for status, count in statuses.items() if not (isinstance(status, int) and status < 400))
+    captured_span = (records[-1][0] - first) / 1000
+    return {
+        "requests": len(records),
+        "errors": errors,
+        "error_rate": round(errors / len(records), 4),
+        "status_codes": {str(status): count for status, count in statuses.most_common()},
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 1),
+            "p95": round(percentile(latencies, 0.95), 1),
+            "p99": round(percentile(latencies, 0.99), 1),
+            "max": round(max(latencies), 1),
+        },
+        # How far sends fell behind schedule; large values mean the replay itself was the bottleneck
+        "max_lag_ms": round(max(lags), 1),
+        "elapsed_s": round(elapsed, 3),
+        "captured_span_s": round(captured_span, 3),
+        "achieved_rate_per_s": round(len(records) / elapsed, 2) if elapsed else None,
+        "alert_types": dict(mix.most_common()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured Loop webhooks")
+    parser.add_argument("capture", help="JSONL capture file or CloudWatch Logs export")
+    parser.add_argument("--url", default="http://localhost:5280/loop", help="/loop endpoint to send to")
+    parser.add_argument("--local", action="store_true", help="send to the in-process pipeline instead of --url")
+    parser.add_argument("--token", default=os.getenv("LOOP_BEARER_TOKEN", ""), help="bearer token for --url")
+    parser.add_argument("--speed", type=float, default=1.0, help="1: captured pace, N: N times faster, 0: no pacing")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at most")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds per request (--url only)")
+    parser.add_argument("--limit", type=int, help="replay only the first N webhooks")
+    parser.add_argument("--keep-ids", action="store_true", help="reuse the captured ids, so repeats are deduped")
+    args = parser.parse_args()
+
+    records = read_capture(args.capture, args.limit)
+    # The in-process handlers print every step; keep that out of the report
+    quiet = contextlib.redirect_stdout(io.StringIO()) if args.local else contextlib.nullcontext()
+    with quiet:
+        target = LocalTarget() if args.local else HttpTarget(args.url, args.token, args.concurrency, args.timeout)
+        try:
+            run_id = None if args.keep_ids else uuid.uuid4().hex[:8]
+            report = replay(records, target, speed=args.speed, concurrency=args.concurrency, run_id=run_id)
+        finally:
+            target.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()